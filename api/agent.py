@@ -0,0 +1,78 @@
+import logging
+import threading
+from typing import List, Optional
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+
+from api.models import WorkerNode
+from api.tasks import reroute_test_run_requests
+
+
+logger = logging.getLogger(__name__)
+_agent = None
+
+
+class NodeAgent:
+    """Registers the node of a worker when it starts and keeps it alive with heartbeats from a thread of the main
+    worker process, which never runs tests itself.
+
+    A node found dead, e.g. after a long pause of the process, registers again and gets envs assigned back.
+    """
+
+    def __init__(self, name: str, capacity: int, env_names: List[str]):
+        self.name = name
+        self.capacity = capacity
+        self.env_names = env_names
+        self.node: Optional[WorkerNode] = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def register(self) -> None:
+        self.node = WorkerNode.register(self.name, self.capacity, self.env_names)
+        envs = ', '.join(env.name for env in self.node.assigned_envs.order_by('name')) or 'none yet'
+        logger.info(f'Worker node {self.name} registered, consuming {self.node.get_queue()}, envs: {envs}')
+
+    def start(self) -> None:
+        self.register()
+        self._thread = threading.Thread(target=self._run, name=f'node-agent-{self.name}', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(settings.TEST_WORKER_NODE_HEARTBEAT_SECONDS):
+            close_old_connections()
+            try:
+                if not self.node.heartbeat():
+                    logger.warning(f'Worker node {self.name} was found dead, registering again.')
+                    self.register()
+            except DatabaseError as e:
+                #  retried at the next heartbeat, the node is only found dead after TEST_WORKER_NODE_TIMEOUT_SECONDS
+                logger.warning(f'Heartbeat of worker node {self.name} failed: {e}')
+
+    def stop(self) -> None:
+        """Leaves the cluster right away instead of waiting for the timeout, its envs and queued runs move to the
+        other nodes."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        close_old_connections()
+        if self.node is not None and self.node.deregister():
+            WorkerNode.balance()
+            reroute_test_run_requests([self.node])
+            logger.info(f'Worker node {self.name} left.')
+
+
+def start_agent(concurrency: int) -> NodeAgent:
+    global _agent
+    _agent = NodeAgent(
+        settings.TEST_WORKER_NODE, settings.TEST_WORKER_NODE_CAPACITY or concurrency, settings.TEST_WORKER_NODE_ENVS
+    )
+    _agent.start()
+    return _agent
+
+
+def stop_agent() -> None:
+    global _agent
+    if _agent is not None:
+        _agent.stop()
+        _agent = None
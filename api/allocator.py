@@ -0,0 +1,115 @@
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import redis
+from django.conf import settings
+
+
+#  pool of the requests which can run on any env, every env is part of it
+ANY_POOL = '*'
+_free_list = None
+_free_list_lock = threading.Lock()
+
+
+def get_pools(env_pool: str) -> List[str]:
+    return [ANY_POOL] + ([env_pool] if env_pool else [])
+
+
+class BaseFreeList:
+    """Ids of the idle envs of each pool, so that an idle env is found in O(1).
+
+    It is only a hint kept in sync by the env lease updates, the lease in the database stays the source of truth:
+    a popped env still has to be locked, and an empty free list is double checked against the database.
+    """
+
+    def add(self, env_id: int, env_pool: str) -> None:
+        raise NotImplementedError
+
+    def remove(self, env_id: int, env_pool: str) -> None:
+        raise NotImplementedError
+
+    def pop(self, pool: str) -> Optional[int]:
+        raise NotImplementedError
+
+    def rebuild(self, envs: Iterable[Tuple[int, str]]) -> None:
+        raise NotImplementedError
+
+
+class MemoryFreeList(BaseFreeList):
+    """Keeps the free list in the process, for development and tests where everything runs in a single process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools: Dict[str, Set[int]] = {}
+
+    def add(self, env_id, env_pool):
+        with self._lock:
+            for pool in get_pools(env_pool):
+                self._pools.setdefault(pool, set()).add(env_id)
+
+    def remove(self, env_id, env_pool):
+        with self._lock:
+            for pool in get_pools(env_pool):
+                self._pools.get(pool, set()).discard(env_id)
+
+    def pop(self, pool):
+        with self._lock:
+            env_ids = self._pools.get(pool)
+            return env_ids.pop() if env_ids else None
+
+    def rebuild(self, envs):
+        pools = {}
+        for env_id, env_pool in envs:
+            for pool in get_pools(env_pool):
+                pools.setdefault(pool, set()).add(env_id)
+        with self._lock:
+            self._pools = pools
+
+
+class RedisFreeList(BaseFreeList):
+    """Keeps the free list in Redis sets, shared by all the workers."""
+
+    def __init__(self, url: str, prefix: str = 'test-env:free'):
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def _key(self, pool: str) -> str:
+        return f'{self._prefix}:{pool}'
+
+    def add(self, env_id, env_pool):
+        pipeline = self._client.pipeline()
+        for pool in get_pools(env_pool):
+            pipeline.sadd(self._key(pool), env_id)
+        pipeline.execute()
+
+    def remove(self, env_id, env_pool):
+        pipeline = self._client.pipeline()
+        for pool in get_pools(env_pool):
+            pipeline.srem(self._key(pool), env_id)
+        pipeline.execute()
+
+    def pop(self, pool):
+        env_id = self._client.spop(self._key(pool))
+        return int(env_id) if env_id is not None else None
+
+    def rebuild(self, envs):
+        pools = {}
+        for env_id, env_pool in envs:
+            for pool in get_pools(env_pool):
+                pools.setdefault(pool, []).append(env_id)
+        pipeline = self._client.pipeline()
+        pipeline.delete(*[key for key in self._client.scan_iter(self._key('*'))] or [self._key(ANY_POOL)])
+        for pool, env_ids in pools.items():
+            pipeline.sadd(self._key(pool), *env_ids)
+        pipeline.execute()
+
+
+def get_free_list() -> BaseFreeList:
+    global _free_list
+    with _free_list_lock:
+        if _free_list is None:
+            if settings.TEST_ENV_ALLOCATOR_REDIS_URL:
+                _free_list = RedisFreeList(settings.TEST_ENV_ALLOCATOR_REDIS_URL)
+            else:
+                _free_list = MemoryFreeList()
+        return _free_list
@@ -3,3 +3,13 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        from django.db import connections
+        from django.db.backends.signals import connection_created
+
+        from api.db import install_query_counter
+
+        connection_created.connect(install_query_counter)
+        for connection in connections.all(initialized_only=True):
+            install_query_counter(connection)
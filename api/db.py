@@ -0,0 +1,86 @@
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.core.signals import request_finished
+from django.db import close_old_connections, connection, connections
+
+
+#  set by the middleware of an async request, counts the queries the request runs in the pool, or in the thread
+#  Django runs its sync code in, see count_queries
+query_counter = contextvars.ContextVar('query_counter', default=None)
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+class QueryCounter:
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started_at
+
+
+def count_queries(execute, sql, params, many, context):
+    #  installed on every connection, the context variable is copied into the thread running a sync view under ASGI
+    counter = query_counter.get()
+    if counter is None:
+        return execute(sql, params, many, context)
+    return counter(execute, sql, params, many, context)
+
+
+def install_query_counter(connection, **kwargs) -> None:
+    if count_queries not in connection.execute_wrappers:
+        #  first, a connection made inside `execute_wrapper()` would otherwise lose it instead of the wrapper it pops
+        connection.execute_wrappers.insert(0, count_queries)
+
+
+def close_request_connections(**kwargs) -> None:
+    #  under ASGI, a thread running the sync code of a request never serves another one, its connections are useless
+    connections.close_all()
+
+
+def start_db_pool(size: int) -> None:
+    """Starts the threads running the database work of the async views, each one keeping its connection open.
+
+    Under ASGI, Django runs the sync code of every request in a new thread with a new connection. The pool bounds
+    the number of connections of the process to `size`, whatever the number of concurrent requests, and the
+    connections of the other requests are closed as soon as they finish.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None and size > 0:
+            _executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='db-pool')
+            request_finished.connect(close_request_connections)
+
+
+def _run_with_connection(counter, func, *args, **kwargs):
+    #  like Django does between requests: drops the connection once older than CONN_MAX_AGE or broken, and makes the
+    #  first query check it if CONN_HEALTH_CHECKS is set
+    close_old_connections()
+    with connection.execute_wrapper(counter) if counter is not None else nullcontext():
+        return func(*args, **kwargs)
+
+
+async def run_db(func, *args, **kwargs):
+    """Runs sync database code from async code, in the pool if it was started, e.g. by ionos.asgi. Otherwise, e.g.
+    under WSGI or in the tests, the code runs in the calling thread like Django's sync_to_async."""
+    if _executor is None:
+        return await sync_to_async(func)(*args, **kwargs)
+    #  not in a copy of the caller's context, the connections of the thread would be those of the caller
+    return await asyncio.get_running_loop().run_in_executor(
+        _executor, partial(_run_with_connection, query_counter.get(), func, *args, **kwargs)
+    )
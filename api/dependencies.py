@@ -0,0 +1,109 @@
+import ast
+import os
+from typing import Iterable, Iterator, List, Optional, Set
+
+from django.conf import settings
+
+
+def get_import_roots(filename: str) -> List[str]:
+    #  pytest puts the directory of the test, or of its top package, in sys.path, any ancestor up to BASE_DIR may be one
+    roots = []
+    directory = os.path.dirname(os.path.abspath(filename))
+    while True:
+        roots.append(directory)
+        if directory == settings.BASE_DIR or os.path.dirname(directory) == directory:
+            break
+        directory = os.path.dirname(directory)
+    return roots if settings.BASE_DIR in roots else roots + [settings.BASE_DIR]
+
+
+def resolve_module(module: str, roots: List[str]) -> Optional[str]:
+    for root in roots:
+        path = os.path.join(root, *module.split('.'))
+        for filename in (path + '.py', os.path.join(path, '__init__.py')):
+            if os.path.isfile(filename):
+                return filename
+    return None
+
+
+def iter_imported_modules(filename: str) -> Iterator[tuple]:
+    """Yields (module, roots) of the imports of a file, the roots being the directories the module is searched in."""
+    try:
+        with open(filename, 'rb') as f:
+            tree = ast.parse(f.read())
+    except (OSError, SyntaxError, ValueError):
+        return
+    roots = get_import_roots(filename)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                yield alias.name, roots
+        elif isinstance(node, ast.ImportFrom):
+            module_roots = roots
+            if node.level:
+                package = os.path.dirname(os.path.abspath(filename))
+                for _ in range(node.level - 1):
+                    package = os.path.dirname(package)
+                module_roots = [package]
+            if node.module:
+                yield node.module, module_roots
+            #  `from package import name` may import a submodule
+            for alias in node.names:
+                yield '.'.join(filter(None, [node.module, alias.name])), module_roots
+
+
+def get_conftests(filename: str) -> List[str]:
+    conftests = [os.path.join(root, 'conftest.py') for root in get_import_roots(filename)]
+    return [conftest for conftest in conftests if os.path.isfile(conftest)]
+
+
+def get_dependencies(filenames: List[str]) -> Set[str]:
+    """Returns the files, the local modules they import recursively and the conftest files applying to them."""
+    dependencies = set()
+    pending = [os.path.abspath(filename) for filename in filenames]
+    while pending:
+        filename = pending.pop()
+        if filename in dependencies:
+            continue
+        dependencies.add(filename)
+        pending.extend(get_conftests(filename))
+        for module, roots in iter_imported_modules(filename):
+            module_filename = resolve_module(module, roots)
+            if module_filename is not None:
+                pending.append(module_filename)
+    return dependencies
+
+
+def get_path_dependencies(path: str) -> List[str]:
+    """Returns the dependencies of a test file, relative to BASE_DIR like the TestFilePath paths."""
+    dependencies = get_dependencies([os.path.join(settings.BASE_DIR, path)])
+    return sorted(os.path.relpath(dependency, settings.BASE_DIR) for dependency in dependencies)
+
+
+def is_modified_since(paths: Iterable[str], timestamp: float) -> bool:
+    for path in paths:
+        try:
+            if os.stat(os.path.join(settings.BASE_DIR, path)).st_mtime > timestamp:
+                return True
+        except OSError:
+            return True
+    return False
+
+
+def select_affected_paths(test_file_paths, changed_files: List[str]) -> Optional[List[str]]:
+    """Returns the paths of the test files depending on one of the changed files.
+
+    None is returned when the dependency map can't tell: a test file was never mapped, or a file it depends on was
+    modified after the mapping, and may import new files since.
+    """
+    changed = {os.path.normpath(changed_file) for changed_file in changed_files}
+    selected = []
+    for test_file_path in test_file_paths:
+        if test_file_path.dependencies_updated_at is None:
+            return None
+        dependencies = set(test_file_path.dependencies)
+        if dependencies & changed:
+            selected.append(test_file_path.path)
+        elif is_modified_since(dependencies, test_file_path.dependencies_updated_at.timestamp()):
+            return None
+    return selected
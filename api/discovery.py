@@ -0,0 +1,113 @@
+import ast
+import logging
+import os
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from api.models import TestFilePath
+from api.usecases import invalidate_assets
+
+
+logger = logging.getLogger(__name__)
+DISCOVERY_STATE_CACHE_KEY = 'test-discovery:state'
+IGNORED_DIRS = ('__pycache__', )
+
+
+def is_test_file(filename: str) -> bool:
+    return filename.endswith('.py') and filename != '__init__.py'
+
+
+def get_test_names(source: str) -> List[str]:
+    """Returns the test functions of a module, as `function` or `Class::method` like in pytest node ids."""
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return []
+    names = []
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name.startswith('test'):
+            names.append(node.name)
+        elif isinstance(node, ast.ClassDef) and node.name.startswith('Test'):
+            names.extend(
+                f'{node.name}::{item.name}' for item in node.body
+                if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)) and item.name.startswith('test')
+            )
+    return names
+
+
+def _scan_dir(path: str, dirs: Dict[str, dict], scanned_dirs: Dict[str, dict]) -> List[str]:
+    #  the listing of a directory only changes with its mtime, so unchanged directories are not listed again
+    mtime = os.stat(path).st_mtime_ns
+    listing = dirs.get(path)
+    if listing is None or listing['mtime'] != mtime:
+        listing = {'mtime': mtime, 'files': [], 'dirs': []}
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if entry.name not in IGNORED_DIRS and not entry.name.startswith('.'):
+                        listing['dirs'].append(entry.name)
+                elif is_test_file(entry.name):
+                    listing['files'].append(entry.name)
+    scanned_dirs[path] = listing
+
+    files = [os.path.join(path, filename) for filename in listing['files']]
+    for dirname in listing['dirs']:
+        files.extend(_scan_dir(os.path.join(path, dirname), dirs, scanned_dirs))
+    return files
+
+
+def _get_mtime(filename: str) -> Optional[int]:
+    if not settings.TEST_DISCOVERY_INDEX_TESTS:
+        return None
+    return os.stat(filename).st_mtime_ns
+
+
+def sync_test_file_paths() -> bool:
+    """Upserts TestFilePath rows to match the test files under TEST_BASE_DIRS. Rows of removed files are only marked
+    as removed, the past runs keep their paths.
+
+    Returns whether anything changed, in which case the cached assets are invalidated.
+    """
+    state = cache.get(DISCOVERY_STATE_CACHE_KEY)
+    if state is None:
+        #  no state yet, compare with what is in the database
+        state = {'dirs': {}, 'files': dict(TestFilePath.get_available().values_list('path', 'mtime'))}
+
+    scanned_dirs = {}
+    files = {}
+    for base_dir in settings.TEST_BASE_DIRS:
+        if not os.path.isdir(base_dir):
+            continue
+        for filename in _scan_dir(base_dir, state['dirs'], scanned_dirs):
+            files[os.path.relpath(filename, settings.BASE_DIR)] = _get_mtime(filename)
+
+    added = [path for path in files if path not in state['files']]
+    removed = [path for path in state['files'] if path not in files]
+    modified = [path for path in files if path in state['files'] and files[path] != state['files'][path]]
+    if added or removed or modified:
+        TestFilePath.objects.filter(path__in=removed).update(removed_at=timezone.now())
+        #  files found again get their row back, and a path inserted by a concurrent discovery is skipped
+        TestFilePath.objects.filter(path__in=added, removed_at__isnull=False).update(removed_at=None)
+        TestFilePath.objects.bulk_create([TestFilePath(path=path) for path in added], ignore_conflicts=True)
+        _index_tests(added + modified, files)
+        invalidate_assets()
+        logger.info(f'Test files discovered, added: {len(added)}, removed: {len(removed)}, modified: {len(modified)}')
+    cache.set(DISCOVERY_STATE_CACHE_KEY, {'dirs': scanned_dirs, 'files': files}, None)
+    return bool(added or removed or modified)
+
+
+def _index_tests(paths: List[str], files: Dict[str, Optional[int]]) -> None:
+    if not settings.TEST_DISCOVERY_INDEX_TESTS or not paths:
+        return
+    test_file_paths = list(TestFilePath.objects.filter(path__in=paths))
+    for test_file_path in test_file_paths:
+        try:
+            with open(os.path.join(settings.BASE_DIR, test_file_path.path)) as f:
+                test_file_path.tests = get_test_names(f.read())
+        except (OSError, UnicodeDecodeError):
+            test_file_path.tests = []
+        test_file_path.mtime = files[test_file_path.path]
+    TestFilePath.objects.bulk_update(test_file_paths, ['tests', 'mtime'])
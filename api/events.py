@@ -0,0 +1,97 @@
+import json
+import logging
+from typing import AsyncIterator, List, Optional, Tuple
+
+import redis
+import redis.asyncio
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+TEST_RUN_EVENTS_STREAM = 'test-run:events'
+_client = None
+
+
+def get_stream_name(request_id: Optional[int] = None) -> str:
+    if request_id is None:
+        return TEST_RUN_EVENTS_STREAM
+    return f'test-run:{request_id}:events'
+
+
+def get_redis_client() -> Optional[redis.Redis]:
+    global _client
+    if not settings.TEST_RUN_EVENTS_REDIS_URL:
+        return None
+    if _client is None:
+        _client = redis.Redis.from_url(settings.TEST_RUN_EVENTS_REDIS_URL)
+    return _client
+
+
+def publish_events(events: List[Tuple[int, str, dict, bool]]) -> None:
+    """Appends (request id, type, data, broadcast) events to the stream of their request, and to the stream of all
+    requests if broadcast is set, in a single round trip.
+
+    Events are best effort, a failing Redis never fails the caller.
+    """
+    client = get_redis_client()
+    if client is None or not events:
+        return
+    try:
+        pipeline = client.pipeline(transaction=False)
+        for request_id, event_type, data, broadcast in events:
+            fields = {'type': event_type, 'data': json.dumps(data)}
+            streams = [get_stream_name(request_id)] + ([get_stream_name()] if broadcast else [])
+            for stream in streams:
+                pipeline.xadd(stream, fields, maxlen=settings.TEST_RUN_EVENTS_MAX_LENGTH, approximate=True)
+            pipeline.expire(get_stream_name(request_id), settings.TEST_RUN_EVENTS_TTL_SECONDS)
+        pipeline.execute()
+    except redis.RedisError as e:
+        logger.warning(f'Failed to publish {len(events)} events of tests(ID:{events[0][0]}): {e}')
+
+
+def publish_event(request_id: int, event_type: str, data: dict, broadcast: bool = False) -> None:
+    publish_events([(request_id, event_type, data, broadcast)])
+
+
+def publish_status(instance) -> None:
+    publish_event(instance.id, 'status', {'id': instance.id, 'status': instance.status}, broadcast=True)
+
+
+def publish_statuses(instances) -> None:
+    publish_events([
+        (instance.id, 'status', {'id': instance.id, 'status': instance.status}, True) for instance in instances
+    ])
+
+
+def publish_logs(request_id: int, offset: int, logs: str) -> None:
+    publish_event(request_id, 'logs', {'id': request_id, 'offset': offset, 'logs': logs})
+
+
+def format_event(event_id: str, event_type: str, data: str) -> str:
+    return f'id: {event_id}\nevent: {event_type}\ndata: {data}\n\n'
+
+
+async def iter_events(stream: str, last_event_id: str) -> AsyncIterator[str]:
+    """Yields server-sent events of the stream, starting after `last_event_id`.
+
+    A comment line is sent when nothing happened for a while, to keep the connection open.
+    """
+    client = redis.asyncio.Redis.from_url(settings.TEST_RUN_EVENTS_REDIS_URL)
+    try:
+        if last_event_id == '$':
+            #  pin the position, so that no event is lost between two reads
+            latest = await client.xrevrange(stream, count=1)
+            last_event_id = latest[0][0].decode() if latest else '0'
+        while True:
+            response = await client.xread(
+                {stream: last_event_id}, count=100, block=settings.TEST_RUN_EVENTS_KEEPALIVE_SECONDS * 1000
+            )
+            if not response:
+                yield ': keepalive\n\n'
+                continue
+            for _, events in response:
+                for event_id, fields in events:
+                    last_event_id = event_id.decode()
+                    yield format_event(last_event_id, fields[b'type'].decode(), fields[b'data'].decode())
+    finally:
+        await client.close()
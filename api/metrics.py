@@ -0,0 +1,190 @@
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import redis
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 1800, 3600)
+BYTES_BUCKETS = tuple(1024 * 4 ** power for power in range(10))
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+#  name -> (type, help, buckets of the histograms)
+METRICS = {
+    'ionos_test_run_queue_depth': ('gauge', 'Pending test runs per env, or per pool for the runs on any env.', None),
+    'ionos_test_run_queue_wait_seconds': (
+        'histogram', 'Time from the creation to the start of a run.', SECONDS_BUCKETS
+    ),
+    'ionos_test_run_retrying_seconds': (
+        'histogram', 'Time a run spent RETRYING, waiting for a busy env, before starting.', SECONDS_BUCKETS
+    ),
+    'ionos_test_run_process_seconds': (
+        'histogram', 'Time from starting the test processes of a run to their exit.', SECONDS_BUCKETS
+    ),
+    'ionos_test_run_log_bytes': ('histogram', 'Size of the logs of a run.', BYTES_BUCKETS),
+    'ionos_test_env_lock_seconds': ('histogram', 'Time to lock or unlock an env.', SECONDS_BUCKETS),
+    'ionos_http_request_seconds': ('histogram', 'Time to serve an API request.', SECONDS_BUCKETS),
+    'ionos_http_db_queries': ('histogram', 'Database queries per API request.', COUNT_BUCKETS),
+    'ionos_http_db_query_seconds': ('histogram', 'Time spent in database queries per API request.', SECONDS_BUCKETS),
+    'ionos_celery_task_seconds': ('histogram', 'Time to run a celery task.', SECONDS_BUCKETS),
+}
+_metrics = None
+_metrics_lock = threading.Lock()
+
+#  (series name, sorted labels, upper bound index of a histogram bucket or None)
+SeriesKey = Tuple[str, Tuple[Tuple[str, str], ...], Optional[int]]
+
+
+def get_labels(labels: dict) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class BaseMetrics:
+    """Counters and histograms of the hot paths, aggregated in the process under a lock.
+
+    A histogram observation adds to a single bucket, the buckets are only made cumulative when they are rendered.
+    Subclasses decide where the values are collected from.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[SeriesKey, float] = {}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values = {}
+
+    def _add(self, deltas: Iterable[Tuple[SeriesKey, float]]) -> None:
+        with self._lock:
+            for key, delta in deltas:
+                self._values[key] = self._values.get(key, 0) + delta
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        self._add([((name, get_labels(labels), None), value)])
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        buckets = METRICS[name][2]
+        labels = get_labels(labels)
+        self._add([
+            ((f'{name}_bucket', labels, bisect_left(buckets, value)), 1),
+            ((f'{name}_sum', labels, None), value),
+            ((f'{name}_count', labels, None), 1),
+        ])
+
+    def observe_since(self, name: str, started_at: float, **labels) -> None:
+        #  `started_at` comes from time.perf_counter()
+        self.observe(name, time.perf_counter() - started_at, **labels)
+
+    def flush(self) -> None:
+        pass
+
+    def collect(self) -> Dict[SeriesKey, float]:
+        raise NotImplementedError
+
+
+class MemoryMetrics(BaseMetrics):
+    """Keeps the metrics in the process, for development and tests where everything runs in a single process."""
+
+    def collect(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class RedisMetrics(BaseMetrics):
+    """Adds the metrics of every web and worker process to a Redis hash.
+
+    Updates are buffered in the process and sent in a single round trip every `TEST_RUN_METRICS_FLUSH_SECONDS`, so
+    that the hot paths never wait for Redis. Metrics are best effort, a failing Redis drops the buffered updates.
+    """
+
+    def __init__(self, url: str, key: str = 'metrics'):
+        super().__init__()
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self._key = key
+        self._flush_at = time.monotonic() + settings.TEST_RUN_METRICS_FLUSH_SECONDS
+
+    def clear(self) -> None:
+        super().clear()
+        self._client.delete(self._key)
+
+    def _add(self, deltas):
+        super()._add(deltas)
+        if time.monotonic() >= self._flush_at:
+            self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            values, self._values = self._values, {}
+            self._flush_at = time.monotonic() + settings.TEST_RUN_METRICS_FLUSH_SECONDS
+        if not values:
+            return
+        try:
+            pipeline = self._client.pipeline(transaction=False)
+            for key, delta in values.items():
+                pipeline.hincrbyfloat(self._key, json.dumps(key), delta)
+            pipeline.execute()
+        except redis.RedisError as e:
+            logger.warning(f'Failed to flush {len(values)} metrics: {e}')
+
+    def collect(self):
+        self.flush()
+        values = {}
+        for field, value in self._client.hgetall(self._key).items():
+            name, labels, bucket = json.loads(field)
+            values[(name, tuple(tuple(label) for label in labels), bucket)] = float(value)
+        return values
+
+
+def get_metrics() -> BaseMetrics:
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            if settings.TEST_RUN_METRICS_REDIS_URL:
+                _metrics = RedisMetrics(settings.TEST_RUN_METRICS_REDIS_URL)
+            else:
+                _metrics = MemoryMetrics()
+        return _metrics
+
+
+def format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    escaped = (
+        (name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in labels
+    )
+    labels = ','.join(f'{name}="{value}"' for name, value in escaped)
+    return f'{{{labels}}}' if labels else ''
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render_metrics(values: Dict[SeriesKey, float]) -> str:
+    """Renders the values in the Prometheus text format, histogram buckets cumulated up to +Inf."""
+    series = {}
+    for (name, labels, bucket), value in values.items():
+        for metric in (name, name.rsplit('_', 1)[0]):
+            if metric in METRICS:
+                series.setdefault(metric, {}).setdefault(labels, {})[name, bucket] = value
+                break
+    lines: List[str] = []
+    for metric in sorted(series):
+        metric_type, help_text, buckets = METRICS[metric]
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {metric_type}')
+        for labels, label_values in sorted(series[metric].items()):
+            if metric_type != 'histogram':
+                lines.append(f'{metric}{format_labels(labels)} {format_value(label_values[metric, None])}')
+                continue
+            count = 0
+            for index, upper_bound in enumerate(buckets + ('+Inf', )):
+                count += label_values.get((f'{metric}_bucket', index), 0)
+                bucket_labels = format_labels(labels + (('le', str(upper_bound)), ))
+                lines.append(f'{metric}_bucket{bucket_labels} {format_value(count)}')
+            for suffix in ('_sum', '_count'):
+                value = label_values.get((f'{metric}{suffix}', None), 0)
+                lines.append(f'{metric}{suffix}{format_labels(labels)} {format_value(value)}')
+    return '\n'.join(lines) + '\n'
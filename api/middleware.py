@@ -0,0 +1,57 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connection
+
+from api.db import QueryCounter, query_counter
+from api.metrics import get_metrics
+
+
+def get_view_name(request) -> str:
+    #  the url name keeps the number of series bounded, unlike the path
+    match = request.resolver_match
+    return (match.url_name or match.view_name) if match is not None else 'unmatched'
+
+
+class MetricsMiddleware:
+    """Records the latency and the database queries of each request, per view, method and status code.
+
+    Under ASGI, the queries are counted through `api.db.query_counter`, whether the view is async and runs them
+    through `api.db.run_db` or is sync and runs in a thread of Django.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        queries = QueryCounter()
+        started_at = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        self.record(request, response, started_at, queries)
+        return response
+
+    async def __acall__(self, request):
+        queries = QueryCounter()
+        token = query_counter.set(queries)
+        started_at = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            query_counter.reset(token)
+        self.record(request, response, started_at, queries)
+        return response
+
+    @staticmethod
+    def record(request, response, started_at, queries):
+        labels = {'view': get_view_name(request), 'method': request.method, 'status': response.status_code}
+        metrics = get_metrics()
+        metrics.observe_since('ionos_http_request_seconds', started_at, **labels)
+        metrics.observe('ionos_http_db_queries', queries.count, **labels)
+        metrics.observe('ionos_http_db_query_seconds', queries.seconds, **labels)
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-17 17:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_auto_20200706_1208'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testenvironment',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='testenvironment',
+            name='lease_owner',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
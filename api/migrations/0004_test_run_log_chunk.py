@@ -0,0 +1,63 @@
+# Generated by Django 4.2.30 on 2026-10-17 17:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def move_logs_to_chunks(apps, _):
+    TestRunRequest = apps.get_model('api', 'TestRunRequest')
+    TestRunLogChunk = apps.get_model('api', 'TestRunLogChunk')
+    for request in TestRunRequest.objects.exclude(logs='').only('id', 'logs').iterator():
+        TestRunLogChunk.objects.create(request_id=request.id, sequence=0, offset=0, data=request.logs)
+        TestRunRequest.objects.filter(id=request.id).update(log_size=len(request.logs), log_chunk_count=1)
+
+
+def move_chunks_to_logs(apps, _):
+    TestRunRequest = apps.get_model('api', 'TestRunRequest')
+    TestRunLogChunk = apps.get_model('api', 'TestRunLogChunk')
+    for request in TestRunRequest.objects.filter(log_chunk_count__gt=0).only('id').iterator():
+        chunks = TestRunLogChunk.objects.filter(request_id=request.id).order_by('sequence')
+        TestRunRequest.objects.filter(id=request.id).update(logs=''.join(chunks.values_list('data', flat=True)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_test_environment_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testrunrequest',
+            name='log_chunk_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='testrunrequest',
+            name='log_size',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='TestRunLogChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.PositiveIntegerField()),
+                ('offset', models.PositiveBigIntegerField()),
+                ('data', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='date created')),
+                ('request', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='log_chunks', to='api.testrunrequest')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['request', 'offset'], name='log_chunk_offset_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='testrunlogchunk',
+            constraint=models.UniqueConstraint(fields=('request', 'sequence'), name='unique_log_chunk_sequence'),
+        ),
+        migrations.RunPython(move_logs_to_chunks, reverse_code=move_chunks_to_logs),
+        migrations.RemoveField(
+            model_name='testrunrequest',
+            name='logs',
+        ),
+    ]
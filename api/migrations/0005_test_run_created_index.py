@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-17 17:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_test_run_log_chunk'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='testrunrequest',
+            index=models.Index(fields=['-created_at', '-id'], name='test_run_created_idx'),
+        ),
+    ]
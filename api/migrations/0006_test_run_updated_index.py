@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-17 17:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_test_run_created_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='testrunrequest',
+            index=models.Index(fields=['updated_at', 'id'], name='test_run_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-17 17:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_test_run_updated_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testfilepath',
+            name='duration',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='testrunrequest',
+            name='parallelism',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+    ]
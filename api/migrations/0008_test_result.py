@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-17 17:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_test_run_parallelism'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TestResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nodeid', models.CharField(max_length=1024)),
+                ('outcome', models.CharField(choices=[('PASSED', 'PASSED'), ('FAILED', 'FAILED'), ('ERROR', 'ERROR'), ('SKIPPED', 'SKIPPED')], max_length=16)),
+                ('duration', models.FloatField()),
+                ('message', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='date created')),
+                ('path', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='results', to='api.testfilepath')),
+                ('request', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='api.testrunrequest')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['nodeid', '-created_at'], name='test_result_nodeid_idx'), models.Index(fields=['created_at'], name='test_result_created_idx')],
+            },
+        ),
+    ]
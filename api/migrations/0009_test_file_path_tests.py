@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-17 17:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_test_result'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testfilepath',
+            name='mtime',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='testfilepath',
+            name='tests',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
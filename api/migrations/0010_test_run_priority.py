@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 17:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_test_file_path_tests'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testrunrequest',
+            name='priority',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
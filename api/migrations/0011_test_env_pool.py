@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-17 17:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_test_run_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testenvironment',
+            name='pool',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='testrunrequest',
+            name='pool',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='testrunrequest',
+            name='env',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='api.testenvironment'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-17 17:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_test_env_pool'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testrunrequest',
+            name='cached_from',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.testrunrequest'),
+        ),
+        migrations.AddField(
+            model_name='testrunrequest',
+            name='use_cache',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='TestRunCacheEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('used_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('request', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cache_entries', to='api.testrunrequest')),
+            ],
+        ),
+    ]
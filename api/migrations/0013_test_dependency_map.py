@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-17 17:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_test_run_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testfilepath',
+            name='dependencies',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='testfilepath',
+            name='dependencies_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='testrunrequest',
+            name='changed_files',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_test_dependency_map'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TestRunCompressedLog',
+            fields=[
+                ('request', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='api.testrunrequest')),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='date created')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='testrunrequest',
+            name='log_archive',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='testrunrequest',
+            name='log_tier',
+            field=models.CharField(choices=[('CHUNKS', 'CHUNKS'), ('COMPRESSED', 'COMPRESSED'), ('ARCHIVED', 'ARCHIVED'), ('PURGED', 'PURGED')], default='CHUNKS', max_length=16),
+        ),
+        migrations.AddIndex(
+            model_name='testrunrequest',
+            index=models.Index(fields=['log_tier', 'updated_at'], name='test_run_log_tier_idx'),
+        ),
+    ]
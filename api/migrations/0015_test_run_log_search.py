@@ -0,0 +1,28 @@
+from django.db import migrations
+
+
+def create_trigram_index(apps, schema_editor):
+    #  Django looks `icontains` up with UPPER(data) LIKE UPPER(%s), the index has to be on the same expression
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS log_chunk_data_trgm_idx ON api_testrunlogchunk USING gin (UPPER(data) gin_trgm_ops)'
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS log_chunk_data_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_test_run_log_tiers'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_index, reverse_code=drop_trigram_index),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_test_run_log_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TestRunRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.CharField(choices=[('SUCCESS', 'SUCCESS'), ('RUNNING', 'RUNNING'), ('FAILED', 'FAILED'), ('CREATED', 'CREATED'), ('RETRYING', 'RETRYING'), ('FAILED_TO_START', 'FAILED_TO_START')], max_length=64)),
+                ('metric', models.CharField(choices=[('RUN', 'RUN'), ('WAIT', 'WAIT')], max_length=8)),
+                ('bucket', models.PositiveSmallIntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('seconds', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='testrunrequest',
+            name='finished_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='testrunrequest',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='testrunrequest',
+            index=models.Index(fields=['status', '-created_at', '-id'], name='test_run_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='testrunrequest',
+            index=models.Index(fields=['env', '-created_at', '-id'], name='test_run_env_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='testrunrequest',
+            index=models.Index(fields=['requested_by', '-created_at', '-id'], name='test_run_requested_by_idx'),
+        ),
+        migrations.AddField(
+            model_name='testrunrollup',
+            name='env',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='api.testenvironment'),
+        ),
+        migrations.AddConstraint(
+            model_name='testrunrollup',
+            constraint=models.UniqueConstraint(fields=('day', 'env', 'status', 'metric', 'bucket'), name='unique_test_run_rollup'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_test_run_filters_and_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testrunrequest',
+            name='timeout_seconds',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='testrunrequest',
+            name='status',
+            field=models.CharField(choices=[('SUCCESS', 'SUCCESS'), ('RUNNING', 'RUNNING'), ('FAILED', 'FAILED'), ('CREATED', 'CREATED'), ('RETRYING', 'RETRYING'), ('FAILED_TO_START', 'FAILED_TO_START'), ('CANCELLED', 'CANCELLED')], default='CREATED', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='testrunrollup',
+            name='status',
+            field=models.CharField(choices=[('SUCCESS', 'SUCCESS'), ('RUNNING', 'RUNNING'), ('FAILED', 'FAILED'), ('CREATED', 'CREATED'), ('RETRYING', 'RETRYING'), ('FAILED_TO_START', 'FAILED_TO_START'), ('CANCELLED', 'CANCELLED')], max_length=64),
+        ),
+    ]
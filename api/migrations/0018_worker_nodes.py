@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_test_run_cancel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkerNode',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='date updated')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='date created')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('status', models.CharField(choices=[('ALIVE', 'ALIVE'), ('DEAD', 'DEAD')], default='ALIVE', max_length=64)),
+                ('capacity', models.PositiveSmallIntegerField(default=1)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('envs', models.ManyToManyField(blank=True, related_name='hosts', to='api.testenvironment')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='testenvironment',
+            name='node',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='assigned_envs', to='api.workernode'),
+        ),
+        migrations.AddField(
+            model_name='testrunrequest',
+            name='node',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.workernode'),
+        ),
+    ]
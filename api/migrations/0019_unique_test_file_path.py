@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:14
+
+from django.db import migrations, models
+
+
+def remove_duplicate_paths(apps, _):
+    #  the runs and results of the duplicates point to the oldest row of their path instead
+    TestFilePath = apps.get_model('api', 'TestFilePath')
+    TestResult = apps.get_model('api', 'TestResult')
+    TestRunRequestPath = apps.get_model('api', 'TestRunRequest').path.through
+    duplicates = TestFilePath.objects.values('path').annotate(
+        count=models.Count('id'), first_id=models.Min('id')
+    ).filter(count__gt=1)
+    for duplicate in duplicates:
+        first_id = duplicate['first_id']
+        ids = list(TestFilePath.objects.filter(path=duplicate['path']).exclude(id=first_id).values_list('id', flat=True))
+        request_ids = set(
+            TestRunRequestPath.objects.filter(testfilepath_id=first_id).values_list('testrunrequest_id', flat=True)
+        )
+        for request_path in TestRunRequestPath.objects.filter(testfilepath_id__in=ids):
+            if request_path.testrunrequest_id in request_ids:
+                request_path.delete()
+            else:
+                request_ids.add(request_path.testrunrequest_id)
+                request_path.testfilepath_id = first_id
+                request_path.save()
+        TestResult.objects.filter(path_id__in=ids).update(path_id=first_id)
+        TestFilePath.objects.filter(id__in=ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_worker_nodes'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_paths, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='testfilepath',
+            name='removed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='testfilepath',
+            name='path',
+            field=models.CharField(max_length=1024, unique=True),
+        ),
+    ]
@@ -0,0 +1,48 @@
+from django.db import migrations, models
+
+from api.models import get_log_search_text
+
+
+def move_chunks_to_search_text(apps, schema_editor):
+    #  the chunks of the compressed logs were kept for the search, only an extract of them is kept now
+    TestRunCompressedLog = apps.get_model('api', 'TestRunCompressedLog')
+    TestRunLogChunk = apps.get_model('api', 'TestRunLogChunk')
+    for compressed_log in TestRunCompressedLog.objects.only('request_id').iterator():
+        chunks = TestRunLogChunk.objects.filter(request_id=compressed_log.request_id)
+        logs = ''.join(chunks.order_by('sequence').values_list('data', flat=True))
+        TestRunCompressedLog.objects.filter(request_id=compressed_log.request_id).update(
+            search_text=get_log_search_text(logs)
+        )
+        chunks.delete()
+
+
+def create_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS compressed_log_search_trgm_idx '
+        'ON api_testruncompressedlog USING gin (UPPER(search_text) gin_trgm_ops)'
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS compressed_log_search_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_unique_test_file_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testruncompressedlog',
+            name='search_text',
+            field=models.TextField(default=''),
+        ),
+        migrations.RunPython(move_chunks_to_search_text, reverse_code=migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_index, reverse_code=drop_trigram_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_compressed_log_search'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='testrunrollup',
+            name='metric',
+            field=models.CharField(choices=[('RUN', 'RUN'), ('WAIT', 'WAIT'), ('NOT_RUN', 'NOT_RUN')], max_length=8),
+        ),
+    ]
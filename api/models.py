@@ -1,9 +1,28 @@
+import codecs
+import io
+import math
+import re
+import time
+import zlib
+from datetime import timedelta
+
 from django.conf import settings
-from django.db import models
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
 
+from api.allocator import ANY_POOL, get_free_list
+from api.dependencies import get_path_dependencies, is_modified_since
+from api.events import publish_logs, publish_status
+from api.metrics import get_metrics
+from api.response_cache import invalidate_test_run
 from api.utils import ExtendedEnum
 
 
+LOG_BLOCK_SIZE = 64 * 1024
+
+
 class Timestampable(models.Model):
     updated_at = models.DateTimeField('date updated', auto_now=True)
     created_at = models.DateTimeField('date created', auto_now_add=True)
@@ -13,11 +32,44 @@ class Timestampable(models.Model):
 
 
 class TestFilePath(Timestampable):
-    path = models.CharField(max_length=1024)
+    path = models.CharField(max_length=1024, unique=True)
+    duration = models.FloatField(null=True, blank=True)  # moving average of the seconds spent in its tests
+    tests = models.JSONField(default=list, blank=True)  # test node ids in the file, when indexed by discovery
+    mtime = models.BigIntegerField(null=True, blank=True)  # file mtime in ns when its tests were indexed
+    dependencies = models.JSONField(default=list, blank=True)  # local files the tests import, itself included
+    dependencies_updated_at = models.DateTimeField(null=True, blank=True)
+    removed_at = models.DateTimeField(null=True, blank=True)  # no longer found by discovery, kept for the past runs
 
     def __str__(self):
         return self.path
 
+    @classmethod
+    def get_available(cls):
+        return cls.objects.filter(removed_at__isnull=True)
+
+    @classmethod
+    def record_durations(cls, durations):
+        paths = list(cls.objects.filter(path__in=durations))
+        for path in paths:
+            if path.duration is None:
+                path.duration = durations[path.path]
+            else:
+                path.duration += settings.TEST_DURATION_SMOOTHING * (durations[path.path] - path.duration)
+        cls.objects.bulk_update(paths, ['duration'])
+
+    @classmethod
+    def refresh_dependencies(cls, paths):
+        #  only the stale entries of the dependency map are computed again
+        stale_paths = [
+            path for path in cls.objects.filter(path__in=paths)
+            if path.dependencies_updated_at is None
+            or is_modified_since(path.dependencies, path.dependencies_updated_at.timestamp())
+        ]
+        for path in stale_paths:
+            path.dependencies_updated_at = timezone.now()
+            path.dependencies = get_path_dependencies(path.path)
+        cls.objects.bulk_update(stale_paths, ['dependencies', 'dependencies_updated_at'])
+
 
 class TestEnvironment(Timestampable):
     class StatusChoices(ExtendedEnum):
@@ -25,6 +77,13 @@ class TestEnvironment(Timestampable):
         BUSY = 'BUSY'
     name = models.CharField(max_length=64, unique=True)
     status = models.CharField(max_length=64, choices=StatusChoices.get_as_tuple(), default=StatusChoices.IDLE.name)
+    lease_owner = models.CharField(max_length=255, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    pool = models.CharField(max_length=64, blank=True, db_index=True)  # tag of the envs requests can target together
+    #  worker node its runs are sent to, any worker runs them if unset
+    node = models.ForeignKey(
+        'WorkerNode', null=True, blank=True, related_name='assigned_envs', on_delete=models.SET_NULL
+    )
 
     def __str__(self):
         return self.name
@@ -35,17 +94,236 @@ class TestEnvironment(Timestampable):
     def is_idle(self):
         return self.status == TestEnvironment.StatusChoices.IDLE.name
 
-    def lock(self):
-        if self.is_busy():
+    @classmethod
+    def get_expired_leases(cls):
+        #  envs locked before leases existed have no expiry and are reclaimed as well
+        return cls.objects.filter(status=cls.StatusChoices.BUSY.name).filter(
+            models.Q(lease_expires_at__lt=timezone.now()) | models.Q(lease_expires_at__isnull=True)
+        )
+
+    def _update_lease(self, queryset, status, lease_owner, lease_expires_at):
+        updated = queryset.filter(pk=self.pk).update(
+            status=status, lease_owner=lease_owner, lease_expires_at=lease_expires_at, updated_at=timezone.now()
+        )
+        if updated:
+            self.status = status
+            self.lease_owner = lease_owner
+            self.lease_expires_at = lease_expires_at
+            if self.is_idle():
+                get_free_list().add(self.id, self.pool)
+            else:
+                get_free_list().remove(self.id, self.pool)
+        return bool(updated)
+
+    @classmethod
+    def get_pool(cls, pool):
+        envs = cls.objects.all()
+        return envs if pool == ANY_POOL else envs.filter(pool=pool)
+
+    @classmethod
+    def allocate(cls, pool, owner='', node=None):
+        """Locks and returns an idle env of the pool, or None if all of them are busy. On a worker node, only the
+        envs assigned to the node are considered."""
+        idle_envs = cls.get_pool(pool).filter(status=cls.StatusChoices.IDLE.name)
+        if node is not None:
+            #  the free list spans every node, the few envs of a node are looked up in the database instead
+            idle_envs = idle_envs.filter(node=node)
+        else:
+            free_list = get_free_list()
+            while (env_id := free_list.pop(pool)) is not None:
+                env = cls.objects.filter(id=env_id).first()
+                if env is not None and env.try_lock(owner):
+                    return env
+        #  the free list may miss envs, e.g. after a restart, only the database can tell that the pool is saturated
+        for env in idle_envs[:settings.TEST_ENV_ALLOCATOR_SCAN_SIZE]:
+            if env.try_lock(owner):
+                return env
+        return None
+
+    @classmethod
+    def rebuild_free_list(cls):
+        get_free_list().rebuild(cls.objects.filter(status=cls.StatusChoices.IDLE.name).values_list('id', 'pool'))
+
+    @staticmethod
+    def _observe_lease_update(operation, started_at, updated):
+        get_metrics().observe_since(
+            'ionos_test_env_lock_seconds', started_at, operation=operation, outcome='ok' if updated else 'conflict'
+        )
+
+    def try_lock(self, owner=''):
+        started_at = time.perf_counter()
+        locked = self._update_lease(
+            TestEnvironment.objects.filter(status=TestEnvironment.StatusChoices.IDLE.name),
+            TestEnvironment.StatusChoices.BUSY.name,
+            owner,
+            timezone.now() + timedelta(seconds=settings.TEST_ENV_LEASE_SECONDS)
+        )
+        self._observe_lease_update('lock', started_at, locked)
+        return locked
+
+    def lock(self, owner=''):
+        if not self.try_lock(owner):
             raise RuntimeError(f'Trying to lock a busy env(id: {self.id})')
-        self.status = TestEnvironment.StatusChoices.BUSY.name
-        self.save()
 
-    def unlock(self):
-        if self.is_idle():
+    def heartbeat(self, owner=''):
+        return self._update_lease(
+            TestEnvironment.objects.filter(status=TestEnvironment.StatusChoices.BUSY.name, lease_owner=owner),
+            TestEnvironment.StatusChoices.BUSY.name,
+            owner,
+            timezone.now() + timedelta(seconds=settings.TEST_ENV_LEASE_SECONDS)
+        )
+
+    def try_unlock(self, owner=None):
+        started_at = time.perf_counter()
+        queryset = TestEnvironment.objects.filter(status=TestEnvironment.StatusChoices.BUSY.name)
+        if owner is not None:
+            queryset = queryset.filter(lease_owner=owner)
+        unlocked = self._update_lease(queryset, TestEnvironment.StatusChoices.IDLE.name, '', None)
+        self._observe_lease_update('unlock', started_at, unlocked)
+        return unlocked
+
+    def unlock(self, owner=None):
+        if not self.try_unlock(owner):
             raise RuntimeError(f'Trying to unlock an idle env(id: {self.id})')
-        self.status = TestEnvironment.StatusChoices.IDLE.name
-        self.save()
+
+    def reclaim(self):
+        #  only succeeds if nobody renewed or released the lease in the meantime
+        return self._update_lease(
+            TestEnvironment.get_expired_leases().filter(lease_owner=self.lease_owner),
+            TestEnvironment.StatusChoices.IDLE.name,
+            '',
+            None
+        )
+
+
+class WorkerNode(Timestampable):
+    """A celery worker running the tests of the envs assigned to it, from its own queue.
+
+    Nodes register the envs they can host and their capacity when their worker starts, and renew `heartbeat_at`
+    while it runs. A node without heartbeat for `TEST_WORKER_NODE_TIMEOUT_SECONDS` is dead, its envs are assigned to
+    the remaining nodes.
+    """
+    class StatusChoices(ExtendedEnum):
+        ALIVE = 'ALIVE'
+        DEAD = 'DEAD'
+    name = models.CharField(max_length=64, unique=True)
+    status = models.CharField(max_length=64, choices=StatusChoices.get_as_tuple(), default=StatusChoices.ALIVE.name)
+    capacity = models.PositiveSmallIntegerField(default=1)  # runs at once, envs are spread in proportion to it
+    envs = models.ManyToManyField(TestEnvironment, blank=True, related_name='hosts')  # it can host, all if empty
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.name
+
+    def is_alive(self):
+        return self.status == WorkerNode.StatusChoices.ALIVE.name
+
+    def get_queue(self):
+        return f'node.{self.name}'
+
+    @classmethod
+    def get_local(cls):
+        """Node of this worker, None unless it runs as a worker node."""
+        if not settings.TEST_WORKER_NODE:
+            return None
+        return cls.objects.filter(name=settings.TEST_WORKER_NODE).first()
+
+    @classmethod
+    def get_for_pool(cls, pool):
+        #  preferably the node of an idle env, the request waits for an env of its node otherwise
+        envs = TestEnvironment.get_pool(pool).filter(node__status=cls.StatusChoices.ALIVE.name).select_related('node')
+        env = envs.filter(status=TestEnvironment.StatusChoices.IDLE.name).first() or envs.first()
+        return env.node if env is not None else None
+
+    @classmethod
+    def register(cls, name, capacity, env_names=None):
+        node, _ = cls.objects.update_or_create(name=name, defaults={
+            'status': cls.StatusChoices.ALIVE.name, 'capacity': max(capacity, 1), 'heartbeat_at': timezone.now()
+        })
+        node.envs.set(TestEnvironment.objects.filter(name__in=env_names) if env_names else [])
+        cls.balance()
+        return node
+
+    def heartbeat(self):
+        #  a node found dead has lost its envs, it has to register again
+        now = timezone.now()
+        return bool(WorkerNode.objects.filter(pk=self.pk, status=WorkerNode.StatusChoices.ALIVE.name).update(
+            heartbeat_at=now, updated_at=now
+        ))
+
+    def _mark_as_dead(self, queryset):
+        updated = queryset.filter(pk=self.pk).update(
+            status=WorkerNode.StatusChoices.DEAD.name, updated_at=timezone.now()
+        )
+        if updated:
+            self.status = WorkerNode.StatusChoices.DEAD.name
+        return bool(updated)
+
+    def deregister(self):
+        return self._mark_as_dead(WorkerNode.objects.filter(status=WorkerNode.StatusChoices.ALIVE.name))
+
+    @classmethod
+    def reap(cls):
+        """Marks the nodes without recent heartbeat as dead and returns them."""
+        expired = cls.objects.filter(
+            status=cls.StatusChoices.ALIVE.name,
+            heartbeat_at__lt=timezone.now() - timedelta(seconds=settings.TEST_WORKER_NODE_TIMEOUT_SECONDS)
+        )
+        #  only if no heartbeat came in the meantime
+        return [node for node in expired if node._mark_as_dead(expired)]
+
+    @classmethod
+    def balance(cls):
+        """Assigns every env to an alive node which can host it, in proportion to the capacity of the nodes.
+
+        Envs stay on their node unless it died or moving them evens the load, so that adding a node takes its share
+        of the envs. A moved env may still be running on its previous node, its lease keeps the runs exclusive.
+        """
+        nodes = {node.id: node for node in cls.objects.filter(status=cls.StatusChoices.ALIVE.name)}
+        hosted = {}
+        for node_id, env_id in cls.envs.through.objects.filter(workernode__in=nodes).values_list(
+            'workernode_id', 'testenvironment_id'
+        ):
+            hosted.setdefault(node_id, set()).add(env_id)
+
+        def get_hosts(env):
+            return [node_id for node_id in nodes if node_id not in hosted or env.id in hosted[node_id]]
+
+        def get_cost(node_id, count):
+            #  increase of the sum of count ** 2 / capacity when adding an env, every move lowers that sum
+            return (2 * count + 1) / nodes[node_id].capacity
+
+        envs = list(TestEnvironment.objects.order_by('id'))
+        assignments = {env.id: env.node_id if env.node_id in get_hosts(env) else None for env in envs}
+        counts = {node_id: 0 for node_id in nodes}
+        for node_id in assignments.values():
+            if node_id is not None:
+                counts[node_id] += 1
+        for env in envs:
+            hosts = get_hosts(env)
+            if assignments[env.id] is None and hosts:
+                assignments[env.id] = min(hosts, key=lambda host: get_cost(host, counts[host]))
+                counts[assignments[env.id]] += 1
+
+        moved = True
+        while moved:
+            moved = False
+            for env in envs:
+                node_id = assignments[env.id]
+                if node_id is None:
+                    continue
+                best = min(get_hosts(env), key=lambda host: get_cost(host, counts[host]))
+                if get_cost(best, counts[best]) < get_cost(node_id, counts[node_id] - 1):
+                    counts[node_id] -= 1
+                    counts[best] += 1
+                    assignments[env.id] = best
+                    moved = True
+
+        changed = [env for env in envs if env.node_id != assignments[env.id]]
+        for env in changed:
+            env.node_id = assignments[env.id]
+        TestEnvironment.objects.bulk_update(changed, ['node'])
+        return changed
 
 
 class TestRunRequest(Timestampable):
@@ -54,42 +332,519 @@ class TestRunRequest(Timestampable):
         RUNNING = 'RUNNING'  # tests are running
         FAILED = 'FAILED'  # tests are done but failed
         CREATED = 'CREATED'  # request created but not started yet
-        RETRYING = 'RETRYING'  # env is busy, retrying
+        RETRYING = 'RETRYING'  # env is busy, waiting in the env queue
         FAILED_TO_START = 'FAILED_TO_START'  # after some retries, env is still busy
+        CANCELLED = 'CANCELLED'  # cancelled by the user, before or while running
+
+    class LogTierChoices(ExtendedEnum):
+        CHUNKS = 'CHUNKS'  # appended to as the tests run
+        COMPRESSED = 'COMPRESSED'  # compressed in the database once the run finished, error lines searchable
+        ARCHIVED = 'ARCHIVED'  # compressed in the `test_run_logs` storage, no longer searchable
+        PURGED = 'PURGED'  # deleted after the retention period
+
+    PENDING_STATUSES = (StatusChoices.CREATED.name, StatusChoices.RETRYING.name)
+    UNFINISHED_STATUSES = PENDING_STATUSES + (StatusChoices.RUNNING.name, )
+    FINISHED_STATUSES = (
+        StatusChoices.SUCCESS.name, StatusChoices.FAILED.name, StatusChoices.FAILED_TO_START.name,
+        StatusChoices.CANCELLED.name
+    )
 
     requested_by = models.CharField(max_length=128)
-    env = models.ForeignKey(TestEnvironment, null=False, on_delete=models.CASCADE)
+    env = models.ForeignKey(TestEnvironment, null=True, on_delete=models.CASCADE)  # set once started for pools
+    pool = models.CharField(max_length=64, blank=True)  # runs on any idle env of the pool instead of a given env
+    #  worker node it was last sent to, it's sent again to another node if this one dies before running it
+    node = models.ForeignKey(WorkerNode, null=True, blank=True, related_name='+', on_delete=models.SET_NULL)
+    use_cache = models.BooleanField(default=False)  # reuse the outcome of an identical run instead of running again
+    cached_from = models.ForeignKey('self', null=True, blank=True, related_name='+', on_delete=models.SET_NULL)
+    changed_files = models.JSONField(default=list, blank=True)  # only the tests depending on them run, if set
     path = models.ManyToManyField(TestFilePath)
     status = models.CharField(max_length=64, choices=StatusChoices.get_as_tuple(), default=StatusChoices.CREATED.name)
-    logs = models.TextField(blank=True)
+    log_size = models.PositiveBigIntegerField(default=0)
+    log_chunk_count = models.PositiveIntegerField(default=0)
+    log_tier = models.CharField(
+        max_length=16, choices=LogTierChoices.get_as_tuple(), default=LogTierChoices.CHUNKS.name
+    )
+    log_archive = models.CharField(max_length=255, blank=True)  # name of the logs in the storage, once archived
+    parallelism = models.PositiveSmallIntegerField(default=1)  # number of processes the paths are split across
+    priority = models.PositiveSmallIntegerField(default=0)  # higher priorities are dispatched first
+    timeout_seconds = models.PositiveIntegerField(null=True, blank=True)  # TEST_RUN_REQUEST_TIMEOUT_SECONDS if unset
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
 
-    def get_command(self):
-        return settings.TEST_BASE_CMD + list(self.path.all().values_list('path', flat=True))
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='test_run_created_idx'),
+            #  filters of the list, in its order
+            models.Index(fields=['status', '-created_at', '-id'], name='test_run_status_idx'),
+            models.Index(fields=['env', '-created_at', '-id'], name='test_run_env_idx'),
+            models.Index(fields=['requested_by', '-created_at', '-id'], name='test_run_requested_by_idx'),
+            models.Index(fields=['updated_at', 'id'], name='test_run_updated_idx'),
+            models.Index(fields=['log_tier', 'updated_at'], name='test_run_log_tier_idx'),
+        ]
+
+    @classmethod
+    def get_next_retrying(cls, env):
+        #  the created requests are still with the scheduler, only the ones which found their env busy wait here
+        pools = models.Q(env__isnull=True, pool__in=[ANY_POOL] + ([env.pool] if env.pool else []))
+        return cls.objects.filter(models.Q(env=env) | pools, status=cls.StatusChoices.RETRYING.name).order_by(
+            '-priority', 'created_at', 'id'
+        ).first()
+
+    @classmethod
+    def get_stranded(cls):
+        """Retrying requests whose env, or an env of whose pool, is idle, they should have been scheduled again."""
+        idle_envs = TestEnvironment.objects.filter(status=TestEnvironment.StatusChoices.IDLE.name)
+        pools = models.Q(env__isnull=True, pool__in=idle_envs.values('pool'))
+        if idle_envs.exists():
+            pools |= models.Q(env__isnull=True, pool=ANY_POOL)
+        return cls.objects.filter(
+            models.Q(env__status=TestEnvironment.StatusChoices.IDLE.name) | pools,
+            status=cls.StatusChoices.RETRYING.name
+        )
+
+    @classmethod
+    def route(cls, pk):
+        """Returns the alive node the request has to be sent to, None for any worker. The node is remembered, so that
+        the request is sent again if the node dies before running it."""
+        instance = cls.objects.select_related('env__node').filter(pk=pk).first()
+        if instance is None:
+            return None
+        if instance.env is not None:
+            node = instance.env.node if instance.env.node is not None and instance.env.node.is_alive() else None
+        else:
+            node = WorkerNode.get_for_pool(instance.pool)
+        if instance.node_id != (node.id if node is not None else None):
+            #  not a change of the request itself, `updated_at` is kept
+            cls.objects.filter(pk=pk).update(node=node)
+        return node
+
+    @classmethod
+    def get_latest_change(cls):
+        return cls.objects.order_by('-updated_at', '-id').values_list('updated_at', 'id').first()
+
+    @staticmethod
+    def changed_since(updated_at, pk):
+        return models.Q(updated_at__gt=updated_at) | models.Q(updated_at=updated_at, id__gt=pk)
+
+    def is_pending(self):
+        return self.status in TestRunRequest.PENDING_STATUSES
 
-    def mark_as_running(self):
-        self.status = TestRunRequest.StatusChoices.RUNNING.name
-        self.save()
+    def get_paths(self):
+        return list(self.path.all().values_list('path', flat=True))
+
+    def get_command(self, paths=None):
+        return settings.TEST_BASE_CMD + (self.get_paths() if paths is None else paths)
+
+    def _set_status_from(self, status, from_statuses, **fields):
+        #  conditional update, so that concurrent workers never move a request backwards
+        updated_at = timezone.now()
+        updated = TestRunRequest.objects.filter(pk=self.pk, status__in=from_statuses).update(
+            status=status, updated_at=updated_at, **fields
+        )
+        if updated:
+            self.status = status
+            self.updated_at = updated_at
+            for name, value in fields.items():
+                setattr(self, name, value)
+            invalidate_test_run(self.pk)
+            publish_status(self)
+        return bool(updated)
+
+    def mark_as_running(self, env=None):
+        fields = {'env': env} if env is not None else {}
+        #  `updated_at` tells since when a retrying request waits, appending logs doesn't change it
+        retrying_since = self.updated_at if self.status == TestRunRequest.StatusChoices.RETRYING.name else None
+        started_at = timezone.now()
+        if not self._set_status_from(
+            TestRunRequest.StatusChoices.RUNNING.name, TestRunRequest.PENDING_STATUSES, started_at=started_at,
+            **fields
+        ):
+            return False
+        metrics = get_metrics()
+        metrics.observe('ionos_test_run_queue_wait_seconds', (started_at - self.created_at).total_seconds())
+        if retrying_since is not None:
+            metrics.observe('ionos_test_run_retrying_seconds', (started_at - retrying_since).total_seconds())
+        return True
+
+    def _finish(self, status, from_statuses=UNFINISHED_STATUSES, **fields):
+        #  a finished request never changes, e.g. a run completing after it was cancelled keeps it cancelled
+        finished = self._set_status_from(status, from_statuses, finished_at=timezone.now(), **fields)
+        if finished:
+            TestRunRollup.record(self)
+        return finished
 
     def mark_as_success(self):
-        self.status = TestRunRequest.StatusChoices.SUCCESS.name
-        self.save()
+        return self._finish(TestRunRequest.StatusChoices.SUCCESS.name)
 
     def mark_as_failed(self):
-        self.status = TestRunRequest.StatusChoices.FAILED.name
-        self.save()
+        return self._finish(TestRunRequest.StatusChoices.FAILED.name)
+
+    def mark_as_cached(self, source):
+        return self._finish(
+            source.status, TestRunRequest.PENDING_STATUSES, cached_from=source, started_at=timezone.now()
+        )
+
+    def cancel(self, from_statuses=UNFINISHED_STATUSES):
+        return self._finish(TestRunRequest.StatusChoices.CANCELLED.name, from_statuses)
+
+    def is_cancelled(self):
+        return TestRunRequest.objects.filter(pk=self.pk, status=TestRunRequest.StatusChoices.CANCELLED.name).exists()
+
+    def get_timeout_seconds(self):
+        return self.timeout_seconds or settings.TEST_RUN_REQUEST_TIMEOUT_SECONDS
+
+    def get_target(self):
+        return self.pool or self.env.name
+
+    def requeue(self):
+        #  a pool request goes back to its pool, it may run on any env of it
+        fields = {'env': None} if self.pool else {}
+        return self._set_status_from(
+            TestRunRequest.StatusChoices.RETRYING.name, (TestRunRequest.StatusChoices.RUNNING.name, ), **fields
+        )
 
     def mark_as_retrying(self):
-        self.status = TestRunRequest.StatusChoices.RETRYING.name
-        self.save()
+        return self._set_status_from(
+            TestRunRequest.StatusChoices.RETRYING.name, (TestRunRequest.StatusChoices.CREATED.name, )
+        )
 
     def mark_as_failed_to_start(self):
-        self.status = TestRunRequest.StatusChoices.FAILED_TO_START.name
-        self.save()
+        return self._finish(TestRunRequest.StatusChoices.FAILED_TO_START.name)
 
     def save_logs(self, logs=None):
         if not logs:
             return
-        self.logs += '\n' + logs
-        self.save()
+        data = '\n' + logs
+        with transaction.atomic():
+            #  the row lock serializes appends, only the counters are written, never the logs written so far
+            counters = TestRunRequest.objects.select_for_update().filter(pk=self.pk).values(
+                'log_size', 'log_chunk_count'
+            ).get()
+            TestRunLogChunk.objects.create(
+                request_id=self.pk, sequence=counters['log_chunk_count'], offset=counters['log_size'], data=data
+            )
+            TestRunRequest.objects.filter(pk=self.pk).update(
+                log_size=models.F('log_size') + len(data), log_chunk_count=models.F('log_chunk_count') + 1
+            )
+        self.log_size = counters['log_size'] + len(data)
+        self.log_chunk_count = counters['log_chunk_count'] + 1
+        invalidate_test_run(self.pk)
+        publish_logs(self.pk, counters['log_size'], data)
+
+    def copy_logs(self, source):
+        with transaction.atomic():
+            counters = TestRunRequest.objects.select_for_update().filter(pk=self.pk).values(
+                'log_size', 'log_chunk_count'
+            ).get()
+            sequence, offset = counters['log_chunk_count'], counters['log_size']
+            chunks = []
+            if source.log_tier == TestRunRequest.LogTierChoices.CHUNKS.name:
+                source_chunks = source.log_chunks.order_by('sequence').values_list('data', flat=True).iterator()
+            else:
+                source_chunks = [logs] if (logs := source.read_logs()) else []
+            for data in source_chunks:
+                chunks.append(TestRunLogChunk(request_id=self.pk, sequence=sequence, offset=offset, data=data))
+                sequence += 1
+                offset += len(data)
+            TestRunLogChunk.objects.bulk_create(chunks, batch_size=settings.TEST_RESULTS_BATCH_SIZE)
+            TestRunRequest.objects.filter(pk=self.pk).update(log_size=offset, log_chunk_count=sequence)
+        self.log_size = offset
+        self.log_chunk_count = sequence
+        invalidate_test_run(self.pk)
+
+    def read_logs(self, offset=0, limit=None):
+        if self.log_tier != TestRunRequest.LogTierChoices.CHUNKS.name:
+            return self._read_compressed_logs(offset, limit)
+        chunks = self.log_chunks.all()
+        if offset:
+            #  the chunk containing `offset` is the last one starting at or before it
+            first_offset = chunks.filter(offset__lte=offset).order_by('-offset').values('offset')[:1]
+            chunks = chunks.filter(offset__gte=models.Subquery(first_offset))
+        if limit is not None:
+            chunks = chunks.filter(offset__lt=offset + limit)
+        chunks = list(chunks.order_by('sequence').values_list('offset', 'data'))
+        if not chunks:
+            return ''
+        start = offset - chunks[0][0]
+        logs = ''.join(data for _, data in chunks)
+        return logs[start:] if limit is None else logs[start:start + limit]
+
+    def _read_compressed_logs(self, offset=0, limit=None):
+        if self.log_tier == TestRunRequest.LogTierChoices.COMPRESSED.name:
+            data = TestRunCompressedLog.objects.filter(request_id=self.pk).values_list('data', flat=True).first()
+            if data is not None:
+                return decompress_logs(io.BytesIO(data), offset, limit)
+            #  archived in the meantime
+            self.refresh_from_db(fields=['log_tier', 'log_archive'])
+        if self.log_tier == TestRunRequest.LogTierChoices.ARCHIVED.name:
+            with get_log_storage().open(self.log_archive, 'rb') as f:
+                return decompress_logs(f, offset, limit)
+        return ''
+
+    @property
+    def logs(self):
+        return self.read_logs()
+
+    def get_log_tail_offset(self):
+        #  where the logs returned with the request start, the earlier ones are read by range
+        return max(self.log_size - settings.TEST_RUN_LOG_READ_LIMIT, 0)
+
+    def read_log_tail(self):
+        return self.read_logs(self.get_log_tail_offset(), settings.TEST_RUN_LOG_READ_LIMIT)
+
+    def _set_log_tier_from(self, log_tier, from_log_tier, **fields):
+        #  not a change of the request itself, `updated_at` keeps telling when it finished
+        updated = TestRunRequest.objects.filter(pk=self.pk, log_tier=from_log_tier).update(log_tier=log_tier, **fields)
+        if updated:
+            self.log_tier = log_tier
+            for name, value in fields.items():
+                setattr(self, name, value)
+        return bool(updated)
+
+    def compress_logs(self):
+        with transaction.atomic():
+            #  the row lock waits for the appends in progress
+            if not TestRunRequest.objects.select_for_update().filter(
+                pk=self.pk, log_tier=TestRunRequest.LogTierChoices.CHUNKS.name
+            ).exists():
+                return False
+            logs = self.read_logs()
+            TestRunCompressedLog.objects.create(
+                request_id=self.pk, data=compress_logs(logs), search_text=get_log_search_text(logs)
+            )
+            self.log_chunks.all().delete()
+            return self._set_log_tier_from(
+                TestRunRequest.LogTierChoices.COMPRESSED.name, TestRunRequest.LogTierChoices.CHUNKS.name
+            )
+
+    def archive_logs(self):
+        data = TestRunCompressedLog.objects.filter(request_id=self.pk).values_list('data', flat=True).first()
+        if data is None:
+            return False
+        storage = get_log_storage()
+        name = storage.save(f'{self.pk}.log.z', ContentFile(bytes(data)))
+        with transaction.atomic():
+            archived = self._set_log_tier_from(
+                TestRunRequest.LogTierChoices.ARCHIVED.name, TestRunRequest.LogTierChoices.COMPRESSED.name,
+                log_archive=name
+            )
+            if archived:
+                TestRunCompressedLog.objects.filter(request_id=self.pk).delete()
+        if not archived:
+            storage.delete(name)
+        return archived
+
+    def purge_logs(self):
+        name = self.log_archive
+        if not self._set_log_tier_from(
+            TestRunRequest.LogTierChoices.PURGED.name, TestRunRequest.LogTierChoices.ARCHIVED.name, log_archive=''
+        ):
+            return False
+        invalidate_test_run(self.pk)
+        get_log_storage().delete(name)
+        return True
+
+    @classmethod
+    def get_logs_older_than(cls, log_tier, seconds):
+        finished_before = timezone.now() - timedelta(seconds=seconds)
+        return cls.objects.filter(log_tier=log_tier, status__in=cls.FINISHED_STATUSES, updated_at__lt=finished_before)
+
+
+def get_log_storage():
+    return storages['test_run_logs']
+
+
+def compress_logs(logs):
+    return zlib.compress(logs.encode(), settings.TEST_RUN_LOG_COMPRESSION_LEVEL)
+
+
+def get_log_search_text(logs):
+    """The bounded extract of the logs searched once they are compressed: the distinct lines matching
+    TEST_RUN_LOG_SEARCH_PATTERN, e.g. failures and errors, keeping them all would take more space than the logs."""
+    pattern = re.compile(settings.TEST_RUN_LOG_SEARCH_PATTERN)
+    lines = dict.fromkeys(line for line in logs.split('\n') if pattern.search(line))
+    return '\n'.join(lines)[:settings.TEST_RUN_LOG_SEARCH_MAX_CHARS]
+
+
+def decompress_logs(f, offset=0, limit=None):
+    """Logs of a compressed file from `offset`, decompressed block by block so that only the requested range is
+    kept in memory."""
+    decompressor = zlib.decompressobj()
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    end = None if limit is None else offset + limit
+    parts = []
+    position = 0
+    while end is None or position < end:
+        data = decompressor.unconsumed_tail or f.read(LOG_BLOCK_SIZE)
+        final = not data
+        text = decoder.decode(decompressor.flush() if final else decompressor.decompress(data, LOG_BLOCK_SIZE), final)
+        parts.append(text[max(offset - position, 0):None if end is None else max(end - position, 0)])
+        position += len(text)
+        if final:
+            break
+    return ''.join(parts)
+
+
+def get_duration_bucket(seconds):
+    #  4 buckets per doubling of the duration, the percentiles are within 19% of the exact ones
+    return math.floor(4 * math.log2(1 + max(seconds, 0)))
+
+
+def get_bucket_upper_bound(bucket):
+    return 2 ** ((bucket + 1) / 4) - 1
+
+
+class TestRunRollup(models.Model):
+    """Finished runs aggregated per day, env, status and duration bucket, updated as each run finishes.
+
+    Their count only grows with the number of days, so the stats of a period are read in a constant time.
+    """
+    class MetricChoices(ExtendedEnum):
+        RUN = 'RUN'  # from the start to the end of the run
+        WAIT = 'WAIT'  # from the creation to the start of the run
+        NOT_RUN = 'NOT_RUN'  # finished without running on an env, e.g. cancelled while pending or cached: no duration
+
+    day = models.DateField()
+    env = models.ForeignKey(TestEnvironment, null=True, on_delete=models.CASCADE)
+    status = models.CharField(max_length=64, choices=TestRunRequest.StatusChoices.get_as_tuple())
+    metric = models.CharField(max_length=8, choices=MetricChoices.get_as_tuple())
+    bucket = models.PositiveSmallIntegerField()  # see get_duration_bucket
+    count = models.PositiveIntegerField(default=0)
+    seconds = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'env', 'status', 'metric', 'bucket'], name='unique_test_run_rollup'
+            ),
+        ]
+
+    @classmethod
+    def _add(cls, key, seconds):
+        #  a single row is updated, the unique constraint doesn't hold for the rows without env on PostgreSQL
+        pk = cls.objects.filter(**key).values_list('pk', flat=True).first()
+        if pk is None:
+            try:
+                with transaction.atomic():
+                    cls.objects.create(count=1, seconds=seconds, **key)
+                return
+            except IntegrityError:
+                #  created by a concurrent run in the meantime
+                pk = cls.objects.filter(**key).values_list('pk', flat=True).first()
+        cls.objects.filter(pk=pk).update(count=models.F('count') + 1, seconds=models.F('seconds') + seconds)
+
+    @classmethod
+    def record(cls, request):
+        finished_at = request.finished_at
+        started_at = request.started_at
+        key = {'day': timezone.localdate(finished_at), 'env_id': request.env_id, 'status': request.status}
+        if request.env_id is None or started_at is None or request.cached_from_id is not None:
+            #  only counted in the statuses, its durations would skew those of the runs
+            cls._add(dict(key, metric=cls.MetricChoices.NOT_RUN.name, bucket=0), 0)
+            return
+        for metric, seconds in (
+            (cls.MetricChoices.RUN.name, (finished_at - started_at).total_seconds()),
+            (cls.MetricChoices.WAIT.name, (started_at - request.created_at).total_seconds()),
+        ):
+            seconds = max(seconds, 0)
+            cls._add(dict(key, metric=metric, bucket=get_duration_bucket(seconds)), seconds)
+
+
+class TestRunLogChunk(models.Model):
+    request = models.ForeignKey(TestRunRequest, related_name='log_chunks', on_delete=models.CASCADE)
+    sequence = models.PositiveIntegerField()
+    offset = models.PositiveBigIntegerField()
+    data = models.TextField()
+    created_at = models.DateTimeField('date created', auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['request', 'sequence'], name='unique_log_chunk_sequence'),
+        ]
+        indexes = [
+            models.Index(fields=['request', 'offset'], name='log_chunk_offset_idx'),
+        ]
+        #  on PostgreSQL, `data__icontains` is also backed by a trigram index, see 0015_test_run_log_search
+
+
+class TestRunCompressedLog(models.Model):
+    request = models.OneToOneField(TestRunRequest, primary_key=True, related_name='+', on_delete=models.CASCADE)
+    data = models.BinaryField()  # zlib compressed logs
+    search_text = models.TextField(default='')  # only searched, see get_log_search_text
+    created_at = models.DateTimeField('date created', auto_now_add=True)
+    #  on PostgreSQL, `search_text__icontains` is also backed by a trigram index, see 0020_compressed_log_search
+
+
+class TestResult(models.Model):
+    class OutcomeChoices(ExtendedEnum):
+        PASSED = 'PASSED'
+        FAILED = 'FAILED'
+        ERROR = 'ERROR'
+        SKIPPED = 'SKIPPED'
+
+    request = models.ForeignKey(TestRunRequest, related_name='results', on_delete=models.CASCADE)
+    path = models.ForeignKey(TestFilePath, null=True, related_name='results', on_delete=models.SET_NULL)
+    nodeid = models.CharField(max_length=1024)
+    outcome = models.CharField(max_length=16, choices=OutcomeChoices.get_as_tuple())
+    duration = models.FloatField()
+    message = models.TextField(blank=True)
+    created_at = models.DateTimeField('date created', auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['nodeid', '-created_at'], name='test_result_nodeid_idx'),
+            models.Index(fields=['created_at'], name='test_result_created_idx'),
+        ]
+
+    @classmethod
+    def record(cls, request, testcases):
+        path_ids = dict(TestFilePath.objects.filter(
+            path__in={testcase.path for testcase in testcases}
+        ).values_list('path', 'id'))
+        cls.objects.bulk_create([
+            cls(
+                request=request,
+                path_id=path_ids.get(testcase.path),
+                nodeid=testcase.nodeid,
+                outcome=testcase.outcome,
+                duration=testcase.duration,
+                message=testcase.message
+            )
+            for testcase in testcases
+        ], batch_size=settings.TEST_RESULTS_BATCH_SIZE)
+
+
+class TestRunCacheEntry(models.Model):
+    key = models.CharField(max_length=64, unique=True)  # hash of the test files, their dependencies and the env
+    request = models.ForeignKey(TestRunRequest, related_name='cache_entries', on_delete=models.CASCADE)
+    created_at = models.DateTimeField(default=timezone.now)
+    used_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    @classmethod
+    def lookup(cls, key):
+        entry = cls.objects.select_related('request').filter(
+            key=key, created_at__gte=timezone.now() - timedelta(seconds=settings.TEST_RESULT_CACHE_TTL_SECONDS)
+        ).first()
+        if entry is not None:
+            cls.objects.filter(pk=entry.pk).update(used_at=timezone.now())
+        return entry
 
+    @classmethod
+    def store(cls, key, request):
+        now = timezone.now()
+        cls.objects.update_or_create(key=key, defaults={'request': request, 'created_at': now, 'used_at': now})
+        cls.evict()
 
+    @classmethod
+    def evict(cls):
+        cls.objects.filter(
+            created_at__lt=timezone.now() - timedelta(seconds=settings.TEST_RESULT_CACHE_TTL_SECONDS)
+        ).delete()
+        #  least recently used entries go first once the cache is full
+        oldest_kept = settings.TEST_RESULT_CACHE_MAX_ENTRIES
+        threshold = list(
+            cls.objects.order_by('-used_at', '-id').values_list('used_at', 'id')[oldest_kept:oldest_kept + 1]
+        )
+        if threshold:
+            used_at, pk = threshold[0]
+            cls.objects.filter(models.Q(used_at__lt=used_at) | models.Q(used_at=used_at, id__lte=pk)).delete()
@@ -0,0 +1,38 @@
+import base64
+import binascii
+from datetime import datetime
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+
+
+class TestRunRequestCursorPagination(CursorPagination):
+    #  keyset pagination, backed by the (created_at, id) index of TestRunRequest
+    ordering = ('-created_at', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class TestResultCursorPagination(CursorPagination):
+    ordering = ('-created_at', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+def encode_change_token(change):
+    if change is None:
+        return ''
+    updated_at, pk = change
+    return base64.urlsafe_b64encode(f'{updated_at.isoformat()}|{pk}'.encode()).decode()
+
+
+def decode_change_token(token):
+    if not token:
+        return None
+    try:
+        updated_at, pk = base64.urlsafe_b64decode(token.encode()).decode().split('|')
+        return datetime.fromisoformat(updated_at), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValidationError({'since': ['Invalid token.']})
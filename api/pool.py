@@ -0,0 +1,236 @@
+import contextlib
+import importlib
+import importlib.metadata
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import traceback
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+MAX_MESSAGE_SIZE = 1024 * 1024
+_runner = None
+_runner_lock = threading.Lock()
+
+
+class WarmProcess:
+    """Popen like handle of a test run forked by a WarmRunner.
+
+    The run is not a child of this process, its exit code is written by the run itself to a status pipe. A run
+    killed before writing it gets -SIGKILL.
+    """
+
+    def __init__(self, pid: int, stdout_fd: int, status_fd: int):
+        self.pid = pid
+        self.stdout = os.fdopen(stdout_fd, 'r', errors='replace')
+        self.returncode = None
+        self._status = os.fdopen(status_fd, 'rb')
+
+    def _read_status(self) -> None:
+        data = self._status.read()
+        self._status.close()
+        self.returncode = int(data) if data else -signal.SIGKILL
+
+    def poll(self) -> Optional[int]:
+        if self.returncode is None and select.select([self._status], [], [], 0)[0]:
+            self._read_status()
+        return self.returncode
+
+    def wait(self, timeout: float = None) -> int:
+        if self.returncode is None:
+            if not select.select([self._status], [], [], timeout)[0]:
+                raise subprocess.TimeoutExpired(f'warm run {self.pid}', timeout)
+            self._read_status()
+        return self.returncode
+
+    def kill(self) -> None:
+        if self.poll() is None:
+            try:
+                os.killpg(self.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                #  not yet the leader of its own group
+                try:
+                    os.kill(self.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+
+def get_rss(pid: int) -> int:
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class WarmRunner:
+    """Keeps a process with pytest and its plugins already imported, which forks a child for every test run.
+
+    The forked runs share nothing but the imported modules, so they stay isolated from each other. The process is
+    recycled after `max_runs` runs or once its memory grows over `max_rss` bytes.
+    """
+
+    def __init__(self, max_runs: int, max_rss: int, preload: List[str]):
+        self._max_runs = max_runs
+        self._max_rss = max_rss
+        self._preload = preload
+        self._lock = threading.Lock()
+        self._process = None
+        self._socket = None
+        self._runs = 0
+
+    def _spawn(self) -> None:
+        #  SOCK_SEQPACKET keeps the message boundaries and closes the zygote when this side is closed
+        self._socket, zygote_socket = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        with zygote_socket:
+            self._process = subprocess.Popen(
+                [sys.executable, '-m', 'api.pool', str(zygote_socket.fileno())] + self._preload,
+                stdin=subprocess.DEVNULL, pass_fds=[zygote_socket.fileno()]
+            )
+        self._runs = 0
+
+    def _should_recycle(self) -> bool:
+        return (
+            self._process is None or self._process.poll() is not None
+            or self._runs >= self._max_runs or get_rss(self._process.pid) > self._max_rss
+        )
+
+    def warm_up(self) -> None:
+        with self._lock:
+            if self._should_recycle():
+                self._close()
+                self._spawn()
+
+    def start(self, args: List[str], cwd: str = None, env: Optional[Dict[str, str]] = None) -> WarmProcess:
+        with self._lock:
+            if self._should_recycle():
+                self._close()
+                self._spawn()
+            process = self._fork(args, cwd or os.getcwd(), env or {})
+            self._runs += 1
+            if self._should_recycle():
+                #  replaced right away, so that the next run finds a warm process
+                self._close()
+                self._spawn()
+            return process
+
+    def _fork(self, args: List[str], cwd: str, env: Dict[str, str]) -> WarmProcess:
+        stdout_r, stdout_w = os.pipe()
+        status_r, status_w = os.pipe()
+        try:
+            message = json.dumps({'args': args, 'cwd': cwd, 'env': env}).encode()
+            socket.send_fds(self._socket, [message], [stdout_w, status_w])
+            response = self._socket.recv(64)
+            if not response:
+                raise ConnectionError('The warm runner exited')
+        except OSError:
+            os.close(stdout_r)
+            os.close(status_r)
+            self._close()
+            raise
+        finally:
+            os.close(stdout_w)
+            os.close(status_w)
+        return WarmProcess(int(response), stdout_r, status_r)
+
+    def _close(self) -> None:
+        if self._process is None:
+            return
+        #  the zygote exits once its socket is closed, the runs it forked keep going
+        self._socket.close()
+        try:
+            self._process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+        self._process = None
+        self._socket = None
+
+    def close(self) -> None:
+        with self._lock:
+            self._close()
+
+
+def get_warm_runner() -> WarmRunner:
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = WarmRunner(
+                settings.TEST_RUNNER_WARM_MAX_RUNS, settings.TEST_RUNNER_WARM_MAX_RSS, settings.TEST_RUNNER_WARM_PRELOAD
+            )
+        return _runner
+
+
+def _run(job: dict, stdout_fd: int, status_fd: int) -> None:
+    code = 1
+    try:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        os.setsid()
+        os.dup2(stdout_fd, 1)
+        os.dup2(stdout_fd, 2)
+        os.close(stdout_fd)
+        sys.stdout.reconfigure(line_buffering=True)
+        sys.stderr.reconfigure(line_buffering=True)
+        os.chdir(job['cwd'])
+        #  before pytest loads the settings, which read it
+        os.environ.update(job['env'])
+        import pytest
+        code = int(pytest.main(job['args']))
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 1
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os.write(status_fd, str(code).encode())
+            os._exit(0)
+
+
+def _warm_up_pytest() -> None:
+    #  an empty session imports the modules pytest only loads while running, outside of any project config
+    import pytest
+    with tempfile.TemporaryDirectory() as cwd, open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+            pytest.main(['--collect-only', '-q', '-p', 'no:cacheprovider', '-p', 'no:django', '--rootdir', cwd, cwd])
+
+
+def serve(zygote_socket: socket.socket, preload: List[str]) -> None:
+    for module in preload:
+        importlib.import_module(module)
+    for entry_point in importlib.metadata.entry_points(group='pytest11'):
+        try:
+            entry_point.load()
+        except Exception:
+            logger.exception(f'Failed to preload the pytest plugin {entry_point.name}')
+    _warm_up_pytest()
+    #  the forked runs are reaped automatically, their exit codes go through the status pipes
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    while True:
+        message, fds, _, _ = socket.recv_fds(zygote_socket, MAX_MESSAGE_SIZE, 2)
+        if not message:
+            return
+        stdout_fd, status_fd = fds
+        pid = os.fork()
+        if pid == 0:
+            zygote_socket.close()
+            _run(json.loads(message), stdout_fd, status_fd)
+        os.close(stdout_fd)
+        os.close(status_fd)
+        zygote_socket.send(str(pid).encode())
+
+
+if __name__ == '__main__':
+    serve(socket.socket(fileno=int(sys.argv[1])), sys.argv[2:])
@@ -0,0 +1,65 @@
+import time
+from typing import Any, Callable, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def get_test_run_cache_keys(pk: int) -> Tuple[str, str]:
+    return f'test-run:{pk}:detail', f'test-run:{pk}:version'
+
+
+def invalidate(version_key: str, timeout: Optional[float] = None) -> None:
+    #  a new version makes every process miss the entry, the old one expires on its own
+    cache.set(version_key, time.time_ns(), timeout)
+
+
+def invalidate_test_run(pk: int) -> None:
+    invalidate(get_test_run_cache_keys(pk)[1], settings.TEST_RUN_DETAIL_CACHE_FINISHED_SECONDS)
+
+
+def _wait_for_entry(key: str, lock_key: str, version: int) -> Tuple[bool, Any]:
+    deadline = time.monotonic() + settings.RESPONSE_CACHE_LOCK_SECONDS
+    while time.monotonic() < deadline:
+        time.sleep(settings.RESPONSE_CACHE_WAIT_SECONDS)
+        values = cache.get_many([key, lock_key])
+        entry = values.get(key)
+        if entry is not None and entry[0] == version:
+            return True, entry[1]
+        if lock_key not in values:
+            #  computed but not cached, or the holder of the lock failed
+            break
+    return False, None
+
+
+def read_through(
+    key: str, version_key: str, compute: Callable[[], Tuple[Any, float]], version_timeout: Optional[float] = None
+) -> Any:
+    """Returns the value cached under `key`, or the value `compute` returns along with how many seconds to cache it
+    for, 0 for not caching it.
+
+    Entries are stored with the version found in `version_key` before computing them, so a value computed while it
+    was invalidated is never served. On a miss, a single caller computes the value while the others wait for it
+    for up to `RESPONSE_CACHE_LOCK_SECONDS`, so that an invalidated entry doesn't send every reader to the database.
+    """
+    values = cache.get_many([key, version_key])
+    version, entry = values.get(version_key), values.get(key)
+    if version is not None and entry is not None and entry[0] == version:
+        return entry[1]
+    if version is None:
+        version = cache.get_or_set(version_key, time.time_ns, version_timeout)
+
+    lock_key = f'{key}:lock'
+    locked = cache.add(lock_key, version, settings.RESPONSE_CACHE_LOCK_SECONDS)
+    if not locked:
+        found, value = _wait_for_entry(key, lock_key, version)
+        if found:
+            return value
+    try:
+        value, timeout = compute()
+        if timeout:
+            cache.set(key, (version, value), timeout)
+        return value
+    finally:
+        if locked:
+            cache.delete(lock_key)
@@ -0,0 +1,32 @@
+import hashlib
+import json
+import os
+import sys
+from typing import List
+
+from django.conf import settings
+
+from api.dependencies import get_dependencies
+
+
+def get_file_hash(filename: str) -> str:
+    try:
+        with open(filename, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return 'missing'
+
+
+def get_cache_key(paths: List[str], target: str) -> str:
+    """Hashes what the outcome of running the paths on the target env or pool depends on: the content of the test
+    files and of their local dependencies, and the runner configuration."""
+    digest = hashlib.sha256(json.dumps({
+        'paths': sorted(paths),
+        'target': target,
+        'command': settings.TEST_BASE_CMD,
+        'python': sys.version,
+    }).encode())
+    filenames = [os.path.join(settings.BASE_DIR, path) for path in paths]
+    for filename in sorted(get_dependencies(filenames)):
+        digest.update(f'{os.path.relpath(filename, settings.BASE_DIR)}\0{get_file_hash(filename)}\0'.encode())
+    return digest.hexdigest()
@@ -0,0 +1,204 @@
+import logging
+import os
+import queue
+import signal
+import subprocess
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+from xml.etree import ElementTree
+
+from django.conf import settings
+
+from api.pool import WarmProcess, get_warm_runner
+
+
+#  bounds the memory used by a run's output: lines are cut at MAX_LINE_LENGTH characters and at most
+#  MAX_PENDING_LINES of them wait to be consumed, the reader then blocks and the pipe applies backpressure
+MAX_LINE_LENGTH = 64 * 1024
+MAX_PENDING_LINES = 1024
+logger = logging.getLogger(__name__)
+
+
+class LogBuffer:
+    """Collects output of a run and flushes it in batches, by size or by time."""
+
+    def __init__(self, flush: Callable[[str], None], max_size: int = None, max_seconds: float = None):
+        self._flush = flush
+        self._max_size = max_size if max_size is not None else settings.TEST_RUN_LOG_FLUSH_SIZE
+        self._max_seconds = max_seconds if max_seconds is not None else settings.TEST_RUN_LOG_FLUSH_SECONDS
+        self._parts: List[str] = []
+        self._size = 0
+        self._flushed_at = time.monotonic()
+
+    def append(self, text: str) -> None:
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self._max_size:
+            self.flush()
+
+    def flush_if_due(self) -> None:
+        if time.monotonic() - self._flushed_at >= self._max_seconds:
+            self.flush()
+
+    def flush(self) -> None:
+        self._flushed_at = time.monotonic()
+        if not self._parts:
+            return
+        #  save_logs starts every batch on a new line
+        text = ''.join(self._parts).removesuffix('\n')
+        self._parts = []
+        self._size = 0
+        self._flush(text)
+
+
+def start_process(cmd: List[str], env: Optional[Dict[str, str]] = None) -> Union[subprocess.Popen, WarmProcess]:
+    """Starts a test run, with the `env` variables added to the environment of this process."""
+    if settings.TEST_RUNNER_WARM_POOL and cmd[:1] == ['pytest']:
+        try:
+            return get_warm_runner().start(cmd[1:], env=env)
+        except OSError as e:
+            logger.warning(f'Failed to start a warm test run, falling back to a new process: {e}')
+    #  stderr is merged into stdout, so a single reader consumes both in the order they were written
+    return subprocess.Popen(
+        cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace',
+        start_new_session=True, env={**os.environ, **env} if env else None
+    )
+
+
+def signal_process_group(process: Union[subprocess.Popen, WarmProcess], sig: int) -> None:
+    #  runs lead their own process group, signalling it also reaches the processes the tests started
+    try:
+        os.killpg(process.pid, sig)
+    except ProcessLookupError:
+        #  a warm run may not have left the group of its runner yet
+        try:
+            os.kill(process.pid, sig)
+        except ProcessLookupError:
+            pass
+
+
+def terminate_processes(processes: List[subprocess.Popen]) -> None:
+    """Asks the processes to stop, they are still running when it returns."""
+    for process in processes:
+        if process.poll() is None:
+            signal_process_group(process, signal.SIGTERM)
+
+
+def kill_processes(processes: List[subprocess.Popen]) -> None:
+    for process in processes:
+        if process.poll() is None:
+            signal_process_group(process, signal.SIGKILL)
+    for process in processes:
+        process.wait()
+
+
+def _read_lines(index: int, stream, lines: queue.Queue) -> None:
+    for line in iter(lambda: stream.readline(MAX_LINE_LENGTH), ''):
+        lines.put((index, line))
+    lines.put((index, None))
+
+
+def iter_output(processes: List[subprocess.Popen], poll_seconds: float) -> Iterator[Optional[Tuple[int, str]]]:
+    """Yields (process index, output line) of the processes until all of them close their stdout.
+
+    None is yielded every `poll_seconds` without output, so that the caller can do housekeeping.
+    """
+    lines = queue.Queue(maxsize=MAX_PENDING_LINES)
+    readers = [
+        threading.Thread(target=_read_lines, args=(index, process.stdout, lines), daemon=True)
+        for index, process in enumerate(processes)
+    ]
+    for reader in readers:
+        reader.start()
+    running = len(readers)
+    try:
+        while running:
+            try:
+                index, line = lines.get(timeout=poll_seconds)
+            except queue.Empty:
+                yield None
+                continue
+            if line is None:
+                running -= 1
+                continue
+            yield index, line
+    finally:
+        #  unblocks the readers if the caller stopped consuming after killing the processes
+        while any(reader.is_alive() for reader in readers):
+            try:
+                lines.get(timeout=poll_seconds)
+            except queue.Empty:
+                pass
+
+
+def split_into_shards(paths: List[str], durations: Dict[str, float], count: int) -> List[List[str]]:
+    """Splits the paths into at most `count` shards with balanced expected durations.
+
+    Longest paths are placed first, each one into the shard expected to finish first. Paths without a known
+    duration are expected to take the average duration.
+    """
+    known = [duration for duration in durations.values() if duration is not None]
+    default_duration = sum(known) / len(known) if known else 1.0
+    expected = {path: durations.get(path) or default_duration for path in paths}
+
+    shards = [[] for _ in range(min(count, len(paths)))]
+    totals = [0.0] * len(shards)
+    for path in sorted(paths, key=lambda path: expected[path], reverse=True):
+        index = totals.index(min(totals))
+        shards[index].append(path)
+        totals[index] += expected[path]
+    return [sorted(shard) for shard in shards]
+
+
+class JunitTestCase(NamedTuple):
+    path: str
+    nodeid: str
+    outcome: str
+    duration: float
+    message: str
+
+
+def get_module_name(path: str) -> str:
+    #  pytest reports the test classes as dotted module paths relative to the rootdir
+    return os.path.splitext(os.path.normpath(path))[0].replace(os.sep, '.')
+
+
+def _get_outcome(testcase: ElementTree.Element) -> Tuple[str, str]:
+    for tag, outcome in (('failure', 'FAILED'), ('error', 'ERROR'), ('skipped', 'SKIPPED')):
+        element = testcase.find(tag)
+        if element is not None:
+            message = element.get('message', '')
+            if element.text:
+                message = f'{message}\n{element.text}' if message else element.text
+            return outcome, message[:settings.TEST_RESULT_MAX_MESSAGE_LENGTH]
+    return 'PASSED', ''
+
+
+def parse_junit_report(report: str, paths: List[str]) -> List[JunitTestCase]:
+    """Returns the test cases of the paths found in a pytest junit xml report."""
+    try:
+        tree = ElementTree.parse(report)
+    except (OSError, ElementTree.ParseError):
+        return []
+    modules = {get_module_name(path): path for path in paths}
+    testcases = []
+    for testcase in tree.iter('testcase'):
+        classname = testcase.get('classname', '')
+        #  the module of a test is the longest selected module its class name starts with
+        module = max((m for m in modules if classname == m or classname.startswith(m + '.')), key=len, default=None)
+        if module is None:
+            continue
+        path = modules[module]
+        classes = classname[len(module) + 1:]
+        nodeid = '::'.join([path] + (classes.split('.') if classes else []) + [testcase.get('name', '')])
+        outcome, message = _get_outcome(testcase)
+        testcases.append(JunitTestCase(path, nodeid, outcome, float(testcase.get('time') or 0), message))
+    return testcases
+
+
+def get_durations(testcases: List[JunitTestCase]) -> Dict[str, float]:
+    durations = {}
+    for testcase in testcases:
+        durations[testcase.path] = durations.get(testcase.path, 0.0) + testcase.duration
+    return durations
@@ -0,0 +1,323 @@
+import math
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import redis
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+#  queued requests are ordered by (-priority, creation time in ms), packed in a single sortable score
+PRIORITY_STEP = 2 ** 44
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_score(priority: int, created_at) -> float:
+    return -priority * PRIORITY_STEP + int(created_at.timestamp() * 1000)
+
+
+def get_priority(score: float) -> int:
+    return -math.floor(score / PRIORITY_STEP)
+
+
+class BaseScheduler:
+    """Decides which queued request is dispatched next.
+
+    The request with the highest priority goes first. Among equal priorities, users get weighted fair shares: each
+    dispatch advances the pass of the user by 1 / weight, and the user with the lowest pass goes first (stride
+    scheduling). Users reaching their cap of running requests are skipped, and nothing is dispatched while all
+    the slots are taken.
+
+    Each slot remembers the dispatch which took it, so that a stale message of a request dispatched again, e.g.
+    after its node died, neither runs it nor frees the slot of the new dispatch.
+
+    Subclasses store the state, every decision is made under `lock`.
+    """
+
+    def lock(self):
+        raise NotImplementedError
+
+    def _get_active_users(self) -> Dict[str, float]:
+        raise NotImplementedError
+
+    def _set_active_user(self, user: str, user_pass: float) -> None:
+        raise NotImplementedError
+
+    def _deactivate_user(self, user: str, user_pass: float) -> None:
+        raise NotImplementedError
+
+    def _get_saved_pass(self, user: str) -> float:
+        raise NotImplementedError
+
+    def _get_virtual_time(self) -> float:
+        raise NotImplementedError
+
+    def _set_virtual_time(self, value: float) -> None:
+        raise NotImplementedError
+
+    def _add_requests(self, user: str, scores: Dict[int, float]) -> None:
+        raise NotImplementedError
+
+    def _get_head(self, user: str) -> Optional[Tuple[int, float]]:
+        raise NotImplementedError
+
+    def _remove_request(self, user: str, request_id: int) -> bool:
+        raise NotImplementedError
+
+    def _get_running(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+    def _get_running_ids(self) -> List[int]:
+        raise NotImplementedError
+
+    def _get_dispatch_id(self, request_id: int) -> Optional[str]:
+        raise NotImplementedError
+
+    def _add_running(self, request_id: int, user: str, dispatch_id: str) -> None:
+        raise NotImplementedError
+
+    def _remove_running(self, request_id: int) -> bool:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    @staticmethod
+    def get_weight(user: str) -> float:
+        return settings.TEST_RUN_USER_WEIGHTS.get(user, 1)
+
+    @staticmethod
+    def get_max_running(user: str) -> int:
+        return settings.TEST_RUN_USER_MAX_RUNNING.get(user, settings.TEST_RUN_DEFAULT_USER_MAX_RUNNING)
+
+    def push(self, request_id: int, user: str, priority: int, created_at) -> None:
+        self.push_many([(request_id, user, priority, created_at)])
+
+    def push_many(self, requests: Iterable[Tuple[int, str, int, datetime]]) -> None:
+        scores = {}
+        for request_id, user, priority, created_at in requests:
+            scores.setdefault(user, {})[request_id] = get_score(priority, created_at)
+        with self.lock():
+            active_users = self._get_active_users()
+            for user, user_scores in scores.items():
+                if user not in active_users:
+                    #  idle users don't bank credit, they restart from the current virtual time
+                    self._set_active_user(user, max(self._get_saved_pass(user), self._get_virtual_time()))
+                self._add_requests(user, user_scores)
+
+    def pop(self, dispatch_id: str = '') -> Optional[int]:
+        with self.lock():
+            running = self._get_running()
+            if sum(running.values()) >= settings.TEST_RUN_SCHEDULER_SLOTS:
+                return None
+            best = None
+            for user, user_pass in self._get_active_users().items():
+                if running.get(user, 0) >= self.get_max_running(user):
+                    continue
+                head = self._get_head(user)
+                if head is None:
+                    self._deactivate_user(user, user_pass)
+                    continue
+                request_id, score = head
+                key = (-get_priority(score), user_pass, score)
+                if best is None or key < best[0]:
+                    best = (key, user, user_pass, request_id)
+            if best is None:
+                return None
+
+            _, user, user_pass, request_id = best
+            self._remove_request(user, request_id)
+            self._add_running(request_id, user, dispatch_id)
+            user_pass += 1 / self.get_weight(user)
+            self._set_virtual_time(max(self._get_virtual_time(), best[0][1]))
+            if self._get_head(user) is None:
+                self._deactivate_user(user, user_pass)
+            else:
+                self._set_active_user(user, user_pass)
+            return request_id
+
+    def get_running_ids(self) -> List[int]:
+        with self.lock():
+            return self._get_running_ids()
+
+    def is_dispatched(self, request_id: int, dispatch_id: str) -> bool:
+        with self.lock():
+            return self._get_dispatch_id(request_id) == dispatch_id
+
+    def release(self, request_id: int, dispatch_id: Optional[str] = None) -> bool:
+        """Frees the slot of the request, only if it was taken by `dispatch_id` when given."""
+        with self.lock():
+            if dispatch_id is not None and self._get_dispatch_id(request_id) != dispatch_id:
+                return False
+            return self._remove_running(request_id)
+
+    def remove(self, request_id: int, user: str) -> bool:
+        with self.lock():
+            return self._remove_request(user, request_id)
+
+
+class MemoryScheduler(BaseScheduler):
+    """Keeps the state in the process, for development and tests where everything runs in a single process."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    @contextmanager
+    def lock(self) -> Iterator[None]:
+        with self._lock:
+            yield
+
+    def clear(self) -> None:
+        self._active_users = {}
+        self._saved_passes = {}
+        self._virtual_time = 0.0
+        self._queues: Dict[str, Dict[int, float]] = {}
+        self._running: Dict[int, Tuple[str, str]] = {}  # request id: (user, dispatch id)
+
+    def _get_active_users(self):
+        return dict(self._active_users)
+
+    def _set_active_user(self, user, user_pass):
+        self._active_users[user] = user_pass
+
+    def _deactivate_user(self, user, user_pass):
+        self._active_users.pop(user, None)
+        self._saved_passes[user] = user_pass
+
+    def _get_saved_pass(self, user):
+        return self._saved_passes.get(user, 0.0)
+
+    def _get_virtual_time(self):
+        return self._virtual_time
+
+    def _set_virtual_time(self, value):
+        self._virtual_time = value
+
+    def _add_requests(self, user, scores):
+        self._queues.setdefault(user, {}).update(scores)
+
+    def _get_head(self, user):
+        queue = self._queues.get(user)
+        if not queue:
+            return None
+        return min(queue.items(), key=lambda item: (item[1], item[0]))
+
+    def _remove_request(self, user, request_id):
+        return self._queues.get(user, {}).pop(request_id, None) is not None
+
+    def _get_running(self):
+        running = {}
+        for user, _ in self._running.values():
+            running[user] = running.get(user, 0) + 1
+        return running
+
+    def _get_running_ids(self):
+        return list(self._running)
+
+    def _get_dispatch_id(self, request_id):
+        return self._running[request_id][1] if request_id in self._running else None
+
+    def _add_running(self, request_id, user, dispatch_id):
+        self._running[request_id] = (user, dispatch_id)
+
+    def _remove_running(self, request_id):
+        return self._running.pop(request_id, None) is not None
+
+
+class RedisScheduler(BaseScheduler):
+    """Keeps the state in Redis, shared by the web and worker processes."""
+
+    def __init__(self, url: str, prefix: str = 'test-run:scheduler'):
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self._prefix = prefix
+
+    def _key(self, *parts) -> str:
+        return ':'.join((self._prefix, ) + parts)
+
+    def lock(self):
+        return self._client.lock(self._key('lock'), timeout=settings.TEST_RUN_SCHEDULER_LOCK_SECONDS)
+
+    def clear(self) -> None:
+        keys = list(self._client.scan_iter(self._key('*')))
+        if keys:
+            self._client.delete(*keys)
+
+    def _get_active_users(self):
+        return dict(self._client.zrange(self._key('users'), 0, -1, withscores=True))
+
+    def _set_active_user(self, user, user_pass):
+        self._client.zadd(self._key('users'), {user: user_pass})
+
+    def _deactivate_user(self, user, user_pass):
+        pipeline = self._client.pipeline()
+        pipeline.zrem(self._key('users'), user)
+        pipeline.hset(self._key('passes'), user, user_pass)
+        pipeline.execute()
+
+    def _get_saved_pass(self, user):
+        return float(self._client.hget(self._key('passes'), user) or 0)
+
+    def _get_virtual_time(self):
+        return float(self._client.get(self._key('virtual-time')) or 0)
+
+    def _set_virtual_time(self, value):
+        self._client.set(self._key('virtual-time'), value)
+
+    def _add_requests(self, user, scores):
+        self._client.zadd(self._key('queue', user), scores)
+
+    def _get_head(self, user):
+        head = self._client.zrange(self._key('queue', user), 0, 0, withscores=True)
+        return (int(head[0][0]), head[0][1]) if head else None
+
+    def _remove_request(self, user, request_id):
+        return bool(self._client.zrem(self._key('queue', user), request_id))
+
+    def _get_running(self):
+        running = {}
+        for user in self._client.hvals(self._key('running')):
+            running[user] = running.get(user, 0) + 1
+        return running
+
+    def _get_running_ids(self):
+        return [int(request_id) for request_id in self._client.hkeys(self._key('running'))]
+
+    def _get_dispatch_id(self, request_id):
+        return self._client.hget(self._key('dispatches'), request_id)
+
+    def _add_running(self, request_id, user, dispatch_id):
+        pipeline = self._client.pipeline()
+        pipeline.hset(self._key('running'), request_id, user)
+        pipeline.hset(self._key('dispatches'), request_id, dispatch_id)
+        pipeline.execute()
+
+    def _remove_running(self, request_id):
+        pipeline = self._client.pipeline()
+        pipeline.hdel(self._key('running'), request_id)
+        pipeline.hdel(self._key('dispatches'), request_id)
+        return bool(pipeline.execute()[0])
+
+
+def check_scheduler() -> None:
+    """Fails to start a web or worker process which would keep the scheduler in its own memory: the slots taken by
+    the web process would never be released by the workers, and nothing would be dispatched anymore."""
+    if not settings.TEST_RUN_SCHEDULER_REDIS_URL and not settings.CELERY_TASK_ALWAYS_EAGER:
+        raise ImproperlyConfigured(
+            'TEST_RUN_SCHEDULER_REDIS_URL must be set for the web and worker processes to share the scheduler, e.g. '
+            'to redis://redis:6379/3, unless CELERY_TASK_ALWAYS_EAGER runs the tasks in the web process.'
+        )
+
+
+def get_scheduler() -> BaseScheduler:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            if settings.TEST_RUN_SCHEDULER_REDIS_URL:
+                _scheduler = RedisScheduler(settings.TEST_RUN_SCHEDULER_REDIS_URL)
+            else:
+                _scheduler = MemoryScheduler()
+        return _scheduler
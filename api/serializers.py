@@ -1,10 +1,77 @@
+from django.conf import settings
 from rest_framework import serializers
 
-from api.models import TestRunRequest, TestFilePath, TestEnvironment
+from api.allocator import ANY_POOL
+from api.models import TestRunRequest, TestFilePath, TestEnvironment, TestResult
+
+
+class PrefetchedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Looks the objects up in the `prefetched` dict of the serializer context when it is set, instead of running a
+    query for each of them."""
+
+    def __init__(self, prefetched, **kwargs):
+        self.prefetched = prefetched
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        objects = self.context.get(self.prefetched)
+        if objects is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            instance = objects.get(int(data))
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if instance is None:
+            self.fail('does_not_exist', pk_value=data)
+        return instance
+
+
+def get_pks(items, name):
+    pks = set()
+    for item in items:
+        values = item.get(name) if isinstance(item, dict) else None
+        for value in values if isinstance(values, list) else [values]:
+            if isinstance(value, (int, str)) and str(value).isdigit():
+                pks.add(int(value))
+    return pks
+
+
+class TestRunRequestListSerializer(serializers.ListSerializer):
+    """Validates and creates many requests with a few queries, whatever their number."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            if len(data) > settings.TEST_RUN_BULK_MAX_SIZE:
+                raise serializers.ValidationError(
+                    {'non_field_errors': [f'Ensure there are at most {settings.TEST_RUN_BULK_MAX_SIZE} requests.']}
+                )
+            self._context['envs'] = TestEnvironment.objects.in_bulk(get_pks(data, 'env'))
+            self._context['paths'] = TestFilePath.get_available().in_bulk(get_pks(data, 'path'))
+            self._context['pools'] = {ANY_POOL} | set(TestEnvironment.objects.values_list('pool', flat=True).distinct())
+        return super().to_internal_value(data)
+
+    def create(self, validated_data):
+        instances = TestRunRequest.objects.bulk_create([
+            TestRunRequest(**{name: value for name, value in attrs.items() if name != 'path'})
+            for attrs in validated_data
+        ])
+        TestRunRequestPath = TestRunRequest.path.through
+        TestRunRequestPath.objects.bulk_create([
+            TestRunRequestPath(testrunrequest_id=instance.id, testfilepath_id=path.id)
+            for instance, attrs in zip(instances, validated_data) for path in attrs['path']
+        ])
+        return instances
 
 
 class TestRunRequestSerializer(serializers.ModelSerializer):
     env_name = serializers.ReadOnlyField(source='env.name')
+    env = PrefetchedPrimaryKeyRelatedField('envs', queryset=TestEnvironment.objects.all(), allow_null=True)
+    path = PrefetchedPrimaryKeyRelatedField(
+        'paths', queryset=TestFilePath.get_available(), many=True, allow_empty=False
+    )
+    changed_files = serializers.ListField(child=serializers.CharField(max_length=1024), required=False)
 
     class Meta:
         model = TestRunRequest
@@ -15,19 +82,65 @@ class TestRunRequestSerializer(serializers.ModelSerializer):
             'path',
             'status',
             'created_at',
-            'env_name'
+            'env_name',
+            'parallelism',
+            'priority',
+            'pool',
+            'use_cache',
+            'cached_from',
+            'changed_files',
+            'timeout_seconds',
+            'started_at',
+            'finished_at'
         )
         read_only_fields = (
             'id',
             'created_at',
             'status',
-            'logs',
-            'env_name'
+            'env_name',
+            'cached_from',
+            'started_at',
+            'finished_at'
         )
+        list_serializer_class = TestRunRequestListSerializer
+
+    def validate_parallelism(self, value):
+        if not 1 <= value <= settings.TEST_RUN_MAX_PARALLELISM:
+            raise serializers.ValidationError(f'Ensure this value is between 1 and {settings.TEST_RUN_MAX_PARALLELISM}.')
+        return value
+
+    def validate_priority(self, value):
+        if value > settings.TEST_RUN_MAX_PRIORITY:
+            raise serializers.ValidationError(f'Ensure this value is between 0 and {settings.TEST_RUN_MAX_PRIORITY}.')
+        return value
+
+    def validate_timeout_seconds(self, value):
+        if value is not None and not 1 <= value <= settings.TEST_RUN_MAX_TIMEOUT_SECONDS:
+            raise serializers.ValidationError(
+                f'Ensure this value is between 1 and {settings.TEST_RUN_MAX_TIMEOUT_SECONDS}.'
+            )
+        return value
+
+    def validate_pool(self, value):
+        pools = self.context.get('pools')
+        exists = value in pools if pools is not None else TestEnvironment.get_pool(value).exists()
+        if value and not exists:
+            raise serializers.ValidationError('There is no test environment in this pool.')
+        return value
+
+    def validate(self, attrs):
+        if attrs.get('env') is None and not attrs.get('pool'):
+            raise serializers.ValidationError({'env': ['Select an env, or a pool to run on any idle env of it.']})
+        if attrs.get('env') is not None and attrs.get('pool'):
+            raise serializers.ValidationError({'pool': ['Select either an env or a pool.']})
+        return attrs
 
 
 class TestRunRequestItemSerializer(serializers.ModelSerializer):
     env_name = serializers.ReadOnlyField(source='env.name')
+    #  the last TEST_RUN_LOG_READ_LIMIT characters of the logs, the earlier ones are read through the logs endpoint
+    logs = serializers.ReadOnlyField(source='read_log_tail')
+    logs_offset = serializers.ReadOnlyField(source='get_log_tail_offset')
 
     class Meta:
         model = TestRunRequest
@@ -39,10 +152,65 @@ class TestRunRequestItemSerializer(serializers.ModelSerializer):
             'status',
             'created_at',
             'env_name',
+            'parallelism',
+            'priority',
+            'pool',
+            'use_cache',
+            'cached_from',
+            'changed_files',
+            'timeout_seconds',
+            'started_at',
+            'finished_at',
+            'log_size',
+            'logs_offset',
             'logs'
         )
 
 
+class TestRunRequestListQuerySerializer(serializers.Serializer):
+    status = serializers.ChoiceField(choices=TestRunRequest.StatusChoices.get_as_tuple(), required=False)
+    env = serializers.IntegerField(min_value=1, required=False)
+    requested_by = serializers.CharField(max_length=128, required=False)
+    path = serializers.IntegerField(min_value=1, required=False)
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
+
+    def get_filters(self):
+        lookups = {
+            'status': 'status',
+            'env': 'env_id',
+            'requested_by': 'requested_by',
+            'path': 'path',
+            'created_after': 'created_at__gte',
+            'created_before': 'created_at__lt',
+        }
+        return {lookups[name]: value for name, value in self.validated_data.items()}
+
+
+class TestRunStatsQuerySerializer(serializers.Serializer):
+    days = serializers.IntegerField(min_value=1, max_value=366, default=7)
+    env = serializers.IntegerField(min_value=1, required=False)
+
+
+class TestRunRequestLogsQuerySerializer(serializers.Serializer):
+    offset = serializers.IntegerField(min_value=0, default=0)
+    limit = serializers.IntegerField(
+        min_value=1, max_value=settings.TEST_RUN_LOG_READ_LIMIT, default=settings.TEST_RUN_LOG_READ_LIMIT
+    )
+
+
+class TestRunLogSearchQuerySerializer(serializers.Serializer):
+    #  shorter terms can't use the trigram index
+    q = serializers.CharField(min_length=3, max_length=256, trim_whitespace=False)
+    status = serializers.ChoiceField(choices=TestRunRequest.StatusChoices.get_as_tuple(), required=False)
+    env = serializers.IntegerField(min_value=1, required=False)
+    requested_by = serializers.CharField(max_length=128, required=False)
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
+    before_id = serializers.IntegerField(min_value=1, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=settings.TEST_RUN_LOG_SEARCH_MAX_RESULTS, default=20)
+
+
 class TestFilePathSerializer(serializers.ModelSerializer):
     class Meta:
         model = TestFilePath
@@ -53,3 +221,18 @@ class TestEnvironmentSerializer(serializers.ModelSerializer):
     class Meta:
         model = TestEnvironment
         fields = ('id', 'name')
+
+
+class TestResultSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = TestResult
+        fields = ('id', 'request', 'path', 'nodeid', 'outcome', 'duration', 'message', 'created_at')
+
+
+class TestResultHistoryQuerySerializer(serializers.Serializer):
+    nodeid = serializers.CharField()
+
+
+class TestResultStatsQuerySerializer(serializers.Serializer):
+    days = serializers.IntegerField(min_value=1, default=7)
+    limit = serializers.IntegerField(min_value=1, max_value=500, default=50)
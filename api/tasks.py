@@ -1,54 +1,363 @@
 import logging
-import subprocess
+import os
+import tempfile
+import time
+import uuid
+from typing import List, Optional
 
 from celery import shared_task
 from django.conf import settings
 
-from api.models import TestRunRequest, TestEnvironment
+from api.allocator import ANY_POOL
+from api.dependencies import select_affected_paths
+from api.discovery import sync_test_file_paths
+from api.metrics import get_metrics
+from api.models import TestRunRequest, TestEnvironment, TestFilePath, TestResult, TestRunCacheEntry, WorkerNode
+from api.result_cache import get_cache_key
+from api.runner import (
+    LogBuffer, get_durations, iter_output, kill_processes, parse_junit_report, split_into_shards, start_process,
+    terminate_processes
+)
+from api.scheduler import get_scheduler
+from api.tracing import trace_test_run
+from api.utils import get_lease_owner
 
 
 logger = logging.getLogger(__name__)
-MAX_RETRY = 10
 
 
-def handle_task_retry(instance: TestRunRequest, retry: int) -> None:
-    if retry < MAX_RETRY:
-        countdown = 2 ** retry
-        logger.warning(f'Test Environment is busy, Retrying in {countdown}')
-        instance.save_logs(logs=f"Failed to run tests on env {instance.env.name} retrying in {countdown} seconds.")
-        instance.mark_as_retrying()
-        execute_test_run_request.s(instance.id, retry + 1).apply_async(countdown=countdown)
-    else:
-        logger.error(
-            f"Failed to run tests(ID:{instance.id}) on env {instance.env.name} after retrying {MAX_RETRY} times."
-        )
-        instance.save_logs(logs=f"Failed to run tests on env {instance.env.name} after retrying {MAX_RETRY} times.")
-        instance.mark_as_failed_to_start()
+def queue_test_run_request(instance: TestRunRequest) -> None:
+    if not instance.mark_as_retrying():
+        #  already queued or picked up by another worker
+        return
+    if instance.env is None:
+        envs = 'All envs' if instance.pool == ANY_POOL else f'All envs of pool {instance.pool}'
+        logger.info(f'{envs} are busy, tests(ID:{instance.id}) queued')
+        instance.save_logs(logs=f"{envs} are busy, waiting for the running tests to finish.")
+        return
+    logger.info(f'Test Environment {instance.env.name} is busy, tests(ID:{instance.id}) queued')
+    instance.save_logs(logs=f"Env {instance.env.name} is busy, waiting for the running tests to finish.")
 
 
-@shared_task
-def execute_test_run_request(instance_id: int, retry: int = 0) -> None:
-    instance = TestRunRequest.objects.get(id=instance_id)
+def schedule_test_run_request(instance: TestRunRequest) -> None:
+    schedule_test_run_requests([instance])
+
+
+def schedule_test_run_requests(instances: List[TestRunRequest]) -> None:
+    get_scheduler().push_many(
+        (instance.id, instance.requested_by, instance.priority, instance.created_at) for instance in instances
+    )
+    dispatch_test_run_requests()
+
 
-    if instance.env.is_busy():
-        handle_task_retry(instance, retry)
+def dispatch_test_run_requests() -> None:
+    scheduler = get_scheduler()
+    #  the task id identifies the dispatch holding the slot
+    while (instance_id := scheduler.pop(dispatch_id := str(uuid.uuid4()))) is not None:
+        with trace_test_run('test_run.dispatch', instance_id):
+            node = TestRunRequest.route(instance_id) if settings.TEST_RUN_NODE_ROUTING else None
+            if node is None:
+                execute_test_run_request.apply_async((instance_id, ), task_id=dispatch_id)
+            else:
+                execute_test_run_request.apply_async((instance_id, ), task_id=dispatch_id, queue=node.get_queue())
+
+
+def dispatch_next_test_run_request(env: TestEnvironment) -> None:
+    #  oldest first among the requests waiting for the env, the scheduler still decides when it's dispatched
+    next_instance = TestRunRequest.get_next_retrying(env)
+    if next_instance is not None:
+        schedule_test_run_request(next_instance)
+
+
+@shared_task(bind=True)
+def execute_test_run_request(self, instance_id: int) -> None:
+    #  None when called directly instead of dispatched
+    dispatch_id = self.request.id
+    if dispatch_id is not None and not get_scheduler().is_dispatched(instance_id, dispatch_id):
+        #  its slot was released and the request dispatched again since, e.g. after its node died
+        logger.info(f'Stale dispatch of tests(ID:{instance_id}) ignored.')
         return
+    try:
+        with trace_test_run('test_run.execute', instance_id):
+            _execute_test_run_request(instance_id)
+    finally:
+        #  frees the scheduler slot taken when the request was dispatched
+        get_scheduler().release(instance_id, dispatch_id)
+        dispatch_test_run_requests()
+
+
+def _execute_test_run_request(instance_id: int) -> None:
+    instance = TestRunRequest.objects.select_related('env__node').get(id=instance_id)
+    if not instance.is_pending():
+        return
+    if instance.use_cache and serve_from_cache(instance):
+        #  served without occupying the env
+        return
+
+    env = instance.env
+    node = WorkerNode.get_local()
+    if node is not None and env is not None and env.node is not None and env.node != node and env.node.is_alive():
+        #  sent before its env moved to another node, sent again to that node once the slot is released
+        get_scheduler().push(instance.id, instance.requested_by, instance.priority, instance.created_at)
+        return
+    lease_owner = get_lease_owner()
+    env = lock_env(instance, lease_owner, node)
+    if env is None:
+        #  no need to retry, the next pending request is dispatched as soon as an env gets unlocked
+        queue_test_run_request(instance)
+        #  unless it was unlocked before the request was marked as retrying, and then couldn't find it
+        env = lock_env(instance, lease_owner, node)
+        if env is None:
+            return
+
+    try:
+        #  the request the scheduler picked runs, so that its priority, fair share and caps hold
+        if not instance.mark_as_running(env):
+            return
+        with trace_test_run('test_run.run', instance.id, env=env.name):
+            run_test_run_request(instance, env, lease_owner)
+    finally:
+        #  if the lease was lost, the reaper has already released the env and requeued the request
+        if env.try_unlock(lease_owner):
+            dispatch_next_test_run_request(env)
+
+
+def lock_env(
+    instance: TestRunRequest, lease_owner: str, node: Optional[WorkerNode] = None
+) -> Optional[TestEnvironment]:
+    if instance.env is None:
+        return TestEnvironment.allocate(instance.pool, lease_owner, node)
+    return instance.env if instance.env.try_lock(lease_owner) else None
+
+
+def serve_from_cache(instance: TestRunRequest) -> bool:
+    entry = TestRunCacheEntry.lookup(get_cache_key(instance.get_paths(), instance.get_target()))
+    if entry is None:
+        return False
+    source = entry.request
+    instance.save_logs(logs=f"Tests and env unchanged since tests(ID:{source.id}), reusing their result.")
+    instance.copy_logs(source)
+    if not instance.mark_as_cached(source):
+        return False
+    logger.info(f'tests(ID:{instance.id}) served from the cached result of tests(ID:{source.id})')
+    return True
+
+
+def cancel_test_run_request(instance: TestRunRequest) -> bool:
+    """Cancels a pending or running request. The worker running it stops the tests within seconds, and a
+    dispatched but not started one skips it."""
+    if instance.cancel(TestRunRequest.PENDING_STATUSES):
+        get_scheduler().remove(instance.id, instance.requested_by)
+        instance.save_logs(logs="Cancelled before starting.")
+    elif not instance.cancel((TestRunRequest.StatusChoices.RUNNING.name, )):
+        return False
+    logger.info(f'tests(ID:{instance.id}) cancelled')
+    return True
+
 
-    env = TestEnvironment.objects.get(name=instance.env.name)
-    env.lock()
+def select_test_paths(instance: TestRunRequest, paths: List[str]) -> List[str]:
+    affected_paths = select_affected_paths(TestFilePath.objects.filter(path__in=paths), instance.changed_files)
+    if affected_paths is None:
+        instance.save_logs(logs=f"The dependency map is outdated, running all the {len(paths)} test files.")
+        return paths
+    instance.save_logs(logs=f"Running {len(affected_paths)} of {len(paths)} test files, affected by the changes.")
+    return [path for path in paths if path in affected_paths]
 
-    cmd = instance.get_command()
-    logger.info(f'Running tests(ID:{instance_id}), CMD({" ".join(cmd)}) on env {instance.env.name}')
 
-    instance.mark_as_running()
+def run_test_run_request(instance: TestRunRequest, env: TestEnvironment, lease_owner: str) -> None:
+    paths = instance.get_paths()
+    #  hashed before running, the files may change while the tests run
+    cache_key = get_cache_key(paths, instance.get_target()) if instance.use_cache else None
+    if instance.changed_files:
+        selected_paths = select_test_paths(instance, paths)
+        if not selected_paths:
+            #  without paths pytest would run everything it finds
+            instance.mark_as_success()
+            return
+        if len(selected_paths) < len(paths):
+            #  the result only covers the affected files, it can't be reused for all the paths of the key
+            cache_key = None
+        paths = selected_paths
+    durations = dict(TestFilePath.objects.filter(path__in=paths).values_list('path', 'duration'))
+    shards = split_into_shards(paths, durations, instance.parallelism) or [[]]
 
-    run = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    return_code = run.wait(timeout=settings.TEST_RUN_REQUEST_TIMEOUT_SECONDS)
+    with tempfile.TemporaryDirectory() as reports_dir:
+        reports = [os.path.join(reports_dir, f'shard-{index}.xml') for index in range(len(shards))]
+        runs = []
+        started_at = time.perf_counter()
+        try:
+            for index, (shard, report) in enumerate(zip(shards, reports)):
+                cmd = instance.get_command(shard)
+                logger.info(f'Running tests(ID:{instance.id}), CMD({" ".join(cmd)}) on env {env.name}')
+                #  isolates what the shards would otherwise share, e.g. the test database of the Django tests
+                shard_env = {'TEST_RUN_SHARD': str(index)} if len(shards) > 1 else None
+                runs.append(start_process(cmd + [f'--junitxml={report}'], env=shard_env))
 
-    env.unlock()
-    instance.save_logs(logs=run.stdout.read())
-    if return_code == 0:
+            logs = LogBuffer(instance.save_logs)
+            timeout_seconds = instance.get_timeout_seconds()
+            deadline = time.monotonic() + timeout_seconds
+            heartbeat_at = time.monotonic() + settings.TEST_ENV_LEASE_HEARTBEAT_SECONDS
+            cancel_check_at = time.monotonic() + settings.TEST_RUN_CANCEL_CHECK_SECONDS
+            #  stopped runs are asked to terminate, and killed if they are still running after a grace period
+            stopped, timed_out, kill_at = False, False, None
+            #  kept referenced, closing it waits for the output to end, which only happens once the runs are killed
+            outputs = iter_output(runs, poll_seconds=settings.TEST_RUN_LOG_FLUSH_SECONDS)
+            for output in outputs:
+                if output is not None:
+                    index, line = output
+                    logs.append(f'[shard {index + 1}] {line}' if len(runs) > 1 else line)
+                logs.flush_if_due()
+
+                now = time.monotonic()
+                if now >= heartbeat_at:
+                    if not env.heartbeat(lease_owner):
+                        kill_processes(runs)
+                        get_metrics().observe_since('ionos_test_run_process_seconds', started_at, outcome='aborted')
+                        logger.warning(f'Lost the lease of env {env.name}, tests(ID:{instance.id}) aborted.')
+                        return
+                    heartbeat_at = now + settings.TEST_ENV_LEASE_HEARTBEAT_SECONDS
+                if stopped:
+                    if kill_at is not None and now >= kill_at:
+                        kill_processes(runs)
+                        kill_at = None
+                    continue
+                if now >= cancel_check_at:
+                    stopped = instance.is_cancelled()
+                    cancel_check_at = now + settings.TEST_RUN_CANCEL_CHECK_SECONDS
+                if not stopped and now > deadline and any(run.poll() is None for run in runs):
+                    stopped = timed_out = True
+                if stopped:
+                    reason = f'Timed out after {timeout_seconds} seconds' if timed_out else 'Cancelled'
+                    logger.warning(f'tests(ID:{instance.id}) on env {env.name}: {reason}.')
+                    logs.append(f'{reason}, stopping the tests.\n')
+                    terminate_processes(runs)
+                    kill_at = now + settings.TEST_RUN_KILL_GRACE_SECONDS
+            logs.flush()
+            return_codes = [run.wait() for run in runs]
+        except BaseException:
+            #  e.g. the worker shutting down or a database error, the tests must not keep running on the env
+            kill_processes(runs)
+            raise
+        if stopped:
+            outcome = 'timed_out' if timed_out else 'cancelled'
+        else:
+            outcome = 'passed' if all(return_code == 0 for return_code in return_codes) else 'failed'
+        metrics = get_metrics()
+        metrics.observe_since('ionos_test_run_process_seconds', started_at, outcome=outcome)
+        metrics.observe('ionos_test_run_log_bytes', instance.log_size)
+        if stopped and not timed_out:
+            #  already marked as cancelled, the partial logs are kept but not the partial results
+            logger.info(f'tests(ID:{instance.id}) on env {env.name} cancelled.')
+            return
+
+        testcases = [
+            testcase for shard, report in zip(shards, reports) for testcase in parse_junit_report(report, shard)
+        ]
+    TestResult.record(instance, testcases)
+    TestFilePath.record_durations(get_durations(testcases))
+    TestFilePath.refresh_dependencies(paths)
+
+    if all(return_code == 0 for return_code in return_codes) and not timed_out:
         instance.mark_as_success()
     else:
         instance.mark_as_failed()
-    logger.info(f'tests(ID:{instance_id}), CMD({" ".join(cmd)}) on env {instance.env.name} Completed successfully.')
+    if cache_key is not None and not timed_out:
+        TestRunCacheEntry.store(cache_key, instance)
+    logger.info(f'tests(ID:{instance.id}) on env {env.name} Completed successfully.')
+
+
+@shared_task
+def reap_expired_env_leases() -> None:
+    #  also repairs the free list, which is only a hint
+    TestEnvironment.rebuild_free_list()
+    for env in TestEnvironment.get_expired_leases():
+        if not env.reclaim():
+            continue
+        for instance in TestRunRequest.objects.filter(env=env, status=TestRunRequest.StatusChoices.RUNNING.name):
+            get_scheduler().release(instance.id)
+            if instance.requeue():
+                logger.warning(f'Lease of env {env.name} expired, tests(ID:{instance.id}) requeued.')
+                instance.save_logs(logs=f"Lost the worker running on env {env.name}, tests requeued.")
+        dispatch_next_test_run_request(env)
+    release_leaked_slots()
+    schedule_stranded_test_run_requests()
+
+
+def release_leaked_slots() -> None:
+    """Frees the scheduler slots of the requests which are no longer pending or running, e.g. taken by a worker which
+    died before releasing them."""
+    scheduler = get_scheduler()
+    running_ids = scheduler.get_running_ids()
+    active_ids = set(TestRunRequest.objects.filter(
+        id__in=running_ids, status__in=TestRunRequest.UNFINISHED_STATUSES
+    ).values_list('id', flat=True))
+    leaked_ids = [instance_id for instance_id in running_ids if instance_id not in active_ids]
+    for instance_id in leaked_ids:
+        scheduler.release(instance_id)
+    if leaked_ids:
+        logger.warning(f'Scheduler slots of finished tests(IDs:{leaked_ids}) released.')
+        dispatch_test_run_requests()
+
+
+def schedule_stranded_test_run_requests() -> None:
+    """Schedules the retrying requests which could run on an idle env, e.g. if their env was unlocked while they
+    were being queued."""
+    instances = list(TestRunRequest.get_stranded().exclude(id__in=get_scheduler().get_running_ids()))
+    if instances:
+        logger.warning(f'Tests(IDs:{[instance.id for instance in instances]}) waiting for an idle env scheduled.')
+        schedule_test_run_requests(instances)
+
+
+def reroute_test_run_requests(nodes: List[WorkerNode]) -> None:
+    """Sends the pending requests sent to dead nodes again, to the nodes their envs were assigned to since."""
+    scheduler = get_scheduler()
+    instances = TestRunRequest.objects.filter(node__in=nodes, status__in=TestRunRequest.PENDING_STATUSES)
+    #  those not holding a slot aren't in a queue, they wait for their env to get unlocked
+    rerouted = [instance for instance in instances if scheduler.release(instance.id)]
+    if rerouted:
+        logger.warning(f'{len(rerouted)} tests queued on dead nodes sent to other nodes.')
+        schedule_test_run_requests(rerouted)
+
+
+@shared_task
+def reap_dead_worker_nodes() -> None:
+    nodes = WorkerNode.reap()
+    if not nodes:
+        return
+    logger.warning(f'Worker nodes {", ".join(node.name for node in nodes)} are dead, their envs are reassigned.')
+    WorkerNode.balance()
+    reroute_test_run_requests(nodes)
+
+
+@shared_task
+def discover_test_files() -> None:
+    sync_test_file_paths()
+
+
+def _apply_log_tier(queryset, move) -> int:
+    moved = 0
+    while instances := list(queryset.order_by('updated_at', 'id')[:settings.TEST_RUN_LOG_RETENTION_BATCH_SIZE]):
+        batch_moved = sum(move(instance) for instance in instances)
+        moved += batch_moved
+        #  the moved requests leave the queryset, stops on requests which can't be moved instead of looping on them
+        if not batch_moved or len(instances) < settings.TEST_RUN_LOG_RETENTION_BATCH_SIZE:
+            break
+    return moved
+
+
+@shared_task
+def apply_log_retention() -> None:
+    """Moves the logs of finished runs down the tiers as they age: compressed in the database, then archived to the
+    `test_run_logs` storage, then deleted. Every step runs in batches."""
+    LogTier = TestRunRequest.LogTierChoices
+    compressed = _apply_log_tier(TestRunRequest.get_logs_older_than(
+        LogTier.CHUNKS.name, settings.TEST_RUN_LOG_COMPRESS_AFTER_SECONDS
+    ), TestRunRequest.compress_logs)
+    archived = _apply_log_tier(TestRunRequest.get_logs_older_than(
+        LogTier.COMPRESSED.name, settings.TEST_RUN_LOG_ARCHIVE_AFTER_SECONDS
+    ), TestRunRequest.archive_logs)
+    purged = _apply_log_tier(TestRunRequest.get_logs_older_than(
+        LogTier.ARCHIVED.name, settings.TEST_RUN_LOG_RETENTION_SECONDS
+    ), TestRunRequest.purge_logs)
+    if compressed or archived or purged:
+        logger.info(f'Logs of {compressed} runs compressed, {archived} archived and {purged} purged.')
@@ -0,0 +1,42 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from asgiref.sync import iscoroutinefunction
+from django.db import connection, connections
+from django.test import TestCase
+from django.urls import resolve, reverse
+
+from api.db import QueryCounter, query_counter, run_db
+
+
+def run_query():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+    return threading.current_thread().name
+
+
+class TestRunDb(TestCase):
+
+    async def test_run_db_without_pool(self):
+        #  in the thread of the test, which sees the data of its transaction
+        self.assertEqual(threading.main_thread().name, await run_db(run_query))
+
+    async def test_run_db(self):
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-pool')
+        queries = QueryCounter()
+        token = query_counter.set(queries)
+        try:
+            with patch('api.db._executor', executor):
+                self.assertTrue((await run_db(run_query)).startswith('db-pool'))
+                self.assertTrue((await run_db(run_query)).startswith('db-pool'))
+                await run_db(connections.close_all)
+        finally:
+            query_counter.reset(token)
+            executor.shutdown()
+        self.assertEqual(2, queries.count)
+
+    def test_read_views_are_async(self):
+        for url in (reverse('assets'), reverse('test_run_req'), reverse('test_run_req_item', args=(1, ))):
+            self.assertTrue(iscoroutinefunction(resolve(url).func), url)
+        self.assertFalse(iscoroutinefunction(resolve(reverse('test_run_req_bulk')).func))
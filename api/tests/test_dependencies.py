@@ -0,0 +1,79 @@
+import os
+import tempfile
+from datetime import timedelta
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from api.dependencies import get_dependencies, get_path_dependencies, select_affected_paths
+from api.models import TestFilePath
+
+
+class TestDependencies(TestCase):
+
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.base_dir = tmp_dir.name
+        os.makedirs(os.path.join(self.base_dir, 'tests', 'helpers'))
+        os.makedirs(os.path.join(self.base_dir, 'lib'))
+        self.write('lib/__init__.py', '')
+        self.write('lib/core.py', 'VALUE = 1\n')
+        self.write('lib/other.py', 'VALUE = 2\n')
+        self.write('tests/conftest.py', '')
+        self.write('tests/helpers/__init__.py', 'from . import checks\n')
+        self.write('tests/helpers/checks.py', 'import os\n')
+        self.write('tests/test_a.py', 'import json\nfrom lib import core\nimport helpers\n\ndef test_a():\n    pass\n')
+        self.write('tests/test_b.py', 'from lib.other import VALUE\n\ndef test_b():\n    pass\n')
+        settings = override_settings(BASE_DIR=self.base_dir)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def write(self, path, source, age=0):
+        filename = os.path.join(self.base_dir, path)
+        with open(filename, 'w') as f:
+            f.write(source)
+        if age:
+            mtime = (timezone.now() - timedelta(seconds=age)).timestamp()
+            os.utime(filename, (mtime, mtime))
+
+    def test_get_dependencies(self):
+        dependencies = get_dependencies([os.path.join(self.base_dir, 'tests', 'test_a.py')])
+        self.assertEqual({
+            'lib/__init__.py', 'lib/core.py', 'tests/conftest.py', 'tests/helpers/__init__.py',
+            'tests/helpers/checks.py', 'tests/test_a.py'
+        }, {os.path.relpath(dependency, self.base_dir) for dependency in dependencies})
+
+    def test_get_path_dependencies(self):
+        self.assertEqual(
+            ['lib/other.py', 'tests/conftest.py', 'tests/test_b.py'],
+            get_path_dependencies('tests/test_b.py')
+        )
+
+    def get_paths(self):
+        for path in ('tests/test_a.py', 'tests/test_b.py'):
+            TestFilePath.objects.create(path=path)
+        TestFilePath.refresh_dependencies(['tests/test_a.py', 'tests/test_b.py'])
+        return list(TestFilePath.objects.filter(path__startswith='tests/').order_by('path'))
+
+    def test_select_affected_paths(self):
+        paths = self.get_paths()
+        self.assertEqual(['tests/test_a.py'], select_affected_paths(paths, ['lib/core.py']))
+        self.assertEqual(['tests/test_b.py'], select_affected_paths(paths, ['./lib/other.py']))
+        self.assertEqual(['tests/test_a.py', 'tests/test_b.py'], select_affected_paths(paths, ['tests/conftest.py']))
+        self.assertEqual([], select_affected_paths(paths, ['README.md']))
+
+    def test_select_affected_paths_not_mapped(self):
+        TestFilePath.objects.create(path='tests/test_a.py')
+        self.assertIsNone(select_affected_paths(TestFilePath.objects.filter(path='tests/test_a.py'), ['lib/core.py']))
+
+    def test_select_affected_paths_stale(self):
+        paths = self.get_paths()
+        TestFilePath.objects.update(dependencies_updated_at=timezone.now() - timedelta(seconds=60))
+        paths = list(TestFilePath.objects.filter(path__startswith='tests/').order_by('path'))
+        self.write('lib/other.py', 'import lib.core\n', age=30)
+        self.assertIsNone(select_affected_paths(paths, ['lib/core.py']))
+
+        TestFilePath.refresh_dependencies(['tests/test_a.py', 'tests/test_b.py'])
+        paths = list(TestFilePath.objects.filter(path__startswith='tests/').order_by('path'))
+        self.assertEqual(['tests/test_a.py', 'tests/test_b.py'], select_affected_paths(paths, ['lib/core.py']))
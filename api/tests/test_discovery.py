@@ -0,0 +1,98 @@
+import os
+import tempfile
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from api.discovery import get_test_names, sync_test_file_paths
+from api.models import TestFilePath, TestRunRequest
+from api.usecases import get_assets_version
+
+
+class TestDiscovery(TestCase):
+    def setUp(self) -> None:
+        TestFilePath.objects.all().delete()
+        cache.clear()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.base_dir = tmp_dir.name
+        self.tests_dir = os.path.join(self.base_dir, 'tests')
+        os.makedirs(os.path.join(self.tests_dir, 'unit'))
+        self.write('tests/__init__.py', '')
+        self.write('tests/test_a.py', 'def test_one():\n    pass\n')
+        self.write('tests/unit/test_b.py', 'class TestB:\n    def test_two(self):\n        pass\n')
+        settings = override_settings(BASE_DIR=self.base_dir, TEST_BASE_DIRS=[self.tests_dir])
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def write(self, path, source):
+        with open(os.path.join(self.base_dir, path), 'w') as f:
+            f.write(source)
+
+    def get_paths(self):
+        return dict(TestFilePath.get_available().values_list('path', 'tests'))
+
+    def test_get_test_names(self):
+        source = (
+            'def test_a(): pass\ndef helper(): pass\nclass TestX:\n    def test_b(self): pass\n    def b(self): pass\n'
+        )
+        self.assertEqual(['test_a', 'TestX::test_b'], get_test_names(source))
+        self.assertEqual([], get_test_names('def ('))
+
+    def test_sync_adds_files_of_subdirectories(self):
+        self.assertTrue(sync_test_file_paths())
+        self.assertEqual(
+            {'tests/test_a.py': ['test_one'], 'tests/unit/test_b.py': ['TestB::test_two']}, self.get_paths()
+        )
+
+    def test_sync_without_changes(self):
+        sync_test_file_paths()
+        version = get_assets_version()
+        with self.assertNumQueries(0):
+            self.assertFalse(sync_test_file_paths())
+        self.assertEqual(version, get_assets_version())
+
+    def test_sync_changes(self):
+        sync_test_file_paths()
+        version = get_assets_version()
+        os.remove(os.path.join(self.tests_dir, 'test_a.py'))
+        self.write('tests/test_c.py', 'def test_three():\n    pass\n')
+        self.write('tests/unit/test_b.py', 'def test_four():\n    pass\n')
+        os.utime(os.path.join(self.tests_dir, 'unit', 'test_b.py'), ns=(1, 1))
+
+        self.assertTrue(sync_test_file_paths())
+        self.assertEqual({'tests/test_c.py': ['test_three'], 'tests/unit/test_b.py': ['test_four']}, self.get_paths())
+        self.assertNotEqual(version, get_assets_version())
+
+    def test_sync_keeps_removed_paths_of_past_runs(self):
+        sync_test_file_paths()
+        path = TestFilePath.objects.get(path='tests/test_a.py')
+        instance = TestRunRequest.objects.create(requested_by='Ramadan')
+        instance.path.add(path)
+        os.remove(os.path.join(self.tests_dir, 'test_a.py'))
+        sync_test_file_paths()
+        self.assertNotIn('tests/test_a.py', self.get_paths())
+        self.assertEqual(['tests/test_a.py'], instance.get_paths())
+
+        self.write('tests/test_a.py', 'def test_one():\n    pass\n')
+        sync_test_file_paths()
+        self.assertEqual(path, TestFilePath.get_available().get(path='tests/test_a.py'))
+
+    def test_sync_concurrent_discovery(self):
+        #  inserted by another discovery since the state was saved
+        sync_test_file_paths()
+        self.write('tests/test_c.py', 'def test_three():\n    pass\n')
+        TestFilePath.objects.create(path='tests/test_c.py')
+        self.assertTrue(sync_test_file_paths())
+        self.assertEqual(1, TestFilePath.objects.filter(path='tests/test_c.py').count())
+
+    def test_sync_without_state_compares_with_database(self):
+        TestFilePath.objects.create(path='tests/removed.py')
+        TestFilePath.objects.create(path='tests/test_a.py')
+        sync_test_file_paths()
+        self.assertEqual(['tests/test_a.py', 'tests/unit/test_b.py'], sorted(self.get_paths()))
+
+    @override_settings(TEST_DISCOVERY_INDEX_TESTS=False)
+    def test_sync_without_indexing(self):
+        sync_test_file_paths()
+        self.assertEqual({'tests/test_a.py': [], 'tests/unit/test_b.py': []}, self.get_paths())
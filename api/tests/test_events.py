@@ -0,0 +1,93 @@
+import json
+from unittest.mock import MagicMock, Mock, patch
+
+import redis
+from django.test import TestCase
+
+from api.events import publish_event, publish_logs, publish_status, publish_statuses, get_stream_name, format_event
+from api.models import TestEnvironment, TestRunRequest
+
+
+class TestPublishEvent(TestCase):
+
+    def setUp(self) -> None:
+        self.client = MagicMock()
+        self.pipeline = self.client.pipeline.return_value
+
+    def test_get_stream_name(self):
+        self.assertEqual('test-run:events', get_stream_name())
+        self.assertEqual('test-run:1:events', get_stream_name(1))
+
+    @patch('api.events.get_redis_client', return_value=None)
+    def test_publish_event_disabled(self, _):
+        publish_event(1, 'status', {'id': 1})
+
+    def test_publish_event(self):
+        with patch('api.events.get_redis_client', return_value=self.client):
+            publish_event(1, 'logs', {'id': 1})
+        self.pipeline.xadd.assert_called_once_with(
+            'test-run:1:events', {'type': 'logs', 'data': '{"id": 1}'}, maxlen=10000, approximate=True
+        )
+        self.assertTrue(self.pipeline.execute.called)
+
+    def test_publish_event_broadcast(self):
+        with patch('api.events.get_redis_client', return_value=self.client):
+            publish_event(1, 'status', {'id': 1}, broadcast=True)
+        self.assertEqual(
+            ['test-run:1:events', 'test-run:events'], [call[0][0] for call in self.pipeline.xadd.call_args_list]
+        )
+
+    def test_publish_event_redis_error(self):
+        self.pipeline.execute.side_effect = redis.ConnectionError
+        with patch('api.events.get_redis_client', return_value=self.client):
+            publish_event(1, 'status', {'id': 1})
+
+    def test_publish_status(self):
+        env = TestEnvironment.objects.create(name='my_env')
+        test_run_req = TestRunRequest.objects.create(requested_by='Ramadan', env=env)
+        with patch('api.events.publish_event') as publish:
+            publish_status(test_run_req)
+        publish.assert_called_once_with(
+            test_run_req.id, 'status', {'id': test_run_req.id, 'status': 'CREATED'}, broadcast=True
+        )
+
+    def test_publish_statuses(self):
+        with patch('api.events.get_redis_client', return_value=self.client):
+            publish_statuses([Mock(id=1, status='CREATED'), Mock(id=2, status='CREATED')])
+        self.assertEqual(4, self.pipeline.xadd.call_count)
+        self.assertEqual(2, self.pipeline.expire.call_count)
+        self.pipeline.execute.assert_called_once_with()
+
+    def test_publish_logs(self):
+        with patch('api.events.publish_event') as publish:
+            publish_logs(1, 10, 'logs')
+        publish.assert_called_once_with(1, 'logs', {'id': 1, 'offset': 10, 'logs': 'logs'})
+
+    def test_format_event(self):
+        self.assertEqual(
+            'id: 1-0\nevent: status\ndata: {"id": 1}\n\n', format_event('1-0', 'status', json.dumps({'id': 1}))
+        )
+
+
+class TestModelEvents(TestCase):
+
+    def setUp(self) -> None:
+        self.env = TestEnvironment.objects.create(name='my_env')
+        self.test_run_req = TestRunRequest.objects.create(requested_by='Ramadan', env=self.env)
+
+    @patch('api.models.publish_status')
+    def test_status_change_published(self, publish):
+        self.test_run_req.mark_as_running()
+        self.test_run_req.mark_as_success()
+        self.assertEqual(2, publish.call_count)
+
+    @patch('api.models.publish_status')
+    def test_no_status_change_not_published(self, publish):
+        self.test_run_req.requeue()
+        self.assertFalse(publish.called)
+
+    @patch('api.models.publish_logs')
+    def test_logs_published(self, publish):
+        self.test_run_req.save_logs('first')
+        self.test_run_req.save_logs('second')
+        publish.assert_called_with(self.test_run_req.id, 6, '\nsecond')
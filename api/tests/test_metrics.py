@@ -0,0 +1,169 @@
+import json
+import sys
+from unittest.mock import MagicMock, patch
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from api.metrics import MemoryMetrics, RedisMetrics, get_metrics, render_metrics
+from api.models import TestEnvironment, TestRunRequest, TestFilePath
+from api.tasks import run_test_run_request
+from api.tracing import get_trace_id, trace_test_run
+
+
+def get_series(name, metrics=None):
+    metrics = metrics or get_metrics()
+    return {key: value for key, value in metrics.collect().items() if key[0] == name}
+
+
+class TestMetrics(TestCase):
+
+    def setUp(self) -> None:
+        self.metrics = MemoryMetrics()
+
+    def test_observe(self):
+        self.metrics.observe('ionos_test_run_log_bytes', 100, outcome='passed')
+        self.metrics.observe('ionos_test_run_log_bytes', 5000, outcome='passed')
+        labels = (('outcome', 'passed'), )
+        self.assertEqual({
+            ('ionos_test_run_log_bytes_bucket', labels, 0): 1,
+            ('ionos_test_run_log_bytes_bucket', labels, 2): 1,
+            ('ionos_test_run_log_bytes_sum', labels, None): 5100,
+            ('ionos_test_run_log_bytes_count', labels, None): 2,
+        }, self.metrics.collect())
+
+    def test_render_metrics(self):
+        self.metrics.observe('ionos_http_db_queries', 3, view='assets', method='GET')
+        self.metrics.observe('ionos_http_db_queries', 1000, view='assets', method='GET')
+        values = self.metrics.collect()
+        values['ionos_test_run_queue_depth', (('env', 'env "1"'), ('pool', '')), None] = 2
+        lines = render_metrics(values).splitlines()
+        self.assertEqual([
+            '# HELP ionos_http_db_queries Database queries per API request.',
+            '# TYPE ionos_http_db_queries histogram',
+            'ionos_http_db_queries_bucket{method="GET",view="assets",le="1"} 0',
+            'ionos_http_db_queries_bucket{method="GET",view="assets",le="2"} 0',
+            'ionos_http_db_queries_bucket{method="GET",view="assets",le="5"} 1',
+        ], lines[:5])
+        self.assertIn('ionos_http_db_queries_bucket{method="GET",view="assets",le="500"} 1', lines)
+        self.assertIn('ionos_http_db_queries_bucket{method="GET",view="assets",le="+Inf"} 2', lines)
+        self.assertIn('ionos_http_db_queries_sum{method="GET",view="assets"} 1003', lines)
+        self.assertIn('ionos_http_db_queries_count{method="GET",view="assets"} 2', lines)
+        self.assertIn('# TYPE ionos_test_run_queue_depth gauge', lines)
+        self.assertIn('ionos_test_run_queue_depth{env="env \\"1\\"",pool=""} 2', lines)
+
+    @override_settings(TEST_RUN_METRICS_FLUSH_SECONDS=60)
+    def test_redis_metrics(self):
+        client = MagicMock()
+        pipeline = client.pipeline.return_value
+        with patch('api.metrics.redis.Redis.from_url', return_value=client):
+            metrics = RedisMetrics('redis://localhost')
+        metrics.inc('ionos_test_run_queue_depth', 2, env='my_env')
+        #  buffered until the flush is due
+        self.assertFalse(pipeline.hincrbyfloat.called)
+
+        client.hgetall.return_value = {json.dumps(['ionos_test_run_queue_depth', [['env', 'my_env']], None]): '5'}
+        self.assertEqual({('ionos_test_run_queue_depth', (('env', 'my_env'), ), None): 5}, metrics.collect())
+        pipeline.hincrbyfloat.assert_called_once_with(
+            'metrics', json.dumps(['ionos_test_run_queue_depth', [['env', 'my_env']], None]), 2
+        )
+
+    @override_settings(TEST_RUN_METRICS_FLUSH_SECONDS=0)
+    def test_redis_metrics_flush_when_due(self):
+        client = MagicMock()
+        with patch('api.metrics.redis.Redis.from_url', return_value=client):
+            metrics = RedisMetrics('redis://localhost')
+        metrics.observe('ionos_celery_task_seconds', 1, task='my_task', state='SUCCESS')
+        self.assertEqual(3, client.pipeline.return_value.hincrbyfloat.call_count)
+
+
+class TestInstrumentation(TestCase):
+
+    def setUp(self) -> None:
+        get_metrics().clear()
+        self.env = TestEnvironment.objects.create(name='my_env')
+
+    def test_env_lock(self):
+        self.env.try_lock('me')
+        self.env.try_lock('me')
+        self.env.try_unlock('me')
+        series = get_series('ionos_test_env_lock_seconds_count')
+        self.assertEqual({
+            ('ionos_test_env_lock_seconds_count', (('operation', 'lock'), ('outcome', 'conflict')), None): 1,
+            ('ionos_test_env_lock_seconds_count', (('operation', 'lock'), ('outcome', 'ok')), None): 1,
+            ('ionos_test_env_lock_seconds_count', (('operation', 'unlock'), ('outcome', 'ok')), None): 1,
+        }, series)
+
+    def test_mark_as_running(self):
+        instance = TestRunRequest.objects.create(requested_by='Ramadan', env=self.env)
+        instance.mark_as_retrying()
+        instance.mark_as_running()
+        self.assertEqual(1, get_series('ionos_test_run_queue_wait_seconds_count')[
+            'ionos_test_run_queue_wait_seconds_count', (), None
+        ])
+        self.assertEqual(1, get_series('ionos_test_run_retrying_seconds_count')[
+            'ionos_test_run_retrying_seconds_count', (), None
+        ])
+
+    @patch('api.models.settings.TEST_BASE_CMD', [sys.executable, '-c', 'print("collected 0 items")'])
+    def test_run_test_run_request(self):
+        instance = TestRunRequest.objects.create(requested_by='Ramadan', env=self.env)
+        instance.path.add(TestFilePath.objects.create(path='path1'))
+        instance.mark_as_running()
+        run_test_run_request(instance, self.env, '')
+        self.assertEqual(1, get_series('ionos_test_run_process_seconds_count')[
+            'ionos_test_run_process_seconds_count', (('outcome', 'passed'), ), None
+        ])
+        self.assertEqual(instance.log_size, get_series('ionos_test_run_log_bytes_sum')[
+            'ionos_test_run_log_bytes_sum', (), None
+        ])
+
+    def test_metrics_view(self):
+        self.client.get(reverse('assets'))
+        TestRunRequest.objects.create(requested_by='Ramadan', env=self.env)
+        TestRunRequest.objects.create(requested_by='Ramadan', pool='*')
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('text/plain; version=0.0.4; charset=utf-8', response['Content-Type'])
+        lines = response.content.decode().splitlines()
+        self.assertIn('ionos_http_request_seconds_count{method="GET",status="200",view="assets"} 1', lines)
+        self.assertIn('ionos_http_db_queries_count{method="GET",status="200",view="assets"} 1', lines)
+        self.assertIn('ionos_test_run_queue_depth{env="my_env",pool=""} 1', lines)
+        self.assertIn('ionos_test_run_queue_depth{env="",pool="*"} 1', lines)
+
+
+    async def test_sync_view_queries_under_asgi(self):
+        labels = (('method', 'GET'), ('status', '200'), ('view', 'test_run_req_stats'))
+        key = ('ionos_http_db_queries_sum', labels, None)
+        before = get_series('ionos_http_db_queries_sum').get(key, 0)
+        response = await self.async_client.get(reverse('test_run_req_stats'))
+        self.assertEqual(200, response.status_code)
+        #  the sync view runs in a thread of Django, not through run_db
+        self.assertGreater(get_series('ionos_http_db_queries_sum')[key], before)
+
+
+class TestTracing(TestCase):
+
+    def test_get_trace_id(self):
+        self.assertEqual(get_trace_id(1), get_trace_id(1))
+        self.assertNotEqual(get_trace_id(1), get_trace_id(2))
+        self.assertLess(get_trace_id(1), 2 ** 128)
+
+    @override_settings(TEST_RUN_TRACING=False)
+    def test_trace_test_run_disabled(self):
+        with patch('api.tracing.trace') as trace:
+            with trace_test_run('test_run.execute', 1):
+                pass
+        self.assertFalse(trace.get_tracer.called)
+
+    @override_settings(TEST_RUN_TRACING=True)
+    def test_trace_test_run(self):
+        with patch('api.tracing.trace') as trace:
+            trace.get_current_span.return_value.get_span_context.return_value.trace_id = 0
+            with trace_test_run('test_run.execute', 1, env='my_env'):
+                pass
+        self.assertEqual(get_trace_id(1), trace.SpanContext.call_args[0][0])
+        trace.get_tracer.return_value.start_as_current_span.assert_called_once_with(
+            'test_run.execute', context=trace.set_span_in_context.return_value,
+            links=[trace.Link.return_value], attributes={'test_run.id': 1, 'env': 'my_env'}
+        )
@@ -1,6 +1,17 @@
-from django.test import TestCase
+import io
+import tempfile
+from datetime import timedelta
 
-from api.models import TestFilePath, TestEnvironment, TestRunRequest
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from api.allocator import ANY_POOL, get_free_list
+from api.models import (
+    TestFilePath, TestEnvironment, TestRunRequest, TestResult, TestRunCacheEntry, TestRunCompressedLog, TestRunRollup,
+    compress_logs, decompress_logs, get_bucket_upper_bound, get_duration_bucket, get_log_search_text, get_log_storage
+)
+from api.runner import JunitTestCase
 
 
 class TestTTestFilePath(TestCase):
@@ -11,6 +22,14 @@ class TestTTestFilePath(TestCase):
     def test__str__(self):
         self.assertEqual('test', str(self.path))
 
+    def test_record_durations(self):
+        TestFilePath.record_durations({'test': 10.0})
+        self.path.refresh_from_db()
+        self.assertEqual(10.0, self.path.duration)
+        TestFilePath.record_durations({'test': 20.0})
+        self.path.refresh_from_db()
+        self.assertAlmostEqual(13.0, self.path.duration)
+
 
 class TestTestEnvironment(TestCase):
 
@@ -56,6 +75,82 @@ class TestTestEnvironment(TestCase):
         self.env.unlock()
         self.assertEqual(TestEnvironment.StatusChoices.IDLE.name, self.env.status)
 
+    def test_lock_stale_instance(self):
+        TestEnvironment.objects.filter(id=self.env.id).update(status=TestEnvironment.StatusChoices.BUSY.name)
+        self.assertFalse(self.env.try_lock('worker'))
+
+    def test_lock_sets_lease(self):
+        self.env.lock('worker')
+        self.env.refresh_from_db()
+        self.assertEqual('worker', self.env.lease_owner)
+        self.assertGreater(self.env.lease_expires_at, timezone.now())
+
+    def test_unlock_other_owner(self):
+        self.env.lock('worker')
+        self.assertFalse(self.env.try_unlock('other_worker'))
+        self.assertTrue(self.env.try_unlock('worker'))
+        self.env.refresh_from_db()
+        self.assertTrue(self.env.is_idle())
+        self.assertEqual('', self.env.lease_owner)
+        self.assertIsNone(self.env.lease_expires_at)
+
+    def test_heartbeat(self):
+        self.env.lock('worker')
+        TestEnvironment.objects.filter(id=self.env.id).update(lease_expires_at=timezone.now())
+        self.assertTrue(self.env.heartbeat('worker'))
+        self.assertFalse(self.env.heartbeat('other_worker'))
+        self.env.refresh_from_db()
+        self.assertGreater(self.env.lease_expires_at, timezone.now())
+
+    def test_get_expired_leases(self):
+        self.env.lock('worker')
+        self.assertEqual([], list(TestEnvironment.get_expired_leases()))
+        TestEnvironment.objects.filter(id=self.env.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual([self.env], list(TestEnvironment.get_expired_leases()))
+
+    def test_reclaim(self):
+        self.env.lock('worker')
+        self.assertFalse(self.env.reclaim())
+        TestEnvironment.objects.filter(id=self.env.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertTrue(self.env.reclaim())
+        self.assertTrue(self.env.is_idle())
+
+
+class TestTestEnvironmentPool(TestCase):
+
+    def setUp(self) -> None:
+        TestEnvironment.objects.all().delete()
+        self.env1 = TestEnvironment.objects.create(name='my_env1', pool='gpu')
+        self.env2 = TestEnvironment.objects.create(name='my_env2', pool='gpu')
+        self.env3 = TestEnvironment.objects.create(name='my_env3')
+        TestEnvironment.rebuild_free_list()
+
+    def test_allocate_pool(self):
+        envs = {TestEnvironment.allocate('gpu', 'worker'), TestEnvironment.allocate('gpu', 'worker')}
+        self.assertEqual({self.env1, self.env2}, envs)
+        self.assertTrue(all(env.is_busy() and env.lease_owner == 'worker' for env in envs))
+        self.assertIsNone(TestEnvironment.allocate('gpu', 'worker'))
+
+    def test_allocate_any_pool(self):
+        envs = {TestEnvironment.allocate(ANY_POOL) for _ in range(3)}
+        self.assertEqual({self.env1, self.env2, self.env3}, envs)
+        self.assertIsNone(TestEnvironment.allocate(ANY_POOL))
+
+    def test_allocate_unlocked_env(self):
+        env = TestEnvironment.allocate('gpu')
+        self.assertIsNotNone(TestEnvironment.allocate('gpu'))
+        env.unlock()
+        self.assertEqual(env, TestEnvironment.allocate('gpu'))
+
+    def test_allocate_skips_envs_locked_elsewhere(self):
+        TestEnvironment.objects.filter(id=self.env1.id).update(status=TestEnvironment.StatusChoices.BUSY.name)
+        self.assertEqual(self.env2, TestEnvironment.allocate('gpu'))
+        self.assertIsNone(TestEnvironment.allocate('gpu'))
+
+    def test_allocate_without_free_list(self):
+        get_free_list().rebuild([])
+        self.assertIn(TestEnvironment.allocate('gpu'), {self.env1, self.env2})
+
 
 class TestTestRunRequest(TestCase):
 
@@ -86,14 +181,107 @@ class TestTestRunRequest(TestCase):
             self.test_run_req.get_command()
         )
 
+    def test_get_command_given_paths(self):
+        self.test_run_req.path.add(self.path1)
+        self.assertEqual(['pytest', '-v', 'path2'], self.test_run_req.get_command(['path2']))
+
     def test_mark_as_running(self):
         self.test_run_req.mark_as_running()
         self.assertEqual(TestRunRequest.StatusChoices.RUNNING.name, self.test_run_req.status)
 
+    def test_mark_as_running_on_env(self):
+        pool_req = TestRunRequest.objects.create(requested_by='Ramadan', pool=ANY_POOL)
+        self.assertTrue(pool_req.mark_as_running(self.env))
+        pool_req.refresh_from_db()
+        self.assertEqual(self.env, pool_req.env)
+
+    def test_requeue_pool_request(self):
+        pool_req = TestRunRequest.objects.create(requested_by='Ramadan', pool=ANY_POOL)
+        pool_req.mark_as_running(self.env)
+        self.assertTrue(pool_req.requeue())
+        pool_req.refresh_from_db()
+        self.assertIsNone(pool_req.env)
+
+    def test_get_next_retrying(self):
+        self.env.pool = 'gpu'
+        other_env = TestEnvironment.objects.create(name='other_env', pool='arm')
+        TestRunRequest.objects.create(requested_by='Ramadan', pool='arm').mark_as_retrying()
+        pool_req = TestRunRequest.objects.create(requested_by='Ramadan', pool='gpu', priority=1)
+        self.assertIsNone(TestRunRequest.get_next_retrying(self.env))
+        pool_req.mark_as_retrying()
+        self.test_run_req.mark_as_retrying()
+        self.assertEqual(pool_req, TestRunRequest.get_next_retrying(self.env))
+        pool_req.mark_as_running()
+        self.assertEqual(self.test_run_req, TestRunRequest.get_next_retrying(self.env))
+        self.assertEqual('arm', TestRunRequest.get_next_retrying(other_env).pool)
+
+    def test_mark_as_cached(self):
+        source = TestRunRequest.objects.create(requested_by='Ramadan', env=self.env)
+        source.mark_as_failed()
+        self.assertTrue(self.test_run_req.mark_as_cached(source))
+        self.test_run_req.refresh_from_db()
+        self.assertEqual(TestRunRequest.StatusChoices.FAILED.name, self.test_run_req.status)
+        self.assertEqual(source, self.test_run_req.cached_from)
+        self.assertFalse(self.test_run_req.mark_as_cached(source))
+
+    def test_copy_logs(self):
+        source = TestRunRequest.objects.create(requested_by='Ramadan', env=self.env)
+        source.save_logs('a')
+        source.save_logs('b')
+        self.test_run_req.save_logs('cached')
+        self.test_run_req.copy_logs(source)
+        self.test_run_req.save_logs('c')
+        self.test_run_req.refresh_from_db()
+        self.assertEqual('\ncached\na\nb\nc', self.test_run_req.logs)
+        self.assertEqual(len(self.test_run_req.logs), self.test_run_req.log_size)
+        self.assertEqual('\nb', self.test_run_req.read_logs(offset=9, limit=2))
+
+    def test_requeue(self):
+        self.assertFalse(self.test_run_req.requeue())
+        self.test_run_req.mark_as_running()
+        self.assertTrue(self.test_run_req.requeue())
+        self.assertEqual(TestRunRequest.StatusChoices.RETRYING.name, self.test_run_req.status)
+
     def test_mark_as_success(self):
         self.test_run_req.mark_as_success()
         self.assertEqual(TestRunRequest.StatusChoices.SUCCESS.name, self.test_run_req.status)
 
+    def test_cancel(self):
+        self.test_run_req.mark_as_running()
+        self.assertTrue(self.test_run_req.cancel())
+        self.assertFalse(self.test_run_req.mark_as_success())
+        self.test_run_req.refresh_from_db()
+        self.assertEqual(TestRunRequest.StatusChoices.CANCELLED.name, self.test_run_req.status)
+        self.assertTrue(self.test_run_req.is_cancelled())
+        self.assertFalse(self.test_run_req.cancel())
+
+    def test_get_timeout_seconds(self):
+        self.assertEqual(settings.TEST_RUN_REQUEST_TIMEOUT_SECONDS, self.test_run_req.get_timeout_seconds())
+        self.test_run_req.timeout_seconds = 10
+        self.assertEqual(10, self.test_run_req.get_timeout_seconds())
+
+    def test_started_and_finished_at(self):
+        self.test_run_req.mark_as_running()
+        self.test_run_req.mark_as_failed()
+        self.test_run_req.refresh_from_db()
+        self.assertLessEqual(self.test_run_req.created_at, self.test_run_req.started_at)
+        self.assertLessEqual(self.test_run_req.started_at, self.test_run_req.finished_at)
+        self.assertEqual(
+            [('FAILED', 'RUN', 1), ('FAILED', 'WAIT', 1)],
+            list(TestRunRollup.objects.order_by('metric').values_list('status', 'metric', 'count'))
+        )
+
+    def test_not_run_durations(self):
+        self.test_run_req.cancel()
+        source = TestRunRequest.objects.create(requested_by='Ramadan', env=self.env, status='SUCCESS')
+        TestRunRequest.objects.create(requested_by='Ramadan', env=self.env).mark_as_cached(source)
+        TestRunRequest.objects.create(requested_by='Ramadan', pool='my_pool').cancel()
+        self.assertCountEqual(
+            [(None, 'CANCELLED', 'NOT_RUN', 1), (self.env.id, 'CANCELLED', 'NOT_RUN', 1),
+             (self.env.id, 'SUCCESS', 'NOT_RUN', 1)],
+            TestRunRollup.objects.values_list('env', 'status', 'metric', 'count')
+        )
+
     def test_mark_as_failed(self):
         self.test_run_req.mark_as_failed()
         self.assertEqual(TestRunRequest.StatusChoices.FAILED.name, self.test_run_req.status)
@@ -113,3 +301,195 @@ class TestTestRunRequest(TestCase):
     def test_save_logs_not_empty(self):
         self.test_run_req.save_logs('logs')
         self.assertEqual('\nlogs', self.test_run_req.logs)
+
+    def test_save_logs_appends_chunks(self):
+        self.test_run_req.save_logs('first')
+        self.test_run_req.save_logs('second')
+        self.assertEqual('\nfirst\nsecond', self.test_run_req.logs)
+        self.assertEqual(13, self.test_run_req.log_size)
+        self.assertEqual(
+            [(0, 0), (1, 6)],
+            list(self.test_run_req.log_chunks.order_by('sequence').values_list('sequence', 'offset'))
+        )
+
+    def test_save_logs_keeps_status(self):
+        TestRunRequest.objects.filter(id=self.test_run_req.id).update(status=TestRunRequest.StatusChoices.RUNNING.name)
+        self.test_run_req.save_logs('logs')
+        self.test_run_req.refresh_from_db()
+        self.assertEqual(TestRunRequest.StatusChoices.RUNNING.name, self.test_run_req.status)
+
+    def test_read_logs_range(self):
+        self.test_run_req.save_logs('first')
+        self.test_run_req.save_logs('second')
+        self.assertEqual('rst\nsec', self.test_run_req.read_logs(offset=3, limit=7))
+        self.assertEqual('ond', self.test_run_req.read_logs(offset=10))
+        self.assertEqual('', self.test_run_req.read_logs(offset=13))
+
+
+class TestTestRunRequestLogTiers(TestCase):
+
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        storages = override_settings(STORAGES={'test_run_logs': {
+            'BACKEND': 'django.core.files.storage.FileSystemStorage', 'OPTIONS': {'location': tmp_dir.name}
+        }})
+        storages.enable()
+        self.addCleanup(storages.disable)
+        env = TestEnvironment.objects.create(name='my_env')
+        self.test_run_req = TestRunRequest.objects.create(requested_by='Ramadan', env=env)
+        self.test_run_req.save_logs('first')
+        self.test_run_req.save_logs('second')
+
+    def test_compress_logs(self):
+        self.assertTrue(self.test_run_req.compress_logs())
+        self.assertFalse(self.test_run_req.compress_logs())
+        self.assertFalse(self.test_run_req.log_chunks.exists())
+        #  no error in the logs
+        self.assertEqual('', TestRunCompressedLog.objects.get().search_text)
+        test_run_req = TestRunRequest.objects.get(id=self.test_run_req.id)
+        self.assertEqual(TestRunRequest.LogTierChoices.COMPRESSED.name, test_run_req.log_tier)
+        self.assertEqual('\nfirst\nsecond', test_run_req.logs)
+        self.assertEqual('rst\nsec', test_run_req.read_logs(offset=3, limit=7))
+
+    def test_archive_logs(self):
+        self.assertFalse(self.test_run_req.archive_logs())
+        self.test_run_req.compress_logs()
+        self.assertTrue(self.test_run_req.archive_logs())
+        self.assertFalse(TestRunCompressedLog.objects.exists())
+        self.assertFalse(self.test_run_req.log_chunks.exists())
+        test_run_req = TestRunRequest.objects.get(id=self.test_run_req.id)
+        self.assertEqual(TestRunRequest.LogTierChoices.ARCHIVED.name, test_run_req.log_tier)
+        self.assertTrue(get_log_storage().exists(test_run_req.log_archive))
+        self.assertEqual('\nfirst\nsecond', test_run_req.logs)
+        self.assertEqual('ond', test_run_req.read_logs(offset=10))
+
+    def test_get_log_search_text(self):
+        logs = 'test_a PASSED\ntest_b FAILED\nE   KeyError: 1\ntest_c PASSED\nE   KeyError: 1\n'
+        self.assertEqual('test_b FAILED\nE   KeyError: 1', get_log_search_text(logs))
+        with override_settings(TEST_RUN_LOG_SEARCH_PATTERN='PASSED', TEST_RUN_LOG_SEARCH_MAX_CHARS=20):
+            self.assertEqual('test_a PASSED\ntest_c', get_log_search_text(logs))
+
+    def test_decompress_logs_range(self):
+        logs = ''.join(f'line {index} é\n' for index in range(100000))
+        data = io.BytesIO(compress_logs(logs))
+        self.assertEqual(logs[500000:500100], decompress_logs(data, 500000, 100))
+        self.assertEqual(logs, decompress_logs(io.BytesIO(data.getvalue())))
+
+    @override_settings(TEST_RUN_LOG_READ_LIMIT=6)
+    def test_read_log_tail(self):
+        self.assertEqual(7, self.test_run_req.get_log_tail_offset())
+        self.assertEqual('second', self.test_run_req.read_log_tail())
+        self.test_run_req.compress_logs()
+        self.assertEqual('second', TestRunRequest.objects.get(id=self.test_run_req.id).read_log_tail())
+
+    def test_read_logs_archived_meanwhile(self):
+        self.test_run_req.compress_logs()
+        test_run_req = TestRunRequest.objects.get(id=self.test_run_req.id)
+        self.test_run_req.archive_logs()
+        self.assertEqual('\nfirst\nsecond', test_run_req.logs)
+
+    def test_purge_logs(self):
+        self.test_run_req.compress_logs()
+        self.test_run_req.archive_logs()
+        name = self.test_run_req.log_archive
+        self.assertTrue(self.test_run_req.purge_logs())
+        self.assertFalse(get_log_storage().exists(name))
+        test_run_req = TestRunRequest.objects.get(id=self.test_run_req.id)
+        self.assertEqual(TestRunRequest.LogTierChoices.PURGED.name, test_run_req.log_tier)
+        self.assertEqual('', test_run_req.logs)
+
+    def test_copy_logs_compressed(self):
+        self.test_run_req.compress_logs()
+        test_run_req = TestRunRequest.objects.create(requested_by='Ramadan', env=self.test_run_req.env)
+        test_run_req.copy_logs(self.test_run_req)
+        self.assertEqual('\nfirst\nsecond', test_run_req.logs)
+        self.assertEqual(13, test_run_req.log_size)
+
+    def test_get_logs_older_than(self):
+        self.assertFalse(TestRunRequest.get_logs_older_than(TestRunRequest.LogTierChoices.CHUNKS.name, 60).exists())
+        self.test_run_req.mark_as_success()
+        TestRunRequest.objects.filter(id=self.test_run_req.id).update(updated_at=timezone.now() - timedelta(seconds=90))
+        self.assertEqual(
+            [self.test_run_req],
+            list(TestRunRequest.get_logs_older_than(TestRunRequest.LogTierChoices.CHUNKS.name, 60))
+        )
+        self.assertFalse(TestRunRequest.get_logs_older_than(TestRunRequest.LogTierChoices.CHUNKS.name, 120).exists())
+
+
+class TestTestResult(TestCase):
+
+    def setUp(self) -> None:
+        self.env = TestEnvironment.objects.create(name='my_env')
+        self.test_run_req = TestRunRequest.objects.create(requested_by='Ramadan', env=self.env)
+        self.path = TestFilePath.objects.create(path='path1')
+
+    def test_record(self):
+        with self.assertNumQueries(2):
+            TestResult.record(self.test_run_req, [
+                JunitTestCase('path1', 'path1::test_a', 'PASSED', 1.5, ''),
+                JunitTestCase('unknown', 'unknown::test_b', 'FAILED', 0.5, 'boom'),
+            ])
+        self.assertEqual(
+            [('path1::test_a', self.path.id, 'PASSED', 1.5, ''), ('unknown::test_b', None, 'FAILED', 0.5, 'boom')],
+            list(self.test_run_req.results.order_by('nodeid').values_list(
+                'nodeid', 'path', 'outcome', 'duration', 'message'
+            ))
+        )
+
+
+class TestTestRunCacheEntry(TestCase):
+
+    def setUp(self) -> None:
+        env = TestEnvironment.objects.create(name='my_env')
+        self.test_run_req = TestRunRequest.objects.create(requested_by='Ramadan', env=env)
+
+    def test_lookup(self):
+        self.assertIsNone(TestRunCacheEntry.lookup('key'))
+        TestRunCacheEntry.store('key', self.test_run_req)
+        self.assertEqual(self.test_run_req, TestRunCacheEntry.lookup('key').request)
+
+    @override_settings(TEST_RESULT_CACHE_TTL_SECONDS=60)
+    def test_lookup_expired(self):
+        TestRunCacheEntry.store('key', self.test_run_req)
+        TestRunCacheEntry.objects.update(created_at=timezone.now() - timedelta(seconds=61))
+        self.assertIsNone(TestRunCacheEntry.lookup('key'))
+
+    @override_settings(TEST_RESULT_CACHE_MAX_ENTRIES=2)
+    def test_evict_least_recently_used(self):
+        for key in ('a', 'b'):
+            TestRunCacheEntry.store(key, self.test_run_req)
+        TestRunCacheEntry.objects.filter(key='a').update(used_at=timezone.now() + timedelta(seconds=1))
+        TestRunCacheEntry.store('c', self.test_run_req)
+        self.assertEqual(['a', 'c'], sorted(TestRunCacheEntry.objects.values_list('key', flat=True)))
+
+
+class TestTestRunRollup(TestCase):
+
+    def setUp(self) -> None:
+        self.env = TestEnvironment.objects.create(name='my_env')
+
+    def finish(self, wait, run, status='SUCCESS'):
+        finished_at = timezone.now()
+        instance = TestRunRequest.objects.create(requested_by='Ramadan', env=self.env, status=status)
+        instance.created_at = finished_at - timedelta(seconds=wait + run)
+        instance.started_at = finished_at - timedelta(seconds=run)
+        instance.finished_at = finished_at
+        TestRunRollup.record(instance)
+
+    def test_record(self):
+        self.finish(wait=1, run=10)
+        self.finish(wait=1, run=10.25)
+        self.finish(wait=1, run=10, status='FAILED')
+        self.assertEqual(4, TestRunRollup.objects.count())
+        run = TestRunRollup.objects.get(metric='RUN', status='SUCCESS')
+        self.assertEqual((2, 20.25, get_duration_bucket(10)), (run.count, run.seconds, run.bucket))
+        wait = TestRunRollup.objects.get(metric='WAIT', status='SUCCESS')
+        self.assertEqual((2, 2.0), (wait.count, wait.seconds))
+
+    def test_duration_buckets(self):
+        self.assertEqual(0, get_duration_bucket(0))
+        for seconds in (0.5, 1, 10, 59, 3600, 60 * 60 * 30):
+            bucket = get_duration_bucket(seconds)
+            self.assertLessEqual(seconds, get_bucket_upper_bound(bucket))
+            self.assertLessEqual(get_bucket_upper_bound(bucket), seconds * 1.2 + 1)
@@ -0,0 +1,172 @@
+from datetime import timedelta
+from unittest.mock import ANY, patch
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from api.agent import NodeAgent
+from api.models import TestEnvironment, TestRunRequest, WorkerNode
+from api.scheduler import get_scheduler
+from api.tasks import execute_test_run_request, reap_dead_worker_nodes, schedule_test_run_request
+
+
+def get_assignments():
+    return dict(TestEnvironment.objects.order_by('name').values_list('name', 'node__name'))
+
+
+class TestWorkerNode(TestCase):
+
+    def setUp(self) -> None:
+        TestEnvironment.objects.all().delete()
+        self.envs = [TestEnvironment.objects.create(name=f'env{index}', pool='gpu') for index in range(6)]
+
+    def test_balance_by_capacity(self):
+        WorkerNode.register('node1', 1)
+        WorkerNode.register('node2', 2)
+        counts = {node.name: node.assigned_envs.count() for node in WorkerNode.objects.all()}
+        self.assertEqual({'node1': 2, 'node2': 4}, counts)
+
+    def test_balance_hosted_envs(self):
+        WorkerNode.register('node1', 4, ['env0', 'env1'])
+        WorkerNode.register('node2', 1)
+        self.assertEqual({
+            'env0': 'node1', 'env1': 'node1', 'env2': 'node2', 'env3': 'node2', 'env4': 'node2', 'env5': 'node2'
+        }, get_assignments())
+
+    def test_new_node_takes_its_share(self):
+        WorkerNode.register('node1', 1)
+        self.assertEqual({'node1'}, set(get_assignments().values()))
+        WorkerNode.register('node2', 1)
+        WorkerNode.register('node3', 1)
+        counts = [node.assigned_envs.count() for node in WorkerNode.objects.all()]
+        self.assertEqual([2, 2, 2], counts)
+
+    def test_dead_node_envs_reassigned(self):
+        node1 = WorkerNode.register('node1', 1)
+        WorkerNode.register('node2', 1)
+        WorkerNode.objects.filter(pk=node1.pk).update(heartbeat_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual([node1], WorkerNode.reap())
+        self.assertFalse(node1.heartbeat())
+        WorkerNode.balance()
+        self.assertEqual({'node2'}, set(get_assignments().values()))
+
+        WorkerNode.register('node1', 1)
+        self.assertEqual(3, WorkerNode.objects.get(name='node1').assigned_envs.count())
+
+    def test_no_host(self):
+        WorkerNode.register('node1', 1, ['env0'])
+        self.assertIsNone(get_assignments()['env1'])
+
+    def test_route(self):
+        node1 = WorkerNode.register('node1', 1, ['env0'])
+        instance = TestRunRequest.objects.create(requested_by='Ramadan', env=self.envs[0])
+        self.assertEqual(node1, TestRunRequest.route(instance.id))
+        instance.refresh_from_db()
+        self.assertEqual(node1.id, instance.node_id)
+
+        node1.deregister()
+        self.assertIsNone(TestRunRequest.route(instance.id))
+
+    def test_route_pool(self):
+        WorkerNode.register('node1', 1, ['env0', 'env1', 'env2'])
+        node2 = WorkerNode.register('node2', 1, ['env3', 'env4', 'env5'])
+        for env in TestEnvironment.objects.filter(node__name='node1'):
+            env.lock()
+        instance = TestRunRequest.objects.create(requested_by='Ramadan', pool='gpu')
+        self.assertEqual(node2, TestRunRequest.route(instance.id))
+
+
+class TestNodeTasks(TestCase):
+
+    def setUp(self) -> None:
+        get_scheduler().clear()
+        TestEnvironment.objects.all().delete()
+        self.env1 = TestEnvironment.objects.create(name='env1', pool='gpu')
+        self.env2 = TestEnvironment.objects.create(name='env2', pool='gpu')
+        self.node1 = WorkerNode.register('node1', 1, ['env1'])
+        self.node2 = WorkerNode.register('node2', 1, ['env2'])
+        self.instance = TestRunRequest.objects.create(requested_by='Ramadan', env=self.env1)
+
+    @override_settings(TEST_RUN_NODE_ROUTING=True)
+    @patch('api.tasks.execute_test_run_request.apply_async')
+    def test_dispatch_to_node_queue(self, task):
+        schedule_test_run_request(self.instance)
+        task.assert_called_once_with((self.instance.id, ), task_id=ANY, queue='node.node1')
+
+    @override_settings(TEST_RUN_NODE_ROUTING=True)
+    @patch('api.tasks.execute_test_run_request.apply_async')
+    def test_reap_dead_worker_nodes(self, task):
+        schedule_test_run_request(self.instance)
+        WorkerNode.objects.filter(pk=self.node1.pk).update(heartbeat_at=timezone.now() - timedelta(minutes=5))
+        #  the other node can host every env
+        self.node2.envs.clear()
+
+        reap_dead_worker_nodes()
+        self.env1.refresh_from_db()
+        self.assertEqual(self.node2.id, self.env1.node_id)
+        task.assert_called_with((self.instance.id, ), task_id=ANY, queue='node.node2')
+        self.assertEqual(2, task.call_count)
+
+    @override_settings(TEST_RUN_NODE_ROUTING=True)
+    @patch('api.tasks.run_test_run_request')
+    @patch('api.tasks.execute_test_run_request.apply_async')
+    def test_execute_stale_dispatch(self, task, run):
+        schedule_test_run_request(self.instance)
+        stale_id = task.call_args[1]['task_id']
+        WorkerNode.objects.filter(pk=self.node1.pk).update(heartbeat_at=timezone.now() - timedelta(minutes=5))
+        self.node2.envs.clear()
+        reap_dead_worker_nodes()
+        dispatch_id = task.call_args[1]['task_id']
+        self.assertNotEqual(stale_id, dispatch_id)
+
+        #  the dead node came back and consumed its queue
+        execute_test_run_request.apply((self.instance.id, ), task_id=stale_id)
+        self.assertFalse(run.called)
+        self.assertTrue(get_scheduler().is_dispatched(self.instance.id, dispatch_id))
+
+        execute_test_run_request.apply((self.instance.id, ), task_id=dispatch_id)
+        self.assertTrue(run.called)
+        self.assertEqual([], get_scheduler().get_running_ids())
+
+    @override_settings(TEST_WORKER_NODE='node2')
+    @patch('api.tasks.run_test_run_request')
+    @patch('api.tasks.execute_test_run_request.apply_async')
+    def test_execute_env_of_other_node(self, task, run):
+        get_scheduler().push(self.instance.id, 'Ramadan', 0, self.instance.created_at)
+        self.assertEqual(self.instance.id, get_scheduler().pop())
+        execute_test_run_request(self.instance.id)
+        self.assertFalse(run.called)
+        #  sent again, to the queue of the node of the env
+        task.assert_called_once_with((self.instance.id, ), task_id=ANY)
+
+    @override_settings(TEST_WORKER_NODE='node2')
+    @patch('api.tasks.run_test_run_request')
+    def test_execute_pool_on_node(self, run):
+        pool_req = TestRunRequest.objects.create(requested_by='Ramadan', pool='gpu')
+        execute_test_run_request(pool_req.id)
+        self.assertEqual(self.env2, run.call_args[0][1])
+
+
+class TestNodeAgent(TestCase):
+
+    def setUp(self) -> None:
+        TestEnvironment.objects.all().delete()
+
+    def test_heartbeat_registers_again(self):
+        TestEnvironment.objects.create(name='env1')
+        agent = NodeAgent('node1', 2, [])
+        agent.register()
+        agent.node.deregister()
+        with patch.object(agent._stopped, 'wait', side_effect=[False, True]):
+            agent._run()
+        agent.node.refresh_from_db()
+        self.assertTrue(agent.node.is_alive())
+        self.assertEqual(1, agent.node.assigned_envs.count())
+
+    @patch('api.agent.reroute_test_run_requests')
+    def test_stop(self, reroute):
+        agent = NodeAgent('node1', 2, [])
+        agent.register()
+        agent.stop()
+        self.assertFalse(WorkerNode.objects.get(name='node1').is_alive())
+        reroute.assert_called_once_with([agent.node])
@@ -0,0 +1,96 @@
+import os
+import signal
+import tempfile
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+
+from api.pool import WarmProcess, WarmRunner
+from api.runner import start_process
+
+
+class TestWarmRunner(TestCase):
+
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = tmp_dir.name
+        with open(os.path.join(self.tmp_dir, 'test_sample.py'), 'w') as f:
+            f.write('def test_pass():\n    pass\n\n\ndef test_other():\n    pass\n')
+        with open(os.path.join(self.tmp_dir, 'test_fail.py'), 'w') as f:
+            f.write('def test_fail():\n    assert False\n')
+        with open(os.path.join(self.tmp_dir, 'test_slow.py'), 'w') as f:
+            f.write('import time\n\ndef test_slow():\n    time.sleep(10)\n')
+        self.runner = WarmRunner(max_runs=2, max_rss=1024 * 1024 * 1024, preload=['pytest'])
+        self.addCleanup(self.runner.close)
+
+    def start(self, *paths):
+        return self.runner.start(['-p', 'no:django', '-p', 'no:cacheprovider', '-v'] + list(paths), cwd=self.tmp_dir)
+
+    def test_run_passes(self):
+        process = self.start('test_sample.py')
+        output = process.stdout.read()
+        self.assertEqual(0, process.wait(timeout=10))
+        self.assertIn('test_sample.py::test_pass PASSED', output)
+        self.assertIn('2 passed', output)
+
+    def test_run_fails(self):
+        process = self.start('test_fail.py')
+        self.assertIn('1 failed', process.stdout.read())
+        self.assertEqual(1, process.wait(timeout=10))
+
+    def test_env(self):
+        with open(os.path.join(self.tmp_dir, 'test_env.py'), 'w') as f:
+            f.write('import os\n\ndef test_env():\n    assert os.environ["TEST_RUN_SHARD"] == "1"\n')
+        process = self.runner.start(['-p', 'no:django', 'test_env.py'], cwd=self.tmp_dir, env={'TEST_RUN_SHARD': '1'})
+        self.assertIn('1 passed', process.stdout.read())
+        self.assertEqual(0, process.wait(timeout=10))
+        process.stdout.close()
+
+    def test_kill(self):
+        process = self.start('test_slow.py')
+        self.assertIsNone(process.poll())
+        process.kill()
+        self.assertEqual(-signal.SIGKILL, process.wait(timeout=10))
+        process.stdout.close()
+
+    def test_recycled_after_max_runs(self):
+        processes = [self.start('test_sample.py')]
+        zygote = self.runner._process
+        processes.append(self.start('test_sample.py'))
+        self.assertIsNot(zygote, self.runner._process)
+        self.assertIsNotNone(zygote.poll())
+        for process in processes:
+            process.stdout.read()
+            self.assertEqual(0, process.wait(timeout=10))
+            process.stdout.close()
+
+    @patch('api.pool.get_rss', return_value=2 * 1024 * 1024 * 1024)
+    def test_recycled_when_memory_grows(self, _):
+        self.runner.warm_up()
+        zygote = self.runner._process
+        process = self.start('test_sample.py')
+        self.assertIsNot(zygote, self.runner._process)
+        process.stdout.read()
+        self.assertEqual(0, process.wait(timeout=10))
+        process.stdout.close()
+
+
+class TestStartProcess(TestCase):
+
+    @override_settings(TEST_RUNNER_WARM_POOL=True)
+    @patch('api.runner.get_warm_runner')
+    def test_warm_pool(self, get_warm_runner):
+        process = start_process(['pytest', '-v', 'path1'])
+        get_warm_runner.return_value.start.assert_called_once_with(['-v', 'path1'], env=None)
+        self.assertEqual(get_warm_runner.return_value.start.return_value, process)
+
+    @override_settings(TEST_RUNNER_WARM_POOL=True)
+    @patch('api.runner.get_warm_runner')
+    def test_warm_pool_failure_falls_back_to_a_new_process(self, get_warm_runner):
+        get_warm_runner.return_value.start.side_effect = ConnectionError
+        process = start_process(['pytest', '--version'])
+        self.assertNotIsInstance(process, WarmProcess)
+        process.stdout.read()
+        self.assertEqual(0, process.wait())
+        process.stdout.close()
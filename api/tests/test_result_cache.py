@@ -0,0 +1,46 @@
+import os
+import tempfile
+
+from django.test import TestCase, override_settings
+
+from api.result_cache import get_cache_key
+
+
+class TestResultCache(TestCase):
+
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.base_dir = tmp_dir.name
+        os.makedirs(os.path.join(self.base_dir, 'tests', 'helpers'))
+        os.makedirs(os.path.join(self.base_dir, 'lib'))
+        self.write('lib/__init__.py', '')
+        self.write('lib/core.py', 'VALUE = 1\n')
+        self.write('lib/other.py', 'VALUE = 2\n')
+        self.write('tests/conftest.py', '')
+        self.write('tests/helpers/__init__.py', 'from . import checks\n')
+        self.write('tests/helpers/checks.py', 'import os\n')
+        self.write('tests/test_a.py', 'import json\nfrom lib import core\nimport helpers\n\ndef test_a():\n    pass\n')
+        self.write('tests/test_b.py', 'from lib.other import VALUE\n\ndef test_b():\n    pass\n')
+        settings = override_settings(BASE_DIR=self.base_dir)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def write(self, path, source):
+        with open(os.path.join(self.base_dir, path), 'w') as f:
+            f.write(source)
+
+    def test_get_cache_key(self):
+        key = get_cache_key(['tests/test_a.py'], 'env1')
+        self.assertEqual(key, get_cache_key(['tests/test_a.py'], 'env1'))
+        self.assertNotEqual(key, get_cache_key(['tests/test_a.py'], 'env2'))
+        self.assertNotEqual(key, get_cache_key(['tests/test_a.py', 'tests/test_b.py'], 'env1'))
+        with override_settings(TEST_BASE_CMD=['pytest']):
+            self.assertNotEqual(key, get_cache_key(['tests/test_a.py'], 'env1'))
+
+    def test_get_cache_key_changed_dependency(self):
+        key = get_cache_key(['tests/test_a.py'], 'env1')
+        self.write('lib/other.py', 'VALUE = 3\n')
+        self.assertEqual(key, get_cache_key(['tests/test_a.py'], 'env1'))
+        self.write('tests/helpers/checks.py', 'import sys\n')
+        self.assertNotEqual(key, get_cache_key(['tests/test_a.py'], 'env1'))
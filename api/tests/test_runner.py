@@ -0,0 +1,163 @@
+import sys
+import tempfile
+import time
+from unittest.mock import Mock, patch
+
+from django.test import TestCase
+
+from api.runner import (
+    JunitTestCase, LogBuffer, get_durations, iter_output, kill_processes, parse_junit_report, split_into_shards,
+    start_process, terminate_processes
+)
+
+
+class TestLogBuffer(TestCase):
+
+    def setUp(self) -> None:
+        self.flush = Mock()
+
+    def test_flush_by_size(self):
+        logs = LogBuffer(self.flush, max_size=10, max_seconds=60)
+        logs.append('line 1\n')
+        self.assertFalse(self.flush.called)
+        logs.append('line 2\n')
+        self.flush.assert_called_once_with('line 1\nline 2')
+
+    @patch('api.runner.time.monotonic', side_effect=[0, 0, 5, 5])
+    def test_flush_by_time(self, _):
+        logs = LogBuffer(self.flush, max_size=1024, max_seconds=1)
+        logs.append('line 1\n')
+        logs.flush_if_due()
+        self.assertFalse(self.flush.called)
+        logs.flush_if_due()
+        self.flush.assert_called_once_with('line 1')
+
+    def test_flush_empty(self):
+        logs = LogBuffer(self.flush, max_size=10, max_seconds=60)
+        logs.flush()
+        self.assertFalse(self.flush.called)
+
+
+class TestIterOutput(TestCase):
+
+    def test_iter_output(self):
+        process = start_process([sys.executable, '-c', 'print("a"); print("b")'])
+        lines = [output for output in iter_output([process], poll_seconds=1) if output is not None]
+        self.assertEqual([(0, 'a\n'), (0, 'b\n')], lines)
+        self.assertEqual(0, process.wait())
+
+    def test_iter_output_multiple_processes(self):
+        processes = [start_process([sys.executable, '-c', f'print("{name}")']) for name in 'ab']
+        lines = [output for output in iter_output(processes, poll_seconds=1) if output is not None]
+        self.assertEqual([(0, 'a\n'), (1, 'b\n')], sorted(lines))
+        kill_processes(processes)
+
+    def test_iter_output_idle(self):
+        process = start_process([sys.executable, '-c', 'import time; time.sleep(0.5)'])
+        lines = list(iter_output([process], poll_seconds=0.1))
+        self.assertIn(None, lines)
+        process.wait()
+
+
+def is_alive(pid):
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+class TestStopProcesses(TestCase):
+    SPAWN_CHILD = (
+        'import subprocess, sys, time; '
+        'child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"]); '
+        'print(child.pid, flush=True); time.sleep(30)'
+    )
+
+    def assert_stopped(self, pid):
+        deadline = time.monotonic() + 5
+        while is_alive(pid) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(is_alive(pid))
+
+    def test_kill_processes_kills_the_group(self):
+        process = start_process([sys.executable, '-c', self.SPAWN_CHILD])
+        child_pid = int(process.stdout.readline())
+        kill_processes([process])
+        self.assertEqual(-9, process.returncode)
+        self.assert_stopped(child_pid)
+        process.stdout.close()
+
+    def test_terminate_processes(self):
+        process = start_process([sys.executable, '-c', self.SPAWN_CHILD])
+        child_pid = int(process.stdout.readline())
+        terminate_processes([process])
+        self.assertEqual(-15, process.wait(timeout=5))
+        self.assert_stopped(child_pid)
+        process.stdout.close()
+
+    def test_stopped_processes_ignored(self):
+        process = start_process([sys.executable, '-c', ''])
+        process.wait()
+        terminate_processes([process])
+        kill_processes([process])
+        self.assertEqual(0, process.returncode)
+        process.stdout.close()
+
+
+class TestSplitIntoShards(TestCase):
+
+    def test_balanced_by_duration(self):
+        durations = {'a.py': 10.0, 'b.py': 6.0, 'c.py': 5.0, 'd.py': 1.0}
+        self.assertEqual(
+            [['a.py', 'd.py'], ['b.py', 'c.py']], split_into_shards(list(durations), durations, 2)
+        )
+
+    def test_unknown_duration_is_average(self):
+        durations = {'a.py': 4.0, 'b.py': 2.0, 'c.py': None}
+        self.assertEqual([['a.py'], ['b.py', 'c.py']], split_into_shards(['a.py', 'b.py', 'c.py'], durations, 2))
+
+    def test_more_shards_than_paths(self):
+        self.assertEqual([['a.py']], split_into_shards(['a.py'], {}, 4))
+
+    def test_no_paths(self):
+        self.assertEqual([], split_into_shards([], {}, 4))
+
+
+class TestParseJunitReport(TestCase):
+
+    def setUp(self) -> None:
+        self.report = tempfile.NamedTemporaryFile('w', suffix='.xml')
+        self.report.write(
+            '<testsuites><testsuite>'
+            '<testcase classname="sample-tests.test_fail.TestFail" name="test_a" time="2.5"/>'
+            '<testcase classname="sample-tests.test_fail.TestFail" name="test_b" time="0.5">'
+            '<failure message="AssertionError: 1 != 2">trace</failure></testcase>'
+            '<testcase classname="api.tests.test_utils" name="test_c" time="0.1"><skipped message="skip"/></testcase>'
+            '<testcase classname="unknown" name="test_d" time="9"/>'
+            '</testsuite></testsuites>'
+        )
+        self.report.flush()
+        self.paths = ['sample-tests/test_fail.py', 'api/tests/test_utils.py']
+
+    def tearDown(self) -> None:
+        self.report.close()
+
+    def test_parse(self):
+        self.assertEqual([
+            JunitTestCase('sample-tests/test_fail.py', 'sample-tests/test_fail.py::TestFail::test_a', 'PASSED', 2.5, ''),
+            JunitTestCase(
+                'sample-tests/test_fail.py', 'sample-tests/test_fail.py::TestFail::test_b', 'FAILED', 0.5,
+                'AssertionError: 1 != 2\ntrace'
+            ),
+            JunitTestCase('api/tests/test_utils.py', 'api/tests/test_utils.py::test_c', 'SKIPPED', 0.1, 'skip'),
+        ], parse_junit_report(self.report.name, self.paths))
+
+    def test_get_durations(self):
+        self.assertEqual(
+            {'sample-tests/test_fail.py': 3.0, 'api/tests/test_utils.py': 0.1},
+            get_durations(parse_junit_report(self.report.name, self.paths))
+        )
+
+    def test_missing_report(self):
+        self.assertEqual([], parse_junit_report('/nonexistent/report.xml', ['a.py']))
@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
+
+from api.scheduler import MemoryScheduler, check_scheduler, get_priority, get_score
+
+
+@override_settings(
+    TEST_RUN_SCHEDULER_SLOTS=100, TEST_RUN_DEFAULT_USER_MAX_RUNNING=100, TEST_RUN_USER_MAX_RUNNING={},
+    TEST_RUN_USER_WEIGHTS={}
+)
+class TestMemoryScheduler(TestCase):
+
+    def setUp(self) -> None:
+        self.scheduler = MemoryScheduler()
+        self.created_at = datetime(2022, 10, 1)
+        self.next_id = 1
+
+    def push(self, user, priority=0, count=1):
+        ids = []
+        for _ in range(count):
+            self.scheduler.push(self.next_id, user, priority, self.created_at + timedelta(seconds=self.next_id))
+            ids.append(self.next_id)
+            self.next_id += 1
+        return ids
+
+    def pop_all(self):
+        ids = []
+        while (request_id := self.scheduler.pop()) is not None:
+            ids.append(request_id)
+        return ids
+
+    def test_score(self):
+        for priority in (0, 3, 10):
+            self.assertEqual(priority, get_priority(get_score(priority, self.created_at)))
+        self.assertLess(get_score(1, self.created_at + timedelta(days=1)), get_score(0, self.created_at))
+
+    def test_fifo_per_user(self):
+        ids = self.push('a', count=3)
+        self.assertEqual(ids, self.pop_all())
+        self.assertIsNone(self.scheduler.pop())
+
+    def test_priority(self):
+        low = self.push('a', count=2)
+        high = self.push('b', priority=5)
+        self.assertEqual(high + low, self.pop_all())
+
+    def test_fair_share_between_users(self):
+        batch = self.push('batch', count=500)
+        interactive = self.push('interactive', count=2)
+        ids = [self.scheduler.pop() for _ in range(4)]
+        self.assertEqual([batch[0], interactive[0], batch[1], interactive[1]], ids)
+
+    @override_settings(TEST_RUN_USER_WEIGHTS={'a': 2})
+    def test_weights(self):
+        a = self.push('a', count=4)
+        b = self.push('b', count=2)
+        self.assertEqual([a[0], b[0], a[1], a[2], b[1], a[3]], self.pop_all())
+
+    def test_idle_users_do_not_bank_credit(self):
+        a = self.push('a', count=10)
+        self.assertEqual(a[:5], [self.scheduler.pop() for _ in range(5)])
+        b = self.push('b', count=5)
+        ids = [self.scheduler.pop() for _ in range(4)]
+        self.assertEqual({a[5], a[6], b[0], b[1]}, set(ids))
+
+    @override_settings(TEST_RUN_DEFAULT_USER_MAX_RUNNING=2, TEST_RUN_USER_MAX_RUNNING={'b': 1})
+    def test_user_caps(self):
+        a = self.push('a', count=3)
+        b = self.push('b', count=2)
+        self.assertEqual([a[0], b[0], a[1]], self.pop_all())
+        self.assertTrue(self.scheduler.release(a[0]))
+        self.assertTrue(self.scheduler.release(b[0]))
+        self.assertEqual([b[1], a[2]], self.pop_all())
+        self.assertFalse(self.scheduler.release(a[0]))
+
+    @override_settings(TEST_RUN_SCHEDULER_SLOTS=2)
+    def test_slots(self):
+        a = self.push('a', count=3)
+        self.assertEqual(a[:2], self.pop_all())
+        self.scheduler.release(a[0])
+        self.assertEqual([a[2]], self.pop_all())
+
+    def test_push_twice(self):
+        ids = self.push('a')
+        self.scheduler.push(ids[0], 'a', 0, self.created_at)
+        self.assertEqual(ids, self.pop_all())
+
+    def test_push_many(self):
+        self.scheduler.push_many([
+            (1, 'a', 0, self.created_at), (2, 'b', 0, self.created_at), (3, 'a', 1, self.created_at)
+        ])
+        self.assertEqual([3, 2, 1], self.pop_all())
+
+    def test_remove(self):
+        ids = self.push('a', count=2)
+        self.assertTrue(self.scheduler.remove(ids[0], 'a'))
+        self.assertEqual(ids[1:], self.pop_all())
+
+    def test_release_dispatch(self):
+        ids = self.push('a')
+        self.assertEqual(ids[0], self.scheduler.pop('dispatch1'))
+        self.assertTrue(self.scheduler.is_dispatched(ids[0], 'dispatch1'))
+        self.assertFalse(self.scheduler.release(ids[0], 'dispatch0'))
+        self.assertTrue(self.scheduler.release(ids[0], 'dispatch1'))
+        self.assertFalse(self.scheduler.is_dispatched(ids[0], 'dispatch1'))
+
+    def test_get_running_ids(self):
+        ids = self.push('a', count=3)
+        self.scheduler.pop()
+        self.scheduler.pop()
+        self.scheduler.release(ids[0])
+        self.assertEqual([ids[1]], self.scheduler.get_running_ids())
+
+    def test_check_scheduler(self):
+        with override_settings(TEST_RUN_SCHEDULER_REDIS_URL='', CELERY_TASK_ALWAYS_EAGER=False):
+            self.assertRaises(ImproperlyConfigured, check_scheduler)
+        with override_settings(TEST_RUN_SCHEDULER_REDIS_URL='', CELERY_TASK_ALWAYS_EAGER=True):
+            check_scheduler()
+        with override_settings(TEST_RUN_SCHEDULER_REDIS_URL='redis://redis:6379/3', CELERY_TASK_ALWAYS_EAGER=False):
+            check_scheduler()
@@ -1,10 +1,21 @@
-from unittest.mock import patch
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from unittest.mock import ANY, patch
 
 from django.conf import settings
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.utils import timezone
 
-from api.models import TestEnvironment, TestRunRequest, TestFilePath
-from api.tasks import handle_task_retry, MAX_RETRY, execute_test_run_request
+from api.allocator import get_free_list
+from api.models import TestEnvironment, TestRunRequest, TestFilePath, TestRunCacheEntry
+from api.runner import JunitTestCase, start_process
+from api.scheduler import get_scheduler
+from api.tasks import (
+    queue_test_run_request, dispatch_next_test_run_request, execute_test_run_request, run_test_run_request,
+    reap_expired_env_leases, schedule_test_run_request, apply_log_retention, cancel_test_run_request
+)
 
 
 class TestTasks(TestCase):
@@ -16,34 +27,273 @@ class TestTasks(TestCase):
         self.path2 = TestFilePath.objects.create(path='path2')
         self.test_run_req.path.add(self.path1)
         self.test_run_req.path.add(self.path2)
+        get_scheduler().clear()
+        get_free_list().rebuild([])
 
-    @patch('api.tasks.execute_test_run_request.s')
-    def test_handle_task_retry_less_than_max_retry(self, task_mock):
-        handle_task_retry(self.test_run_req, MAX_RETRY - 1)
+    def test_queue_test_run_request(self):
+        queue_test_run_request(self.test_run_req)
         self.assertEqual(TestRunRequest.StatusChoices.RETRYING.name, self.test_run_req.status)
-        self.assertEqual(f'\nFailed to run tests on env my_env retrying in 512 seconds.', self.test_run_req.logs)
-        self.assertTrue(task_mock.called)
-        task_mock.assert_called_with(self.test_run_req.id, MAX_RETRY)
+        self.assertEqual('\nEnv my_env is busy, waiting for the running tests to finish.', self.test_run_req.logs)
 
-    def test_handle_task_retry_equal_to_max_retry(self):
-        handle_task_retry(self.test_run_req, MAX_RETRY)
-        self.assertEqual(TestRunRequest.StatusChoices.FAILED_TO_START.name, self.test_run_req.status)
-        self.assertEqual(f'\nFailed to run tests on env my_env after retrying 10 times.', self.test_run_req.logs)
+    def test_queue_test_run_request_already_running(self):
+        TestRunRequest.objects.filter(id=self.test_run_req.id).update(status=TestRunRequest.StatusChoices.RUNNING.name)
+        queue_test_run_request(self.test_run_req)
+        self.test_run_req.refresh_from_db()
+        self.assertEqual(TestRunRequest.StatusChoices.RUNNING.name, self.test_run_req.status)
+        self.assertEqual('', self.test_run_req.logs)
+
+    @patch('api.tasks.execute_test_run_request.apply_async')
+    def test_dispatch_next_test_run_request(self, task):
+        self.test_run_req.mark_as_retrying()
+        newer_req = TestRunRequest.objects.create(requested_by='Ramadan', env=self.env)
+        newer_req.mark_as_retrying()
+        #  still with the scheduler
+        TestRunRequest.objects.create(requested_by='Ramadan', env=self.env, priority=1)
+        dispatch_next_test_run_request(self.env)
+        task.assert_called_once_with((self.test_run_req.id, ), task_id=ANY)
+
+    @override_settings(TEST_RUN_DEFAULT_USER_MAX_RUNNING=1)
+    @patch('api.tasks.execute_test_run_request.apply_async')
+    def test_schedule_test_run_request_user_cap(self, task):
+        other_req = TestRunRequest.objects.create(requested_by='Ramadan', env=self.env)
+        schedule_test_run_request(self.test_run_req)
+        schedule_test_run_request(other_req)
+        task.assert_called_once_with((self.test_run_req.id, ), task_id=ANY)
 
-    @patch('api.tasks.handle_task_retry')
-    def test_execute_test_run_request_busy_env(self, retry):
+        with patch('api.tasks._execute_test_run_request'):
+            execute_test_run_request(self.test_run_req.id)
+        task.assert_called_with((other_req.id, ), task_id=ANY)
+
+    @patch('api.tasks.execute_test_run_request.apply_async')
+    def test_dispatch_next_test_run_request_empty_queue(self, task):
+        self.test_run_req.mark_as_success()
+        dispatch_next_test_run_request(self.env)
+        self.assertFalse(task.called)
+
+    @patch('api.tasks.run_test_run_request')
+    def test_execute_test_run_request_busy_env(self, run):
         self.env.status = TestEnvironment.StatusChoices.BUSY.name
         self.env.save()
         execute_test_run_request(self.test_run_req.id)
-        self.assertTrue(retry.called)
-        retry.assert_called_with(self.test_run_req, 0)
+        self.test_run_req.refresh_from_db()
+        self.assertFalse(run.called)
+        self.assertEqual(TestRunRequest.StatusChoices.RETRYING.name, self.test_run_req.status)
+
+    @patch('api.tasks.run_test_run_request')
+    def test_execute_test_run_request_pool(self, run):
+        gpu_env = TestEnvironment.objects.create(name='gpu_env', pool='gpu')
+        pool_req = TestRunRequest.objects.create(requested_by='Ramadan', pool='gpu')
+        execute_test_run_request(pool_req.id)
+        self.assertEqual(pool_req, run.call_args[0][0])
+        self.assertEqual(gpu_env, run.call_args[0][1])
+        pool_req.refresh_from_db()
+        self.assertEqual(gpu_env, pool_req.env)
+        gpu_env.refresh_from_db()
+        self.assertTrue(gpu_env.is_idle())
+
+    @patch('api.tasks.run_test_run_request')
+    def test_execute_test_run_request_saturated_pool(self, run):
+        TestEnvironment.objects.create(name='gpu_env', pool='gpu').lock('worker')
+        pool_req = TestRunRequest.objects.create(requested_by='Ramadan', pool='gpu')
+        execute_test_run_request(pool_req.id)
+        self.assertFalse(run.called)
+        pool_req.refresh_from_db()
+        self.assertEqual(TestRunRequest.StatusChoices.RETRYING.name, pool_req.status)
+        self.assertEqual('\nAll envs of pool gpu are busy, waiting for the running tests to finish.', pool_req.logs)
+
+    @patch('api.tasks.get_cache_key', return_value='key')
+    @patch('subprocess.Popen.wait', return_value=0)
+    def test_execute_test_run_request_cache(self, *_):
+        self.test_run_req.use_cache = True
+        self.test_run_req.save()
+        execute_test_run_request(self.test_run_req.id)
+        self.assertEqual(self.test_run_req, TestRunCacheEntry.lookup('key').request)
+
+        cached_req = TestRunRequest.objects.create(requested_by='Ramadan', env=self.env, use_cache=True)
+        with patch('api.tasks.run_test_run_request') as run:
+            execute_test_run_request(cached_req.id)
+        self.assertFalse(run.called)
+        cached_req.refresh_from_db()
+        self.assertEqual(TestRunRequest.StatusChoices.SUCCESS.name, cached_req.status)
+        self.assertEqual(self.test_run_req, cached_req.cached_from)
+        self.assertTrue(cached_req.logs.startswith(
+            f'\nTests and env unchanged since tests(ID:{self.test_run_req.id}), reusing their result.\n'
+        ))
+        self.env.refresh_from_db()
+        self.assertTrue(self.env.is_idle())
+
+    @patch('subprocess.Popen.wait', return_value=0)
+    def test_execute_test_run_request_without_cache(self, _):
+        execute_test_run_request(self.test_run_req.id)
+        self.assertFalse(TestRunCacheEntry.objects.exists())
+
+    @patch('api.tasks.select_affected_paths', return_value=['path2'])
+    @patch('api.models.settings.TEST_BASE_CMD', [sys.executable, '-c', 'import sys; print(sys.argv[1:-1])'])
+    def test_run_test_run_request_affected_paths(self, _):
+        self.test_run_req.changed_files = ['lib.py']
+        self.test_run_req.mark_as_running()
+        run_test_run_request(self.test_run_req, self.env, 'worker')
+        self.test_run_req.refresh_from_db()
+        self.assertIn("['path2']", self.test_run_req.logs)
+        self.assertIn('Running 1 of 2 test files, affected by the changes.', self.test_run_req.logs)
+
+    @patch('api.tasks.get_cache_key', return_value='key')
+    @patch('api.tasks.select_affected_paths', return_value=['path2'])
+    @patch('subprocess.Popen.wait', return_value=0)
+    def test_run_test_run_request_affected_paths_not_cached(self, *_):
+        self.test_run_req.use_cache = True
+        self.test_run_req.changed_files = ['lib.py']
+        self.test_run_req.mark_as_running()
+        run_test_run_request(self.test_run_req, self.env, 'worker')
+        self.assertEqual(TestRunRequest.StatusChoices.SUCCESS.name, self.test_run_req.status)
+        #  only path2 ran, the result is not reused for path1 and path2
+        self.assertIsNone(TestRunCacheEntry.lookup('key'))
+
+    @patch('api.tasks.select_affected_paths', return_value=[])
+    @patch('api.tasks.start_process')
+    def test_run_test_run_request_no_affected_paths(self, start_process, _):
+        self.test_run_req.changed_files = ['lib.py']
+        self.test_run_req.mark_as_running()
+        run_test_run_request(self.test_run_req, self.env, 'worker')
+        self.assertFalse(start_process.called)
+        self.assertEqual(TestRunRequest.StatusChoices.SUCCESS.name, self.test_run_req.status)
+
+    @patch('api.tasks.select_affected_paths', return_value=None)
+    @patch('api.models.settings.TEST_BASE_CMD', [sys.executable, '-c', 'import sys; print(sys.argv[1:-1])'])
+    def test_run_test_run_request_outdated_dependency_map(self, _):
+        self.test_run_req.changed_files = ['lib.py']
+        self.test_run_req.mark_as_running()
+        run_test_run_request(self.test_run_req, self.env, 'worker')
+        self.test_run_req.refresh_from_db()
+        self.assertIn("['path1', 'path2']", self.test_run_req.logs)
+        self.assertIn('The dependency map is outdated, running all the 2 test files.', self.test_run_req.logs)
+
+    @override_settings(TEST_RUN_KILL_GRACE_SECONDS=0.5)
+    @patch('api.models.settings.TEST_BASE_CMD', [
+        sys.executable, '-c', 'import time; print("started", flush=True); time.sleep(30)'
+    ])
+    def test_run_test_run_request_timeout(self):
+        TestRunRequest.objects.filter(id=self.test_run_req.id).update(timeout_seconds=1)
+        self.test_run_req.refresh_from_db()
+        self.test_run_req.mark_as_running()
+        started_at = time.monotonic()
+        run_test_run_request(self.test_run_req, self.env, 'worker')
+        self.assertLess(time.monotonic() - started_at, 10)
+        self.test_run_req.refresh_from_db()
+        self.assertEqual(TestRunRequest.StatusChoices.FAILED.name, self.test_run_req.status)
+        self.assertIn('started\nTimed out after 1 seconds, stopping the tests.', self.test_run_req.logs)
+
+    @override_settings(TEST_RUN_CANCEL_CHECK_SECONDS=0, TEST_RUN_KILL_GRACE_SECONDS=0.5)
+    @patch('api.models.settings.TEST_BASE_CMD', [sys.executable, '-c', 'import time; time.sleep(30)'])
+    def test_run_test_run_request_cancelled(self):
+        self.test_run_req.mark_as_running()
+        self.assertTrue(cancel_test_run_request(self.test_run_req))
+        started_at = time.monotonic()
+        run_test_run_request(self.test_run_req, self.env, 'worker')
+        self.assertLess(time.monotonic() - started_at, 10)
+        self.test_run_req.refresh_from_db()
+        self.assertEqual(TestRunRequest.StatusChoices.CANCELLED.name, self.test_run_req.status)
+        self.assertEqual('\nCancelled, stopping the tests.', self.test_run_req.logs)
+        self.assertFalse(self.test_run_req.results.exists())
+
+    @override_settings(TEST_RUN_CANCEL_CHECK_SECONDS=0)
+    @patch('api.models.TestRunRequest.is_cancelled', side_effect=KeyboardInterrupt)
+    @patch('api.models.settings.TEST_BASE_CMD', [sys.executable, '-c', 'import time; time.sleep(30)'])
+    def test_run_test_run_request_interrupted(self, _):
+        self.test_run_req.mark_as_running()
+        started_at = time.monotonic()
+        processes = []
+
+        def start(cmd, env=None):
+            processes.append(start_process(cmd, env))
+            return processes[-1]
+
+        with patch('api.tasks.start_process', side_effect=start):
+            with self.assertRaises(KeyboardInterrupt):
+                run_test_run_request(self.test_run_req, self.env, 'worker')
+        #  not left running on the env
+        self.assertIsNotNone(processes[0].poll())
+        self.assertLess(time.monotonic() - started_at, 10)
+
+    def test_cancel_test_run_request_pending(self):
+        schedule = patch('api.tasks.execute_test_run_request.apply_async')
+        schedule.start()
+        self.addCleanup(schedule.stop)
+        with override_settings(TEST_RUN_SCHEDULER_SLOTS=0):
+            schedule_test_run_request(self.test_run_req)
+        self.assertTrue(cancel_test_run_request(self.test_run_req))
+        self.assertEqual(TestRunRequest.StatusChoices.CANCELLED.name, self.test_run_req.status)
+        self.assertEqual('\nCancelled before starting.', self.test_run_req.logs)
+        #  dropped from the scheduler
+        self.assertIsNone(get_scheduler().pop())
+        self.assertFalse(cancel_test_run_request(self.test_run_req))
+
+    def test_cancel_test_run_request_finished(self):
+        self.test_run_req.mark_as_success()
+        self.assertFalse(cancel_test_run_request(self.test_run_req))
+        self.assertEqual(TestRunRequest.StatusChoices.SUCCESS.name, self.test_run_req.status)
+
+    @patch('api.tasks.run_test_run_request')
+    def test_execute_test_run_request_not_pending(self, run):
+        self.test_run_req.mark_as_success()
+        execute_test_run_request(self.test_run_req.id)
+        self.assertFalse(run.called)
+
+    @patch('api.tasks.execute_test_run_request.apply_async')
+    @patch('api.tasks.run_test_run_request')
+    def test_execute_test_run_request_scheduled(self, run, task):
+        self.test_run_req.mark_as_retrying()
+        newer_req = TestRunRequest.objects.create(requested_by='Ramadan', env=self.env, priority=1)
+        execute_test_run_request(newer_req.id)
+        #  the request picked by the scheduler runs, the waiting one is scheduled once the env is unlocked
+        self.assertEqual(1, run.call_count)
+        self.assertEqual(newer_req, run.call_args[0][0])
+        self.test_run_req.refresh_from_db()
+        self.assertEqual(TestRunRequest.StatusChoices.RETRYING.name, self.test_run_req.status)
+        self.env.refresh_from_db()
+        self.assertTrue(self.env.is_idle())
+        task.assert_called_once_with((self.test_run_req.id, ), task_id=ANY)
+
+    @override_settings(TEST_RUN_SCHEDULER_SLOTS=1)
+    @patch('api.tasks.execute_test_run_request.apply_async')
+    def test_execute_test_run_request_fair_share(self, task):
+        for index in range(5):
+            req = TestRunRequest.objects.create(requested_by='batch', pool='*')
+            schedule_test_run_request(req)
+        alice_req = TestRunRequest.objects.create(requested_by='alice', pool='*')
+        schedule_test_run_request(alice_req)
+        first_id = task.call_args[0][0][0]
+        with patch('api.tasks.run_test_run_request') as run:
+            execute_test_run_request(first_id)
+        self.assertEqual(first_id, run.call_args[0][0].id)
+        #  alice does not wait behind the whole batch
+        task.assert_called_with((alice_req.id, ), task_id=ANY)
+
+    @patch('api.tasks.execute_test_run_request.apply_async')
+    def test_reap_leaked_scheduler_slots(self, task):
+        scheduler = get_scheduler()
+        scheduler.push(self.test_run_req.id, 'Ramadan', 0, self.test_run_req.created_at)
+        self.assertEqual(self.test_run_req.id, scheduler.pop())
+        reap_expired_env_leases()
+        self.assertEqual([self.test_run_req.id], scheduler.get_running_ids())
+
+        #  the worker died before releasing the slot
+        self.test_run_req.mark_as_running()
+        self.test_run_req.mark_as_failed()
+        other_req = TestRunRequest.objects.create(requested_by='Ramadan', env=self.env)
+        with override_settings(TEST_RUN_SCHEDULER_SLOTS=1):
+            schedule_test_run_request(other_req)
+            self.assertFalse(task.called)
+            reap_expired_env_leases()
+        self.assertEqual([other_req.id], scheduler.get_running_ids())
+        task.assert_called_once_with((other_req.id, ), task_id=ANY)
 
     @patch('subprocess.Popen.wait', return_value=1)
     def test_execute_test_run_request_failed(self, wait):
         execute_test_run_request(self.test_run_req.id)
         self.test_run_req.refresh_from_db()
         self.assertTrue(wait.called)
-        wait.assert_called_with(timeout=settings.TEST_RUN_REQUEST_TIMEOUT_SECONDS)
+        wait.assert_called_with()
         self.assertEqual(TestRunRequest.StatusChoices.FAILED.name, self.test_run_req.status)
 
     @patch('subprocess.Popen.wait', return_value=0)
@@ -51,5 +301,186 @@ class TestTasks(TestCase):
         execute_test_run_request(self.test_run_req.id)
         self.test_run_req.refresh_from_db()
         self.assertTrue(wait.called)
-        wait.assert_called_with(timeout=settings.TEST_RUN_REQUEST_TIMEOUT_SECONDS)
+        wait.assert_called_with()
+        self.assertEqual(TestRunRequest.StatusChoices.SUCCESS.name, self.test_run_req.status)
+
+    @patch('api.tasks.execute_test_run_request.apply_async')
+    def test_reap_expired_env_leases(self, task):
+        self.env.lock('dead_worker')
+        self.test_run_req.mark_as_running()
+        TestEnvironment.objects.filter(id=self.env.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        reap_expired_env_leases()
+        self.env.refresh_from_db()
+        self.test_run_req.refresh_from_db()
+        self.assertTrue(self.env.is_idle())
+        self.assertEqual(TestRunRequest.StatusChoices.RETRYING.name, self.test_run_req.status)
+        self.assertEqual('\nLost the worker running on env my_env, tests requeued.', self.test_run_req.logs)
+        task.assert_called_once_with((self.test_run_req.id, ), task_id=ANY)
+
+    @patch('api.tasks.execute_test_run_request.apply_async')
+    @patch('api.tasks.run_test_run_request')
+    def test_execute_test_run_request_env_unlocked_while_queued(self, run, task):
+        self.env.lock('other_worker')
+
+        def queue(instance):
+            #  the env is unlocked before the request is marked as retrying, the next one can't be found yet
+            self.assertTrue(self.env.try_unlock('other_worker'))
+            dispatch_next_test_run_request(self.env)
+            queue_test_run_request(instance)
+
+        with patch('api.tasks.queue_test_run_request', side_effect=queue):
+            execute_test_run_request(self.test_run_req.id)
+        self.assertFalse(task.called)
+        self.assertEqual(self.test_run_req, run.call_args[0][0])
+        self.assertEqual(self.env, run.call_args[0][1])
+
+    @patch('api.tasks.execute_test_run_request.apply_async')
+    def test_reap_stranded_test_run_requests(self, task):
+        self.test_run_req.mark_as_retrying()
+        pool_req = TestRunRequest.objects.create(requested_by='Ramadan', pool='gpu')
+        pool_req.mark_as_retrying()
+        busy_env = TestEnvironment.objects.create(name='busy_env', pool='arm')
+        busy_env.lock('worker')
+        busy_req = TestRunRequest.objects.create(requested_by='Ramadan', env=busy_env)
+        busy_req.mark_as_retrying()
+        reap_expired_env_leases()
+        task.assert_called_once_with((self.test_run_req.id, ), task_id=ANY)
+
+        TestEnvironment.objects.create(name='gpu_env', pool='gpu')
+        reap_expired_env_leases()
+        #  the request already dispatched isn't sent twice
+        task.assert_called_with((pool_req.id, ), task_id=ANY)
+        self.assertEqual(2, task.call_count)
+
+    @patch('api.tasks.execute_test_run_request.apply_async')
+    def test_reap_expired_env_leases_alive(self, task):
+        self.env.lock('worker')
+        self.test_run_req.mark_as_running()
+        reap_expired_env_leases()
+        self.env.refresh_from_db()
+        self.assertTrue(self.env.is_busy())
+        self.assertFalse(task.called)
+
+    @override_settings(TEST_ENV_LEASE_HEARTBEAT_SECONDS=0)
+    @patch('api.models.TestRunRequest.get_command', return_value=[sys.executable, '-c', 'import time; time.sleep(30)'])
+    def test_run_test_run_request_lost_lease(self, _):
+        self.test_run_req.mark_as_running()
+        run_test_run_request(self.test_run_req, self.env, 'worker')
+        self.test_run_req.refresh_from_db()
+        self.assertEqual(TestRunRequest.StatusChoices.RUNNING.name, self.test_run_req.status)
+
+    @override_settings(TEST_RUN_LOG_FLUSH_SIZE=1)
+    @patch('api.models.TestRunRequest.get_command', return_value=[
+        sys.executable, '-c', 'import sys; print("out"); sys.stdout.flush(); print("err", file=sys.stderr)'
+    ])
+    def test_run_test_run_request_streams_logs(self, _):
+        self.test_run_req.mark_as_running()
+        run_test_run_request(self.test_run_req, self.env, 'worker')
+        self.test_run_req.refresh_from_db()
+        self.assertEqual(TestRunRequest.StatusChoices.SUCCESS.name, self.test_run_req.status)
+        self.assertEqual('\nout\nerr', self.test_run_req.logs)
+
+    @patch('api.models.settings.TEST_BASE_CMD', [sys.executable, '-c', 'import sys; print(sys.argv[1])'])
+    def test_run_test_run_request_parallel(self):
+        TestRunRequest.objects.filter(id=self.test_run_req.id).update(parallelism=2)
+        self.test_run_req.refresh_from_db()
+        self.test_run_req.mark_as_running()
+        run_test_run_request(self.test_run_req, self.env, 'worker')
+        self.test_run_req.refresh_from_db()
         self.assertEqual(TestRunRequest.StatusChoices.SUCCESS.name, self.test_run_req.status)
+        self.assertIn('[shard 1] path', self.test_run_req.logs)
+        self.assertIn('[shard 2] path', self.test_run_req.logs)
+
+    @patch('api.models.settings.TEST_BASE_CMD', [
+        sys.executable, '-c', 'import os, sys; print(sys.argv[1], os.environ.get("TEST_RUN_SHARD"))'
+    ])
+    def test_run_test_run_request_parallel_shard_env(self):
+        TestRunRequest.objects.filter(id=self.test_run_req.id).update(parallelism=2)
+        self.test_run_req.refresh_from_db()
+        self.test_run_req.mark_as_running()
+        run_test_run_request(self.test_run_req, self.env, 'worker')
+        self.test_run_req.refresh_from_db()
+        #  each shard gets its own test database
+        self.assertEqual({'[shard 1] path1 0', '[shard 2] path2 1'}, set(self.test_run_req.logs.strip().split('\n')))
+
+    @patch('api.models.settings.TEST_BASE_CMD', [
+        sys.executable, '-c', 'import os; print(os.environ.get("TEST_RUN_SHARD"))'
+    ])
+    def test_run_test_run_request_single_shard_env(self):
+        self.test_run_req.mark_as_running()
+        run_test_run_request(self.test_run_req, self.env, 'worker')
+        self.test_run_req.refresh_from_db()
+        self.assertEqual('\nNone', self.test_run_req.logs)
+
+    @patch('api.models.settings.TEST_BASE_CMD', [
+        sys.executable, '-c', 'import sys; sys.exit(sys.argv[1] == "path2")'
+    ])
+    def test_run_test_run_request_parallel_one_shard_failed(self):
+        TestRunRequest.objects.filter(id=self.test_run_req.id).update(parallelism=2)
+        self.test_run_req.refresh_from_db()
+        self.test_run_req.mark_as_running()
+        run_test_run_request(self.test_run_req, self.env, 'worker')
+        self.test_run_req.refresh_from_db()
+        self.assertEqual(TestRunRequest.StatusChoices.FAILED.name, self.test_run_req.status)
+
+    @patch('api.tasks.parse_junit_report', return_value=[
+        JunitTestCase('path1', 'path1::test_a', 'PASSED', 2.0, ''),
+        JunitTestCase('path2', 'path2::test_b', 'FAILED', 1.0, 'boom'),
+    ])
+    @patch('api.models.settings.TEST_BASE_CMD', [sys.executable, '-c', ''])
+    def test_run_test_run_request_records_results(self, _):
+        self.test_run_req.mark_as_running()
+        run_test_run_request(self.test_run_req, self.env, 'worker')
+        self.assertEqual(
+            [('path1::test_a', 'PASSED'), ('path2::test_b', 'FAILED')],
+            list(self.test_run_req.results.order_by('nodeid').values_list('nodeid', 'outcome'))
+        )
+        self.path1.refresh_from_db()
+        self.assertEqual(2.0, self.path1.duration)
+
+
+class TestApplyLogRetention(TestCase):
+
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        storages = override_settings(STORAGES={'test_run_logs': {
+            'BACKEND': 'django.core.files.storage.FileSystemStorage', 'OPTIONS': {'location': tmp_dir.name}
+        }})
+        storages.enable()
+        self.addCleanup(storages.disable)
+        self.env = TestEnvironment.objects.create(name='my_env')
+
+    def create_request(self, status, finished_ago):
+        instance = TestRunRequest.objects.create(requested_by='Ramadan', env=self.env, status=status)
+        instance.save_logs('logs')
+        finished_at = timezone.now() - timedelta(seconds=finished_ago)
+        TestRunRequest.objects.filter(id=instance.id).update(updated_at=finished_at)
+        return instance
+
+    def get_log_tier(self, instance):
+        return TestRunRequest.objects.values_list('log_tier', flat=True).get(id=instance.id)
+
+    @override_settings(
+        TEST_RUN_LOG_COMPRESS_AFTER_SECONDS=60, TEST_RUN_LOG_ARCHIVE_AFTER_SECONDS=600,
+        TEST_RUN_LOG_RETENTION_SECONDS=6000, TEST_RUN_LOG_RETENTION_BATCH_SIZE=2
+    )
+    def test_apply_log_retention(self):
+        SUCCESS, RUNNING = TestRunRequest.StatusChoices.SUCCESS.name, TestRunRequest.StatusChoices.RUNNING.name
+        running = self.create_request(RUNNING, 6001)
+        recent = self.create_request(SUCCESS, 30)
+        compressed = [self.create_request(SUCCESS, 61) for _ in range(3)]
+        archived = self.create_request(SUCCESS, 601)
+        purged = self.create_request(SUCCESS, 6001)
+
+        apply_log_retention()
+        self.assertEqual('CHUNKS', self.get_log_tier(running))
+        self.assertEqual('CHUNKS', self.get_log_tier(recent))
+        self.assertEqual(['COMPRESSED'] * 3, [self.get_log_tier(instance) for instance in compressed])
+        #  old logs go down all their tiers at once
+        self.assertEqual('ARCHIVED', self.get_log_tier(archived))
+        self.assertEqual('\nlogs', TestRunRequest.objects.get(id=archived.id).logs)
+        self.assertEqual('PURGED', self.get_log_tier(purged))
+
+        apply_log_retention()
+        self.assertEqual('ARCHIVED', self.get_log_tier(archived))
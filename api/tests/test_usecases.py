@@ -1,19 +1,28 @@
 from collections import OrderedDict
+from datetime import timedelta
+from unittest.mock import patch
 
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
 
-from api.models import TestFilePath, TestEnvironment
-from api.usecases import get_assets
+from api.models import TestFilePath, TestEnvironment, TestRunRequest, TestResult, TestRunRollup
+from api.usecases import (
+    get_assets, get_slowest_tests, get_flaky_tests, invalidate_assets, search_logs, get_run_stats, get_percentiles,
+    get_test_run_detail
+)
+from api.response_cache import get_test_run_cache_keys
 
 
 class TestGetAssets(TestCase):
     def setUp(self) -> None:
         TestFilePath.objects.all().delete()
         TestEnvironment.objects.all().delete()
+        cache.clear()
 
     def test_empty_models(self):
         self.assertEqual(
-            {'available_paths': [], 'test_envs': []},
+            {'available_paths': [], 'test_envs': [], 'test_pools': ['*']},
             get_assets()
         )
 
@@ -29,3 +38,220 @@ class TestGetAssets(TestCase):
         self.assertEqual(1, len(data['test_envs']))
         self.assertEqual(path_dict, data['available_paths'][0])
         self.assertEqual(env_dict, data['test_envs'][0])
+
+    def test_test_pools(self):
+        TestEnvironment.objects.create(name='env1', pool='gpu')
+        TestEnvironment.objects.create(name='env2', pool='gpu')
+        TestEnvironment.objects.create(name='env3', pool='arm')
+        self.assertEqual(['*', 'arm', 'gpu'], get_assets()['test_pools'])
+
+    def test_cached_until_invalidated(self):
+        self.assertEqual([], get_assets()['available_paths'])
+        TestFilePath.objects.create(path='path1')
+        with self.assertNumQueries(0):
+            self.assertEqual([], get_assets()['available_paths'])
+        invalidate_assets()
+        self.assertEqual(1, len(get_assets()['available_paths']))
+
+
+class TestGetTestRunDetail(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        env = TestEnvironment.objects.create(name='my_env')
+        self.test_run_req = TestRunRequest.objects.create(requested_by='Ramadan', env=env)
+        self.test_run_req.path.add(TestFilePath.objects.create(path='path1'))
+
+    def test_missing(self):
+        self.assertIsNone(get_test_run_detail(8897))
+
+    def test_cached_until_updated(self):
+        self.assertEqual('CREATED', get_test_run_detail(self.test_run_req.id)['status'])
+        with self.assertNumQueries(0):
+            self.assertEqual('CREATED', get_test_run_detail(self.test_run_req.id)['status'])
+
+        self.test_run_req.save_logs('tests started')
+        self.assertEqual('\ntests started', get_test_run_detail(self.test_run_req.id)['logs'])
+        self.test_run_req.mark_as_running()
+        self.test_run_req.mark_as_success()
+        self.assertEqual('SUCCESS', get_test_run_detail(self.test_run_req.id)['status'])
+        with self.assertNumQueries(0):
+            get_test_run_detail(self.test_run_req.id)
+
+    @override_settings(TEST_RUN_DETAIL_CACHE_MAX_LOG_SIZE=10)
+    def test_large_logs_not_cached(self):
+        self.test_run_req.save_logs('x' * 20)
+        get_test_run_detail(self.test_run_req.id)
+        self.assertIsNone(cache.get(get_test_run_cache_keys(self.test_run_req.id)[0]))
+
+    @override_settings(RESPONSE_CACHE_WAIT_SECONDS=0)
+    def test_waits_for_the_lock_holder(self):
+        key, version_key = get_test_run_cache_keys(self.test_run_req.id)
+        version = cache.get_or_set(version_key, 1)
+        cache.add(f'{key}:lock', version)
+
+        def computed_meanwhile(seconds):
+            cache.set(key, (version, {'id': self.test_run_req.id}))
+
+        with patch('api.response_cache.time.sleep', side_effect=computed_meanwhile), self.assertNumQueries(0):
+            self.assertEqual({'id': self.test_run_req.id}, get_test_run_detail(self.test_run_req.id))
+
+    @override_settings(RESPONSE_CACHE_WAIT_SECONDS=0)
+    def test_computes_when_the_lock_holder_fails(self):
+        key, version_key = get_test_run_cache_keys(self.test_run_req.id)
+        cache.add(f'{key}:lock', cache.get_or_set(version_key, 1))
+
+        with patch('api.response_cache.time.sleep', side_effect=lambda seconds: cache.delete(f'{key}:lock')):
+            self.assertEqual('CREATED', get_test_run_detail(self.test_run_req.id)['status'])
+        self.assertIsNotNone(cache.get(key))
+
+
+class TestTestResultStats(TestCase):
+    def setUp(self) -> None:
+        env = TestEnvironment.objects.create(name='my_env')
+        self.test_run_req = TestRunRequest.objects.create(requested_by='Ramadan', env=env)
+        for nodeid, outcome, duration in [
+            ('test_a', 'PASSED', 1.0),
+            ('test_a', 'FAILED', 3.0),
+            ('test_b', 'PASSED', 5.0),
+            ('test_c', 'ERROR', 0.5),
+            ('test_c', 'PASSED', 0.5),
+            ('test_c', 'ERROR', 0.5),
+        ]:
+            TestResult.objects.create(request=self.test_run_req, nodeid=nodeid, outcome=outcome, duration=duration)
+
+    def test_get_slowest_tests(self):
+        self.assertEqual([
+            {'nodeid': 'test_b', 'runs': 1, 'avg_duration': 5.0, 'max_duration': 5.0},
+            {'nodeid': 'test_a', 'runs': 2, 'avg_duration': 2.0, 'max_duration': 3.0},
+        ], get_slowest_tests(days=7, limit=2))
+
+    def test_get_flaky_tests(self):
+        self.assertEqual([
+            {'nodeid': 'test_c', 'runs': 3, 'passed': 1, 'failed': 2},
+            {'nodeid': 'test_a', 'runs': 2, 'passed': 1, 'failed': 1},
+        ], get_flaky_tests(days=7, limit=50))
+
+    def test_old_results_ignored(self):
+        TestResult.objects.update(created_at=timezone.now() - timedelta(days=8))
+        self.assertEqual([], get_slowest_tests(days=7, limit=50))
+        self.assertEqual([], get_flaky_tests(days=7, limit=50))
+
+
+@override_settings(TEST_RUN_LOG_SEARCH_MATCHES_PER_RUN=2, TEST_RUN_LOG_SEARCH_CONTEXT_CHARS=5)
+class TestSearchLogs(TestCase):
+    def setUp(self) -> None:
+        self.env = TestEnvironment.objects.create(name='my_env')
+        self.failed = TestRunRequest.objects.create(requested_by='Ramadan', env=self.env, status='FAILED')
+        self.failed.save_logs('test_a PASSED')
+        self.failed.save_logs('E   ConnectionError: refused\nE   connectionerror again\nConnectionError')
+        self.passed = TestRunRequest.objects.create(requested_by='Jane', env=self.env, status='SUCCESS')
+        self.passed.save_logs('retrying after ConnectionError')
+
+    def test_search_logs(self):
+        data = search_logs('connectionerror', limit=10)
+        self.assertEqual([self.passed.id, self.failed.id], [result['id'] for result in data['results']])
+        self.assertIsNone(data['next_before_id'])
+        self.assertEqual([
+            {'offset': 19, 'before': 'E   ', 'match': 'ConnectionError', 'after': ': ref'},
+            {'offset': 48, 'before': 'E   ', 'match': 'connectionerror', 'after': ' agai'},
+        ], data['results'][1]['matches'])
+        self.assertEqual({
+            'id', 'requested_by', 'env', 'env_name', 'pool', 'status', 'created_at', 'matches'
+        }, set(data['results'][0]))
+        self.assertEqual('my_env', data['results'][0]['env_name'])
+
+    def test_search_logs_filters(self):
+        self.assertEqual([self.failed.id], [
+            result['id'] for result in search_logs('ConnectionError', limit=10, status='FAILED')['results']
+        ])
+        self.assertEqual([self.passed.id], [
+            result['id'] for result in search_logs('ConnectionError', limit=10, requested_by='Jane')['results']
+        ])
+        self.assertEqual([], search_logs('ConnectionError', limit=10, env=self.env.id + 1)['results'])
+        self.assertEqual([], search_logs(
+            'ConnectionError', limit=10, created_after=timezone.now() + timedelta(minutes=1)
+        )['results'])
+        self.assertEqual([], search_logs('Timeout', limit=10)['results'])
+
+    def test_search_logs_compressed(self):
+        self.failed.compress_logs()
+        data = search_logs('connectionerror', limit=10)
+        self.assertEqual([self.passed.id, self.failed.id], [result['id'] for result in data['results']])
+        self.assertEqual([
+            {'offset': 19, 'before': 'E   ', 'match': 'ConnectionError', 'after': ': ref'},
+            {'offset': 48, 'before': 'E   ', 'match': 'connectionerror', 'after': ' agai'},
+        ], data['results'][1]['matches'])
+        self.assertEqual([self.passed.id], [
+            result['id'] for result in search_logs('ConnectionError', limit=10, status='SUCCESS')['results']
+        ])
+        #  only the error lines of compressed logs are searched
+        self.assertEqual([], search_logs('test_a', limit=10)['results'])
+
+    def test_search_logs_pages(self):
+        data = search_logs('ConnectionError', limit=1)
+        self.assertEqual([self.passed.id], [result['id'] for result in data['results']])
+        self.assertEqual(self.passed.id, data['next_before_id'])
+        data = search_logs('ConnectionError', limit=1, before_id=data['next_before_id'])
+        self.assertEqual([self.failed.id], [result['id'] for result in data['results']])
+        self.assertIsNone(data['next_before_id'])
+
+
+class TestRunStats(TestCase):
+    def setUp(self) -> None:
+        self.env = TestEnvironment.objects.create(name='my_env')
+        self.other_env = TestEnvironment.objects.create(name='other_env')
+        for env, status, run, wait in [
+            (self.env, 'SUCCESS', 10, 1),
+            (self.env, 'SUCCESS', 20, 1),
+            (self.env, 'FAILED', 30, 100),
+            (self.other_env, 'SUCCESS', 600, 1),
+        ]:
+            self.finish(env, status, run, wait)
+        TestRunRequest.objects.create(requested_by='Ramadan', env=self.env)
+
+    def finish(self, env, status, run, wait, days_ago=0):
+        finished_at = timezone.now() - timedelta(days=days_ago)
+        instance = TestRunRequest.objects.create(requested_by='Ramadan', env=env, status=status)
+        instance.created_at = finished_at - timedelta(seconds=wait + run)
+        instance.started_at = finished_at - timedelta(seconds=run)
+        instance.finished_at = finished_at
+        TestRunRollup.record(instance)
+
+    def test_get_percentiles(self):
+        self.assertEqual({'p50': None, 'p95': None}, get_percentiles({}))
+        self.assertEqual({'p50': 1.0, 'p95': 3.0}, get_percentiles({3: 90, 7: 10}))
+
+    def test_get_run_stats(self):
+        stats = get_run_stats(days=1)
+        self.assertEqual(3, stats['statuses']['SUCCESS'])
+        self.assertEqual(1, stats['statuses']['FAILED'])
+        self.assertEqual(1, stats['statuses']['CREATED'])
+        self.assertEqual(0, stats['statuses']['RUNNING'])
+        self.assertEqual(
+            [(self.env.id, 'my_env', 3, 60), (self.other_env.id, 'other_env', 1, 600)],
+            [(env['env'], env['env_name'], env['runs'], env['busy_seconds']) for env in stats['envs']]
+        )
+        self.assertLess(0, stats['envs'][0]['utilization'])
+        self.assertLessEqual(20, stats['run_seconds']['p50'])
+        self.assertLess(stats['run_seconds']['p50'], 30)
+        self.assertLessEqual(600, stats['run_seconds']['p95'])
+        self.assertLessEqual(100, stats['queue_wait_seconds']['p95'])
+
+    def test_get_run_stats_not_run(self):
+        TestRunRequest.objects.create(requested_by='Ramadan', env=self.other_env).cancel()
+        stats = get_run_stats(days=1)
+        self.assertEqual(1, stats['statuses']['CANCELLED'])
+        self.assertEqual([3, 1], [env['runs'] for env in stats['envs']])
+        self.assertLess(1, stats['run_seconds']['p50'])
+        self.assertLessEqual(1, stats['queue_wait_seconds']['p50'])
+
+    def test_get_run_stats_env(self):
+        stats = get_run_stats(days=1, env=self.other_env.id)
+        self.assertEqual(1, stats['statuses']['SUCCESS'])
+        self.assertEqual(0, stats['statuses']['CREATED'])
+        self.assertEqual([self.other_env.id], [env['env'] for env in stats['envs']])
+
+    def test_get_run_stats_period(self):
+        self.finish(self.env, 'FAILED', 1, 1, days_ago=3)
+        self.assertEqual(1, get_run_stats(days=1)['statuses']['FAILED'])
+        self.assertEqual(2, get_run_stats(days=4)['statuses']['FAILED'])
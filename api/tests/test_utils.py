@@ -13,7 +13,8 @@ class TestExtendedEnum(TestCase):
                  ('FAILED', 'FAILED'),
                  ('CREATED', 'CREATED'),
                  ('RETRYING', 'RETRYING'),
-                 ('FAILED_TO_START', 'FAILED_TO_START')
+                 ('FAILED_TO_START', 'FAILED_TO_START'),
+                 ('CANCELLED', 'CANCELLED')
             ],
             TestRunRequest.StatusChoices.get_as_tuple()
         )
@@ -1,10 +1,12 @@
-from unittest.mock import patch
+from unittest.mock import ANY, patch
 
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from rest_framework import status
 
-from api.models import TestRunRequest, TestEnvironment, TestFilePath
+from api.models import TestRunRequest, TestEnvironment, TestFilePath, TestResult
+from api.scheduler import get_scheduler
 
 
 class TestTestRunRequestAPIView(TestCase):
@@ -14,12 +16,13 @@ class TestTestRunRequestAPIView(TestCase):
         self.path1 = TestFilePath.objects.create(path='path1')
         self.path2 = TestFilePath.objects.create(path='path2')
         self.url = reverse('test_run_req')
+        get_scheduler().clear()
 
     def test_get_empty(self):
         response = self.client.get(self.url)
         self.assertEqual(status.HTTP_200_OK, response.status_code)
         response_data = response.json()
-        self.assertEqual([], response_data)
+        self.assertEqual({'next': None, 'previous': None, 'since': '', 'results': []}, response_data)
 
     def test_get_with_data(self):
         for _ in range(10):
@@ -27,7 +30,91 @@ class TestTestRunRequestAPIView(TestCase):
         response = self.client.get(self.url)
         self.assertEqual(status.HTTP_200_OK, response.status_code)
         response_data = response.json()
-        self.assertEqual(10, len(response_data))
+        self.assertEqual(10, len(response_data['results']))
+        self.assertIsNone(response_data['next'])
+
+    def test_get_paginated(self):
+        test_run_reqs = [TestRunRequest.objects.create(requested_by='Ramadan', env=self.env) for _ in range(5)]
+        response = self.client.get(self.url, data={'page_size': 3})
+        response_data = response.json()
+        self.assertEqual([req.id for req in test_run_reqs[:1:-1]], [item['id'] for item in response_data['results']])
+        response = self.client.get(response_data['next'])
+        response_data = response.json()
+        self.assertEqual([req.id for req in test_run_reqs[1::-1]], [item['id'] for item in response_data['results']])
+        self.assertIsNone(response_data['next'])
+
+    def test_get_filtered(self):
+        other_env = TestEnvironment.objects.create(name='other_env')
+        created = TestRunRequest.objects.create(requested_by='Ramadan', env=self.env)
+        created.path.add(self.path1, self.path2)
+        failed = TestRunRequest.objects.create(requested_by='Jane', env=other_env, status='FAILED')
+        failed.path.add(self.path2)
+        for query, expected in [
+            ({'status': 'FAILED'}, [failed]),
+            ({'env': self.env.id}, [created]),
+            ({'requested_by': 'Jane'}, [failed]),
+            ({'path': self.path2.id}, [failed, created]),
+            ({'path': self.path1.id, 'env': other_env.id}, []),
+            ({'created_after': created.created_at.isoformat()}, [failed, created]),
+            ({'created_before': created.created_at.isoformat()}, []),
+        ]:
+            response = self.client.get(self.url, data=query)
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertEqual([req.id for req in expected], [item['id'] for item in response.json()['results']])
+
+    def test_get_invalid_filter(self):
+        response = self.client.get(self.url, data={'status': 'DONE', 'env': 'my_env'})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual({'status', 'env'}, set(response.json()))
+
+    def test_get_query_count(self):
+        for _ in range(10):
+            test_run_req = TestRunRequest.objects.create(requested_by='Ramadan', env=self.env)
+            test_run_req.path.add(self.path1, self.path2)
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+    def test_get_since(self):
+        old_req = TestRunRequest.objects.create(requested_by='Ramadan', env=self.env)
+        since = self.client.get(self.url).json()['since']
+        new_req = TestRunRequest.objects.create(requested_by='Ramadan', env=self.env)
+        old_req.mark_as_running()
+
+        response = self.client.get(self.url, data={'since': since})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        response_data = response.json()
+        self.assertEqual([new_req.id, old_req.id], [item['id'] for item in response_data['results']])
+        self.assertFalse(response_data['has_more'])
+
+        response = self.client.get(self.url, data={'since': response_data['since']})
+        response_data = response.json()
+        self.assertEqual([], response_data['results'])
+
+    def test_get_since_page_size(self):
+        test_run_reqs = [TestRunRequest.objects.create(requested_by='Ramadan', env=self.env) for _ in range(3)]
+        response_data = self.client.get(self.url, data={'since': '', 'page_size': 2}).json()
+        self.assertEqual([req.id for req in test_run_reqs[:2]], [item['id'] for item in response_data['results']])
+        self.assertTrue(response_data['has_more'])
+        response_data = self.client.get(self.url, data={'since': response_data['since'], 'page_size': 2}).json()
+        self.assertEqual([test_run_reqs[2].id], [item['id'] for item in response_data['results']])
+        self.assertFalse(response_data['has_more'])
+
+    def test_get_since_invalid(self):
+        response = self.client.get(self.url, data={'since': 'rambo'})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual({'since': ['Invalid token.']}, response.json())
+
+    def test_get_not_modified(self):
+        TestRunRequest.objects.create(requested_by='Ramadan', env=self.env)
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+
+        TestRunRequest.objects.create(requested_by='Ramadan', env=self.env)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
 
     def test_post_no_data(self):
         response = self.client.post(self.url, data={})
@@ -42,6 +129,94 @@ class TestTestRunRequestAPIView(TestCase):
             response_data
         )
 
+    @override_settings(TEST_RUN_MAX_PARALLELISM=4)
+    def test_post_invalid_parallelism(self):
+        response = self.client.post(
+            self.url, data={'env': self.env.id, 'path': self.path1.id, 'requested_by': 'iron man', 'parallelism': 5}
+        )
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual({'parallelism': ['Ensure this value is between 1 and 4.']}, response.json())
+
+    @patch('api.tasks.execute_test_run_request.apply_async')
+    def test_post_bulk(self, task):
+        data = [
+            {'env': self.env.id, 'path': [self.path1.id, self.path2.id], 'requested_by': f'user {i}'} for i in range(50)
+        ] + [{'env': None, 'pool': '*', 'path': [self.path1.id], 'requested_by': 'ci', 'priority': 2}]
+        with self.assertNumQueries(5):
+            response = self.client.post(reverse('test_run_req_bulk'), data=data, content_type='application/json')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        ids = response.json()['ids']
+        self.assertEqual(51, len(ids))
+        self.assertEqual(51, TestRunRequest.objects.filter(id__in=ids).count())
+        self.assertEqual(101, TestRunRequest.path.through.objects.filter(testrunrequest_id__in=ids).count())
+        pool_req = TestRunRequest.objects.get(id=ids[-1])
+        self.assertEqual(('*', 2, ['path1']), (pool_req.pool, pool_req.priority, pool_req.get_paths()))
+        self.assertTrue(task.called)
+
+    def test_post_bulk_invalid(self):
+        data = [
+            {'env': self.env.id, 'path': [self.path1.id], 'requested_by': 'ci'},
+            {'env': 500, 'path': [self.path1.id, 500], 'requested_by': 'ci'},
+            {'env': None, 'pool': 'gpu', 'path': [self.path1.id], 'requested_by': 'ci'},
+        ]
+        response = self.client.post(reverse('test_run_req_bulk'), data=data, content_type='application/json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual([
+            {},
+            {
+                'env': ['Invalid pk "500" - object does not exist.'],
+                'path': ['Invalid pk "500" - object does not exist.'],
+            },
+            {'pool': ['There is no test environment in this pool.']},
+        ], response.json())
+        self.assertFalse(TestRunRequest.objects.exists())
+
+    @override_settings(TEST_RUN_BULK_MAX_SIZE=1)
+    def test_post_bulk_too_many(self):
+        data = [{'env': self.env.id, 'path': [self.path1.id], 'requested_by': 'ci'}] * 2
+        response = self.client.post(reverse('test_run_req_bulk'), data=data, content_type='application/json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual({'non_field_errors': ['Ensure there are at most 1 requests.']}, response.json())
+
+    @patch('api.tasks.execute_test_run_request.apply_async')
+    def test_post_valid_pool(self, task):
+        TestEnvironment.objects.create(name='gpu_env', pool='gpu')
+        response = self.client.post(
+            self.url, data={'env': '', 'pool': 'gpu', 'path': self.path1.id, 'requested_by': 'iron man'}
+        )
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        response_data = response.json()
+        self.assertIsNone(response_data['env'])
+        self.assertEqual('gpu', response_data['pool'])
+        task.assert_called_with((response_data['id'], ), task_id=ANY)
+
+    def test_post_invalid_pool(self):
+        response = self.client.post(
+            self.url, data={'env': '', 'pool': 'gpu', 'path': self.path1.id, 'requested_by': 'iron man'}
+        )
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual({'pool': ['There is no test environment in this pool.']}, response.json())
+
+    def test_post_env_and_pool(self):
+        response = self.client.post(
+            self.url, data={'env': self.env.id, 'pool': '*', 'path': self.path1.id, 'requested_by': 'iron man'}
+        )
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual({'pool': ['Select either an env or a pool.']}, response.json())
+
+    def test_post_no_env_nor_pool(self):
+        response = self.client.post(self.url, data={'env': '', 'path': self.path1.id, 'requested_by': 'iron man'})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual({'env': ['Select an env, or a pool to run on any idle env of it.']}, response.json())
+
+    @override_settings(TEST_RUN_MAX_PRIORITY=5)
+    def test_post_invalid_priority(self):
+        response = self.client.post(
+            self.url, data={'env': self.env.id, 'path': self.path1.id, 'requested_by': 'iron man', 'priority': 6}
+        )
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual({'priority': ['Ensure this value is between 0 and 5.']}, response.json())
+
     def test_post_invalid_path_and_env_id(self):
         response = self.client.post(self.url, data={'env': 'rambo', 'path': "waw", 'requested_by': 'iron man'})
         self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
@@ -60,7 +235,7 @@ class TestTestRunRequestAPIView(TestCase):
             'path': ['Invalid pk "500" - object does not exist.']
         }, response_data)
 
-    @patch('api.views.execute_test_run_request.delay')
+    @patch('api.tasks.execute_test_run_request.apply_async')
     def test_post_valid_multiple_paths(self, task):
         response = self.client.post(
             self.url,
@@ -70,16 +245,16 @@ class TestTestRunRequestAPIView(TestCase):
         response_data = response.json()
         self.__assert_valid_response(response_data, [self.path1.id, self.path2.id])
         self.assertTrue(task.called)
-        task.assert_called_with(response_data['id'])
+        task.assert_called_with((response_data['id'], ), task_id=ANY)
 
-    @patch('api.views.execute_test_run_request.delay')
+    @patch('api.tasks.execute_test_run_request.apply_async')
     def test_post_valid_one_path(self, task):
         response = self.client.post(self.url, data={'env': self.env.id, 'path': self.path1.id, 'requested_by': 'iron man'})
         self.assertEqual(status.HTTP_201_CREATED, response.status_code)
         response_data = response.json()
         self.__assert_valid_response(response_data, [self.path1.id])
         self.assertTrue(task.called)
-        task.assert_called_with(response_data['id'])
+        task.assert_called_with((response_data['id'], ), task_id=ANY)
 
     def __assert_valid_response(self, response_data, expected_paths):
         self.assertIn('created_at', response_data)
@@ -113,12 +288,35 @@ class TestRunRequestItemAPIView(TestCase):
         self.test_run_req.path.add(self.path1)
         self.test_run_req.path.add(self.path2)
         self.url = reverse('test_run_req_item', args=(self.test_run_req.id, ))
+        cache.clear()
 
     def test_get_invalid_pk(self):
         self.url = reverse('test_run_req_item', args=(8897, ))
         response = self.client.get(self.url)
         self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
 
+    def test_get_not_a_pk(self):
+        response = self.client.get(reverse('test_run_req_item', args=('rambo', )))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    @override_settings(TEST_RUN_LOG_READ_LIMIT=6)
+    def test_get_log_tail(self):
+        self.test_run_req.save_logs('first')
+        self.test_run_req.save_logs('second')
+        response_data = self.client.get(self.url).json()
+        self.assertEqual(13, response_data['log_size'])
+        self.assertEqual(7, response_data['logs_offset'])
+        self.assertEqual('second', response_data['logs'])
+
+    def test_get_cached(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(self.test_run_req.id, response.json()['id'])
+
+        self.test_run_req.save_logs('tests started')
+        self.assertEqual('\ntests started', self.client.get(self.url).json()['logs'])
+
     def test_get_valid(self):
         response = self.client.get(self.url)
         self.assertEqual(status.HTTP_200_OK, response.status_code)
@@ -142,6 +340,193 @@ class TestRunRequestItemAPIView(TestCase):
         self.assertEqual(self.test_run_req.status, response_data['status'])
 
 
+class TestRunRequestLogsAPIView(TestCase):
+
+    def setUp(self) -> None:
+        self.env = TestEnvironment.objects.create(name='my_env')
+        self.test_run_req = TestRunRequest.objects.create(requested_by='Ramadan', env=self.env)
+        self.test_run_req.save_logs('first')
+        self.test_run_req.save_logs('second')
+        self.url = reverse('test_run_req_logs', args=(self.test_run_req.id, ))
+
+    def test_get_invalid_pk(self):
+        response = self.client.get(reverse('test_run_req_logs', args=(8897, )))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    def test_get_all(self):
+        response = self.client.get(self.url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(
+            {'id': self.test_run_req.id, 'offset': 0, 'next_offset': 13, 'log_size': 13, 'logs': '\nfirst\nsecond'},
+            response.json()
+        )
+
+    def test_get_range(self):
+        response = self.client.get(self.url, data={'offset': 3, 'limit': 7})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(
+            {'id': self.test_run_req.id, 'offset': 3, 'next_offset': 10, 'log_size': 13, 'logs': 'rst\nsec'},
+            response.json()
+        )
+
+    def test_get_invalid_range(self):
+        response = self.client.get(self.url, data={'offset': -1, 'limit': 0})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual({'offset', 'limit'}, set(response.json()))
+
+
+async def fake_events(stream, last_event_id):
+    yield f'id: 1-0\nevent: status\ndata: {stream} {last_event_id}\n\n'
+
+
+@override_settings(TEST_RUN_EVENTS_REDIS_URL='redis://localhost')
+@patch('api.views.iter_events', fake_events)
+class TestRunRequestEventsView(TestCase):
+
+    def setUp(self) -> None:
+        self.env = TestEnvironment.objects.create(name='my_env')
+        self.test_run_req = TestRunRequest.objects.create(requested_by='Ramadan', env=self.env)
+
+    async def read_events(self, url, **extra):
+        response = await self.async_client.get(url, **extra)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('text/event-stream', response['Content-Type'])
+        return b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+    async def test_all_events(self):
+        events = await self.read_events(reverse('test_run_req_events'))
+        self.assertEqual('id: 1-0\nevent: status\ndata: test-run:events $\n\n', events)
+
+    async def test_request_events(self):
+        events = await self.read_events(reverse('test_run_req_item_events', args=(self.test_run_req.id, )))
+        self.assertEqual(f'id: 1-0\nevent: status\ndata: test-run:{self.test_run_req.id}:events 0\n\n', events)
+
+    async def test_request_events_resume(self):
+        url = reverse('test_run_req_item_events', args=(self.test_run_req.id, ))
+        events = await self.read_events(url, headers={'Last-Event-ID': '5-1'})
+        self.assertIn(f'test-run:{self.test_run_req.id}:events 5-1', events)
+
+    async def test_request_events_invalid_last_event_id(self):
+        url = reverse('test_run_req_item_events', args=(self.test_run_req.id, ))
+        response = await self.async_client.get(url, headers={'Last-Event-ID': 'rambo'})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+    async def test_request_events_invalid_pk(self):
+        response = await self.async_client.get(reverse('test_run_req_item_events', args=(8897, )))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    @override_settings(TEST_RUN_EVENTS_REDIS_URL='')
+    async def test_events_disabled(self):
+        response = await self.async_client.get(reverse('test_run_req_events'))
+        self.assertEqual(status.HTTP_503_SERVICE_UNAVAILABLE, response.status_code)
+
+
+class TestTestResultAPIViews(TestCase):
+
+    def setUp(self) -> None:
+        self.env = TestEnvironment.objects.create(name='my_env')
+        self.test_run_req = TestRunRequest.objects.create(requested_by='Ramadan', env=self.env)
+        self.results = [
+            TestResult.objects.create(request=self.test_run_req, nodeid='test_a', outcome=outcome, duration=1.0)
+            for outcome in ('PASSED', 'FAILED')
+        ]
+
+    def test_history(self):
+        response = self.client.get(reverse('test_results_history'), data={'nodeid': 'test_a'})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        response_data = response.json()
+        self.assertEqual([self.results[1].id, self.results[0].id], [item['id'] for item in response_data['results']])
+        self.assertEqual(
+            {'id', 'request', 'path', 'nodeid', 'outcome', 'duration', 'message', 'created_at'},
+            set(response_data['results'][0])
+        )
+
+    def test_history_no_nodeid(self):
+        response = self.client.get(reverse('test_results_history'))
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual({'nodeid': ['This field is required.']}, response.json())
+
+    def test_slowest(self):
+        response = self.client.get(reverse('test_results_slowest'), data={'days': 1})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(
+            [{'nodeid': 'test_a', 'runs': 2, 'avg_duration': 1.0, 'max_duration': 1.0}], response.json()
+        )
+
+    def test_flaky(self):
+        response = self.client.get(reverse('test_results_flaky'))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([{'nodeid': 'test_a', 'runs': 2, 'passed': 1, 'failed': 1}], response.json())
+
+    def test_invalid_query(self):
+        response = self.client.get(reverse('test_results_flaky'), data={'days': 0, 'limit': 1000})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual({'days', 'limit'}, set(response.json()))
+
+
+class TestRunRequestCancelAPIView(TestCase):
+
+    def setUp(self) -> None:
+        env = TestEnvironment.objects.create(name='my_env')
+        self.test_run_req = TestRunRequest.objects.create(requested_by='Ramadan', env=env)
+        self.url = reverse('test_run_req_cancel', args=(self.test_run_req.id, ))
+        get_scheduler().clear()
+
+    def test_cancel(self):
+        response = self.client.post(self.url)
+        self.assertEqual(status.HTTP_202_ACCEPTED, response.status_code)
+        self.assertEqual({'id': self.test_run_req.id, 'status': 'CANCELLED'}, response.json())
+
+    def test_cancel_finished(self):
+        self.test_run_req.mark_as_failed()
+        response = self.client.post(self.url)
+        self.assertEqual(status.HTTP_409_CONFLICT, response.status_code)
+        self.assertEqual({'detail': 'Tests are already done, with status FAILED.'}, response.json())
+
+    def test_cancel_not_found(self):
+        response = self.client.post(reverse('test_run_req_cancel', args=(8897, )))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+
+class TestRunLogSearchAPIView(TestCase):
+
+    def setUp(self) -> None:
+        self.env = TestEnvironment.objects.create(name='my_env')
+        self.test_run_req = TestRunRequest.objects.create(requested_by='Ramadan', env=self.env)
+        self.test_run_req.save_logs('E   ConnectionError')
+
+    def test_search(self):
+        response = self.client.get(reverse('test_run_req_search'), data={'q': 'connectionerror', 'status': 'CREATED'})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        response_data = response.json()
+        self.assertEqual([self.test_run_req.id], [result['id'] for result in response_data['results']])
+        self.assertEqual('ConnectionError', response_data['results'][0]['matches'][0]['match'])
+
+    def test_search_invalid_query(self):
+        response = self.client.get(reverse('test_run_req_search'), data={'q': 'E', 'status': 'DONE'})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual({'q', 'status'}, set(response.json()))
+
+
+class TestRunStatsAPIView(TestCase):
+
+    def test_stats(self):
+        env = TestEnvironment.objects.create(name='my_env')
+        test_run_req = TestRunRequest.objects.create(requested_by='Ramadan', env=env)
+        test_run_req.mark_as_running()
+        test_run_req.mark_as_success()
+        response = self.client.get(reverse('test_run_req_stats'), data={'days': 1, 'env': env.id})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        response_data = response.json()
+        self.assertEqual(1, response_data['statuses']['SUCCESS'])
+        self.assertEqual([env.id], [item['env'] for item in response_data['envs']])
+        self.assertEqual({'p50', 'p95'}, set(response_data['run_seconds']))
+
+    def test_stats_invalid_query(self):
+        response = self.client.get(reverse('test_run_req_stats'), data={'days': 0})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+
 class TestAssetsAPIView(TestCase):
 
     def setUp(self) -> None:
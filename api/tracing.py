@@ -0,0 +1,46 @@
+import hashlib
+from contextlib import contextmanager
+from typing import Iterator
+
+from django.conf import settings
+
+try:
+    from opentelemetry import trace
+except ImportError:  # tracing is optional
+    trace = None
+
+
+def get_trace_id(request_id: int) -> int:
+    return int(hashlib.sha256(f'test-run:{request_id}'.encode()).hexdigest()[:32], 16)
+
+
+def is_tracing_enabled() -> bool:
+    return trace is not None and settings.TEST_RUN_TRACING
+
+
+@contextmanager
+def trace_test_run(name: str, request_id: int, **attributes) -> Iterator[None]:
+    """Records a span of the run, in a trace of its own.
+
+    The trace id is derived from the request id, so that the spans recorded by the web and worker processes end up
+    in the same trace without passing a context through the broker. A span started inside another trace, e.g. the
+    HTTP request creating the run, links to it.
+    """
+    if not is_tracing_enabled():
+        yield
+        return
+    trace_id = get_trace_id(request_id)
+    current = trace.get_current_span().get_span_context()
+    context, links = None, []
+    if current.trace_id != trace_id:
+        root = trace.SpanContext(
+            trace_id, trace_id & 0xFFFFFFFFFFFFFFFF, is_remote=True, trace_flags=trace.TraceFlags(
+                trace.TraceFlags.SAMPLED
+            )
+        )
+        context = trace.set_span_in_context(trace.NonRecordingSpan(root))
+        links = [trace.Link(current)] if current.is_valid else []
+    with trace.get_tracer(__name__).start_as_current_span(
+        name, context=context, links=links, attributes={'test_run.id': request_id, **attributes}
+    ):
+        yield
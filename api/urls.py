@@ -1,9 +1,25 @@
 from django.urls import path
 
-from .views import TestRunRequestAPIView, TestRunRequestItemAPIView, AssetsAPIView
+from .views import (
+    TestRunRequestAPIView, TestRunRequestBulkAPIView, TestRunRequestItemAPIView, TestRunRequestLogsAPIView,
+    TestRunRequestCancelAPIView,
+    AssetsAPIView, test_run_events,
+    TestRunLogSearchAPIView, TestRunStatsAPIView,
+    TestResultHistoryAPIView, TestResultSlowestAPIView, TestResultFlakyAPIView
+)
 
 urlpatterns = [
     path('assets', AssetsAPIView.as_view(), name='assets'),
     path('test-run', TestRunRequestAPIView.as_view(), name='test_run_req'),
+    path('test-run/events', test_run_events, name='test_run_req_events'),
+    path('test-run/bulk', TestRunRequestBulkAPIView.as_view(), name='test_run_req_bulk'),
+    path('test-run/search', TestRunLogSearchAPIView.as_view(), name='test_run_req_search'),
+    path('test-run/stats', TestRunStatsAPIView.as_view(), name='test_run_req_stats'),
     path('test-run/<pk>', TestRunRequestItemAPIView.as_view(), name='test_run_req_item'),
+    path('test-run/<int:pk>/events', test_run_events, name='test_run_req_item_events'),
+    path('test-run/<pk>/logs', TestRunRequestLogsAPIView.as_view(), name='test_run_req_logs'),
+    path('test-run/<pk>/cancel', TestRunRequestCancelAPIView.as_view(), name='test_run_req_cancel'),
+    path('test-results/history', TestResultHistoryAPIView.as_view(), name='test_results_history'),
+    path('test-results/slowest', TestResultSlowestAPIView.as_view(), name='test_results_slowest'),
+    path('test-results/flaky', TestResultFlakyAPIView.as_view(), name='test_results_flaky'),
 ]
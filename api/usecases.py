@@ -1,9 +1,241 @@
-from api.models import TestFilePath, TestEnvironment
-from api.serializers import TestFilePathSerializer, TestEnvironmentSerializer
+import io
+import math
+import re
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, F, Max, Q, Sum, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from api.allocator import ANY_POOL
+from api.models import (
+    TestFilePath, TestEnvironment, TestResult, TestRunCompressedLog, TestRunLogChunk, TestRunRequest, TestRunRollup,
+    decompress_logs, get_bucket_upper_bound
+)
+from api.response_cache import get_test_run_cache_keys, invalidate, read_through
+from api.serializers import TestFilePathSerializer, TestEnvironmentSerializer, TestRunRequestItemSerializer
+
+
+ASSETS_CACHE_KEY = 'assets'
+ASSETS_VERSION_CACHE_KEY = 'assets:version'
+
+
+def get_assets_version():
+    return cache.get_or_set(ASSETS_VERSION_CACHE_KEY, time.time_ns, None)
+
+
+def invalidate_assets():
+    invalidate(ASSETS_VERSION_CACHE_KEY)
+
+
+def get_test_pools():
+    pools = TestEnvironment.objects.exclude(pool='').order_by('pool').values_list('pool', flat=True).distinct()
+    return [ANY_POOL] + list(pools)
 
 
 def get_assets():
+    def compute():
+        return {
+            'available_paths': TestFilePathSerializer(TestFilePath.get_available().order_by('path'), many=True).data,
+            'test_envs': TestEnvironmentSerializer(TestEnvironment.objects.all().order_by('name'), many=True).data,
+            'test_pools': get_test_pools()
+        }, settings.ASSETS_CACHE_SECONDS
+
+    return read_through(ASSETS_CACHE_KEY, ASSETS_VERSION_CACHE_KEY, compute)
+
+
+def get_test_run_detail(pk):
+    """Serialized request, or None if it doesn't exist. Finished requests never change, they stay cached for long,
+    the others until their next update. Requests with larger logs than TEST_RUN_DETAIL_CACHE_MAX_LOG_SIZE aren't
+    cached, so that the size of the cache stays bounded."""
+    def compute():
+        instance = TestRunRequest.objects.select_related('env').prefetch_related('path').filter(pk=pk).first()
+        if instance is None:
+            return None, 0
+        if instance.log_size > settings.TEST_RUN_DETAIL_CACHE_MAX_LOG_SIZE:
+            timeout = 0
+        elif instance.status in TestRunRequest.FINISHED_STATUSES:
+            timeout = settings.TEST_RUN_DETAIL_CACHE_FINISHED_SECONDS
+        else:
+            timeout = settings.TEST_RUN_DETAIL_CACHE_UNFINISHED_SECONDS
+        return TestRunRequestItemSerializer(instance).data, timeout
+
+    key, version_key = get_test_run_cache_keys(pk)
+    return read_through(key, version_key, compute, settings.TEST_RUN_DETAIL_CACHE_FINISHED_SECONDS)
+
+
+def get_queue_depths():
+    #  requests targeting a pool have no env until they start
+    return list(TestRunRequest.objects.filter(status__in=TestRunRequest.PENDING_STATUSES).values_list(
+        'env__name', 'pool'
+    ).annotate(count=Count('id')).order_by('env__name', 'pool'))
+
+
+def get_recent_results(days):
+    return TestResult.objects.filter(created_at__gte=timezone.now() - timedelta(days=days))
+
+
+def get_slowest_tests(days, limit):
+    return list(get_recent_results(days).values('nodeid').annotate(
+        runs=Count('id'), avg_duration=Avg('duration'), max_duration=Max('duration')
+    ).order_by('-avg_duration', 'nodeid')[:limit])
+
+
+def get_flaky_tests(days, limit):
+    #  a test is flaky when it both passed and failed in the period
+    failed_outcomes = (TestResult.OutcomeChoices.FAILED.name, TestResult.OutcomeChoices.ERROR.name)
+    return list(get_recent_results(days).values('nodeid').annotate(
+        runs=Count('id'),
+        passed=Count('id', filter=Q(outcome=TestResult.OutcomeChoices.PASSED.name)),
+        failed=Count('id', filter=Q(outcome__in=failed_outcomes))
+    ).filter(passed__gt=0, failed__gt=0).order_by('-failed', 'nodeid')[:limit])
+
+
+def get_percentiles(bucket_counts, percentiles=(50, 95)):
+    """Percentiles of the durations counted per bucket, as the upper bound of the bucket they fall in."""
+    total = sum(bucket_counts.values())
+    values = {}
+    for percentile in percentiles:
+        if not total:
+            values[f'p{percentile}'] = None
+            continue
+        rank = math.ceil(total * percentile / 100)
+        seen = 0
+        for bucket in sorted(bucket_counts):
+            seen += bucket_counts[bucket]
+            if seen >= rank:
+                values[f'p{percentile}'] = round(get_bucket_upper_bound(bucket), 3)
+                break
+    return values
+
+
+def get_run_stats(days, env=None):
+    """Runs finished in the last `days` days (today included) and the runs currently pending or running, read
+    from the rollups and the status index only."""
+    now = timezone.now()
+    since = timezone.localdate(now) - timedelta(days=days - 1)
+    rollups = TestRunRollup.objects.filter(day__gte=since)
+    requests = TestRunRequest.objects.filter(
+        status__in=TestRunRequest.PENDING_STATUSES + (TestRunRequest.StatusChoices.RUNNING.name, )
+    )
+    if env is not None:
+        rollups = rollups.filter(env_id=env)
+        requests = requests.filter(env_id=env)
+    runs = rollups.filter(metric=TestRunRollup.MetricChoices.RUN.name)
+    finished = rollups.filter(
+        metric__in=(TestRunRollup.MetricChoices.RUN.name, TestRunRollup.MetricChoices.NOT_RUN.name)
+    )
+
+    statuses = {name: 0 for name, _ in TestRunRequest.StatusChoices.get_as_tuple()}
+    for status, count in finished.values_list('status').annotate(total=Sum('count')).order_by():
+        statuses[status] += count
+    for status, count in requests.values_list('status').annotate(total=Count('id')).order_by():
+        statuses[status] += count
+
+    period_seconds = (now - timezone.make_aware(datetime.combine(since, datetime.min.time()))).total_seconds()
+    env_runs = list(runs.filter(env__isnull=False).values_list('env').annotate(
+        total=Sum('count'), total_seconds=Sum('seconds')
+    ).order_by('env'))
+    envs = TestEnvironment.objects.in_bulk([env_id for env_id, _, _ in env_runs])
+    utilization = []
+    for env_id, count, seconds in env_runs:
+        utilization.append({
+            'env': env_id,
+            'env_name': envs[env_id].name if env_id in envs else None,
+            'runs': count,
+            'busy_seconds': round(seconds, 3),
+            'utilization': round(seconds / period_seconds, 4),
+        })
+
+    durations = {name: {} for name, _ in TestRunRollup.MetricChoices.get_as_tuple()}
+    for metric, bucket, count in rollups.values_list('metric', 'bucket').annotate(total=Sum('count')).order_by():
+        durations[metric][bucket] = count
     return {
-        'available_paths': TestFilePathSerializer(TestFilePath.objects.all().order_by('path'), many=True).data,
-        'test_envs': TestEnvironmentSerializer(TestEnvironment.objects.all().order_by('name'), many=True).data
+        'days': days,
+        'statuses': statuses,
+        'envs': utilization,
+        'run_seconds': get_percentiles(durations[TestRunRollup.MetricChoices.RUN.name]),
+        'queue_wait_seconds': get_percentiles(durations[TestRunRollup.MetricChoices.WAIT.name]),
     }
+
+
+def get_log_matches(data, offset, pattern, limit):
+    """Snippets of the lines of a log chunk around the matches, a match split across two chunks is not found."""
+    matches = []
+    context = settings.TEST_RUN_LOG_SEARCH_CONTEXT_CHARS
+    for match in pattern.finditer(data):
+        start, end = match.span()
+        line_start = data.rfind('\n', 0, start) + 1
+        line_end = data.find('\n', end)
+        line_end = len(data) if line_end == -1 else line_end
+        matches.append({
+            'offset': offset + start,
+            'before': data[max(line_start, start - context):start],
+            'match': data[start:end],
+            'after': data[end:min(line_end, end + context)],
+        })
+        if len(matches) == limit:
+            break
+    return matches
+
+
+def search_logs(q, limit, before_id=None, status=None, env=None, requested_by=None, created_after=None,
+                created_before=None):
+    """Runs whose logs contain `q`, case insensitive, newest first, with snippets of their first matches.
+
+    The logs in chunks are searched whole, the compressed ones only through their lines matching
+    TEST_RUN_LOG_SEARCH_PATTERN, archived logs are not searched.
+    """
+    filters = {
+        'request_id__lt': before_id,
+        'request__status': status,
+        'request__env_id': env,
+        'request__requested_by': requested_by,
+        'request__created_at__gte': created_after,
+        'request__created_at__lt': created_before,
+    }
+    filters = {name: value for name, value in filters.items() if value is not None}
+    chunks = TestRunLogChunk.objects.filter(data__icontains=q, **filters)
+    compressed_logs = TestRunCompressedLog.objects.filter(search_text__icontains=q, **filters)
+    request_ids = sorted({
+        *chunks.order_by('-request_id').values_list('request_id', flat=True).distinct()[:limit + 1],
+        *compressed_logs.order_by('-request_id').values_list('request_id', flat=True)[:limit + 1],
+    }, reverse=True)[:limit + 1]
+    has_more = len(request_ids) > limit
+    request_ids = request_ids[:limit]
+
+    matches_per_run = settings.TEST_RUN_LOG_SEARCH_MATCHES_PER_RUN
+    first_chunks = chunks.filter(request_id__in=request_ids).annotate(
+        row=Window(RowNumber(), partition_by=F('request_id'), order_by=F('offset').asc())
+    ).filter(row__lte=matches_per_run).order_by('request_id', 'offset').values_list('request_id', 'offset', 'data')
+    pattern = re.compile(re.escape(q), re.IGNORECASE)
+    matches = {}
+    for request_id, offset, data in first_chunks:
+        run_matches = matches.setdefault(request_id, [])
+        if len(run_matches) < matches_per_run:
+            run_matches.extend(get_log_matches(data, offset, pattern, matches_per_run - len(run_matches)))
+    for request_id, data in compressed_logs.filter(request_id__in=request_ids).values_list('request_id', 'data'):
+        #  the snippets and offsets come from the logs themselves
+        matches[request_id] = get_log_matches(decompress_logs(io.BytesIO(data)), 0, pattern, matches_per_run)
+
+    requests = TestRunRequest.objects.select_related('env').in_bulk(request_ids)
+    results = []
+    for request_id in request_ids:
+        instance = requests.get(request_id)
+        if instance is None:
+            #  deleted in the meantime
+            continue
+        results.append({
+            'id': instance.id,
+            'requested_by': instance.requested_by,
+            'env': instance.env_id,
+            'env_name': instance.env.name if instance.env else None,
+            'pool': instance.pool,
+            'status': instance.status,
+            'created_at': instance.created_at,
+            'matches': matches.get(request_id, []),
+        })
+    return {'results': results, 'next_before_id': request_ids[-1] if has_more else None}
@@ -1,3 +1,6 @@
+import os
+import socket
+import uuid
 from enum import Enum
 from typing import List, Tuple
 
@@ -7,3 +10,8 @@ class ExtendedEnum(Enum):
     def get_as_tuple(cls) -> List[Tuple]:
         #  return str representation of value to allow for objects as values
         return [(item.name, str(item.value)) for item in cls]
+
+
+def get_lease_owner() -> str:
+    #  unique per acquisition, but still tells which host/process holds the lease
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
@@ -1,30 +1,231 @@
+import hashlib
+import re
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from rest_framework import status
-from rest_framework.generics import ListCreateAPIView, RetrieveAPIView
+from rest_framework.generics import CreateAPIView, GenericAPIView, ListAPIView, ListCreateAPIView, RetrieveAPIView
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from api.models import TestRunRequest
-from api.serializers import TestRunRequestSerializer, TestRunRequestItemSerializer
-from api.tasks import execute_test_run_request
-from api.usecases import get_assets
+from api.db import run_db
+from api.events import get_stream_name, iter_events, publish_status, publish_statuses
+from api.metrics import get_metrics, render_metrics
+from api.models import TestRunRequest, TestResult
+from api.pagination import (
+    TestRunRequestCursorPagination, TestResultCursorPagination, encode_change_token, decode_change_token
+)
+from api.serializers import (
+    TestRunRequestSerializer, TestRunRequestItemSerializer, TestRunRequestLogsQuerySerializer, TestResultSerializer,
+    TestResultHistoryQuerySerializer, TestResultStatsQuerySerializer, TestRunLogSearchQuerySerializer,
+    TestRunRequestListQuerySerializer, TestRunStatsQuerySerializer
+)
+from api.tasks import cancel_test_run_request, schedule_test_run_request, schedule_test_run_requests
+from api.tracing import trace_test_run
+from api.usecases import (
+    get_assets, get_slowest_tests, get_flaky_tests, get_queue_depths, get_run_stats, get_test_run_detail, search_logs
+)
+
+
+def get_test_run_list_etag(request, *args, **kwargs):
+    #  the list only changes when a request is created or updated, so the latest change identifies it
+    latest_change = TestRunRequest.get_latest_change()
+    return hashlib.md5(f'{latest_change}|{request.GET.urlencode()}'.encode()).hexdigest()
+
 
+class AsyncAPIViewMixin:
+    """Serves the view as an async view. The DRF request handling still runs as sync code, in the database pool of
+    `api.db`, so that under ASGI a request waiting on the database holds a pool thread and its connection, and
+    not a thread and a connection of its own."""
+    view_is_async = True
 
-class TestRunRequestAPIView(ListCreateAPIView):
+    async def dispatch(self, request, *args, **kwargs):
+        return await run_db(super().dispatch, request, *args, **kwargs)
+
+
+class TestRunRequestAPIView(AsyncAPIViewMixin, ListCreateAPIView):
     serializer_class = TestRunRequestSerializer
-    queryset = TestRunRequest.objects.all().order_by('-created_at')
+    queryset = TestRunRequest.objects.select_related('env').prefetch_related('path')
+    pagination_class = TestRunRequestCursorPagination
+
+    @method_decorator(condition(etag_func=get_test_run_list_etag))
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method != 'GET':
+            return queryset
+        query = TestRunRequestListQuerySerializer(data=self.request.query_params)
+        query.is_valid(raise_exception=True)
+        filters = query.get_filters()
+        #  a request is listed once, even when several of its paths match
+        return queryset.filter(**filters).distinct() if 'path' in filters else queryset.filter(**filters)
+
+    def list(self, request, *args, **kwargs):
+        latest_change = encode_change_token(TestRunRequest.get_latest_change())
+        if 'since' not in request.query_params:
+            response = super().list(request, *args, **kwargs)
+            response.data['since'] = latest_change
+            return response
+
+        #  changes feed, requests created or updated after the `since` token, oldest change first
+        since = decode_change_token(request.query_params['since'])
+        queryset = self.get_queryset()
+        if since is not None:
+            queryset = queryset.filter(TestRunRequest.changed_since(*since))
+        page_size = self.paginator.get_page_size(request)
+        items = list(queryset.order_by('updated_at', 'id')[:page_size + 1])
+        has_more = len(items) > page_size
+        items = items[:page_size]
+        if items:
+            since_token = encode_change_token((items[-1].updated_at, items[-1].id))
+        else:
+            since_token = request.query_params['since'] or latest_change
+        return Response(status=status.HTTP_200_OK, data={
+            'since': since_token,
+            'has_more': has_more,
+            'results': self.get_serializer(items, many=True).data,
+        })
 
     def perform_create(self, serializer):
         instance = serializer.save()
-        execute_test_run_request.delay(instance.id)
+        with trace_test_run('test_run.submit', instance.id, requested_by=instance.requested_by):
+            publish_status(instance)
+            schedule_test_run_request(instance)
+
+
+class TestRunRequestBulkAPIView(CreateAPIView):
+    serializer_class = TestRunRequestSerializer
 
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        instances = serializer.save()
+        publish_statuses(instances)
+        schedule_test_run_requests(instances)
+        return Response(status=status.HTTP_201_CREATED, data={'ids': [instance.id for instance in instances]})
 
-class TestRunRequestItemAPIView(RetrieveAPIView):
+
+class TestRunRequestItemAPIView(AsyncAPIViewMixin, RetrieveAPIView):
     serializer_class = TestRunRequestItemSerializer
     queryset = TestRunRequest.objects.all()
     lookup_field = 'pk'
 
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs['pk']
+        data = get_test_run_detail(int(pk)) if pk.isdigit() else None
+        if data is None:
+            raise Http404
+        return Response(status=status.HTTP_200_OK, data=data)
+
+
+class TestRunRequestCancelAPIView(GenericAPIView):
+    queryset = TestRunRequest.objects.all()
+    lookup_field = 'pk'
+
+    def post(self, request, *args, **kwargs):
+        instance = self.get_object()
+        if not cancel_test_run_request(instance):
+            return Response(status=status.HTTP_409_CONFLICT, data={
+                'detail': f'Tests are already done, with status {instance.status}.'
+            })
+        return Response(status=status.HTTP_202_ACCEPTED, data={'id': instance.id, 'status': instance.status})
+
+
+class TestRunRequestLogsAPIView(RetrieveAPIView):
+    queryset = TestRunRequest.objects.all()
+    lookup_field = 'pk'
+
+    def retrieve(self, request, *args, **kwargs):
+        query = TestRunRequestLogsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        instance = self.get_object()
+        offset, limit = query.validated_data['offset'], query.validated_data['limit']
+        logs = instance.read_logs(offset=offset, limit=limit)
+        return Response(status=status.HTTP_200_OK, data={
+            'id': instance.id,
+            'offset': offset,
+            'next_offset': offset + len(logs),
+            'log_size': instance.log_size,
+            'logs': logs,
+        })
+
 
-class AssetsAPIView(APIView):
+class TestRunLogSearchAPIView(APIView):
+
+    def get(self, request):
+        query = TestRunLogSearchQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return Response(status=status.HTTP_200_OK, data=search_logs(**query.validated_data))
+
+
+class TestRunStatsAPIView(APIView):
+
+    def get(self, request):
+        query = TestRunStatsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return Response(status=status.HTTP_200_OK, data=get_run_stats(**query.validated_data))
+
+
+class TestResultHistoryAPIView(ListAPIView):
+    serializer_class = TestResultSerializer
+    pagination_class = TestResultCursorPagination
+
+    def get_queryset(self):
+        query = TestResultHistoryQuerySerializer(data=self.request.query_params)
+        query.is_valid(raise_exception=True)
+        return TestResult.objects.filter(nodeid=query.validated_data['nodeid'])
+
+
+class TestResultSlowestAPIView(APIView):
+
+    def get(self, request):
+        query = TestResultStatsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return Response(status=status.HTTP_200_OK, data=get_slowest_tests(**query.validated_data))
+
+
+class TestResultFlakyAPIView(APIView):
+
+    def get(self, request):
+        query = TestResultStatsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return Response(status=status.HTTP_200_OK, data=get_flaky_tests(**query.validated_data))
+
+
+class AssetsAPIView(AsyncAPIViewMixin, APIView):
 
     def get(self, request):
         return Response(status=status.HTTP_200_OK, data=get_assets())
+
+
+async def test_run_events(request, pk=None):
+    """Server-sent events of all requests' status changes, or of one request's status and logs.
+
+    Reconnecting clients resume after the `Last-Event-ID` they got last.
+    """
+    if not settings.TEST_RUN_EVENTS_REDIS_URL:
+        return HttpResponse(status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    if pk is not None and not await TestRunRequest.objects.filter(pk=pk).aexists():
+        raise Http404
+    #  history of a single request is replayed, the global stream starts with new events
+    default_event_id = '$' if pk is None else '0'
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id') or default_event_id
+    if last_event_id != '$' and not re.fullmatch(r'\d+(-\d+)?', last_event_id):
+        return HttpResponse(status=status.HTTP_400_BAD_REQUEST)
+
+    response = StreamingHttpResponse(iter_events(get_stream_name(pk), last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def metrics(request):
+    """Metrics in the Prometheus text format, of all the processes if they are collected in Redis."""
+    values = get_metrics().collect()
+    for env, pool, count in get_queue_depths():
+        values['ionos_test_run_queue_depth', (('env', env or ''), ('pool', pool)), None] = count
+    return HttpResponse(render_metrics(values), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,317 @@
+"""Load test of the submission -> execution -> result pipeline, against a throwaway database.
+
+Clients submit requests with `POST /api/v1/test-run` and poll `GET /api/v1/test-run/<id>` until they are done, while
+worker threads execute the dispatched tasks from an in memory queue, like celery workers with an in memory broker.
+Everything runs in this process, through the Django test client, and the tests are stubs which only write a junit
+report. The database comes from the DB_* environment variables like the app, SQLite in a temporary file if unset,
+and the scheduler and the env free list use Redis if TEST_RUN_SCHEDULER_REDIS_URL / TEST_ENV_ALLOCATOR_REDIS_URL are.
+
+Usage: python benchmarks/pipeline.py [--requests 1000] [--clients 100] [--workers 8] [--repeat 1]
+    [--save-baseline | --check]
+"""
+import argparse
+import json
+import os
+import platform
+import queue
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ionos.settings')
+for name, value in {
+    'DB_ENGINE': 'django.db.backends.sqlite3',
+    'DB_NAME': 'benchmark',
+    'DB_DATABASE_USERNAME': '',
+    'DB_DATABASE_HOST': '',
+    'DB_DATABASE_PORT': '',
+    'DB_DATABASE_PASSWORD': '',
+}.items():
+    os.environ.setdefault(name, value)
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.db.backends.signals import connection_created  # noqa: E402
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment  # noqa: E402
+from django.urls import reverse  # noqa: E402
+
+from api.models import TestEnvironment, TestFilePath, TestRunRequest  # noqa: E402
+from api.scheduler import get_scheduler  # noqa: E402
+from api.tasks import execute_test_run_request  # noqa: E402
+
+
+DEFAULT_BASELINE = os.path.join(BASE_DIR, 'benchmarks', 'baselines', 'pipeline.json')
+STUB_PATHS = 20
+#  writes a junit report with a passing test per path, the paths are the arguments not starting with --
+STUB_TEST = '''
+import sys, time
+time.sleep(float(sys.argv[1]))
+paths = [arg for arg in sys.argv[2:] if not arg.startswith('--')]
+report = next(arg.split('=', 1)[1] for arg in sys.argv if arg.startswith('--junitxml='))
+with open(report, 'w') as f:
+    f.write('<testsuite>')
+    for path in paths:
+        print(f'{path}::test_stub PASSED')
+        f.write(f'<testcase classname="{path[:-3].replace("/", ".")}" name="test_stub" time="0.01"/>')
+    f.write('</testsuite>')
+'''
+#  metric -> whether higher is better, compared to the baseline by --check
+CHECKED_METRICS = {
+    'submit_latency_p95_ms': False,
+    'poll_latency_p95_ms': False,
+    'queue_wait_p95_s': False,
+    'queries_per_submit': False,
+    'queries_per_poll': False,
+    'queries_per_run': False,
+    'throughput_runs_per_s': True,
+}
+QUERY_METRICS = ('queries_per_submit', 'queries_per_poll', 'queries_per_run')
+
+
+def percentile(values: list, percent: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class Stats:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values = {}
+        self.errors = 0
+
+    def add(self, name: str, value: float) -> None:
+        with self._lock:
+            self.values.setdefault(name, []).append(value)
+
+    def add_error(self) -> None:
+        with self._lock:
+            self.errors += 1
+
+
+def share_sqlite_database(name: str) -> None:
+    """Lets the threads share a SQLite file: readers don't wait for the writer, and transactions take the write lock
+    when they begin, so that two of them can't both read and then deadlock upgrading to write."""
+    connection.settings_dict.setdefault('TEST', {})['NAME'] = name
+    connection.settings_dict.setdefault('OPTIONS', {})['timeout'] = 60
+
+    def set_wal_mode(sender, connection, **kwargs):
+        if connection.vendor == 'sqlite':
+            connection.cursor().execute('PRAGMA journal_mode=WAL')
+
+    connection_created.connect(set_wal_mode, weak=False)
+    SQLiteDatabaseWrapper._start_transaction_under_autocommit = lambda self: self.cursor().execute('BEGIN IMMEDIATE')
+
+
+def work(tasks: queue.Queue, stats: Stats) -> None:
+    try:
+        while (instance_id := tasks.get()) is not None:
+            try:
+                with CaptureQueriesContext(connection) as queries:
+                    execute_test_run_request(instance_id)
+                stats.add('run_queries', len(queries))
+            except Exception:
+                stats.add_error()
+    finally:
+        connection.close()
+
+
+def poll(client: Client, instance_id: int, poll_seconds: float, stats: Stats) -> None:
+    url = reverse('test_run_req_item', args=(instance_id, ))
+    while True:
+        started_at = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        stats.add('poll_latency', time.perf_counter() - started_at)
+        stats.add('poll_queries', len(queries))
+        if response.status_code != 200:
+            stats.add_error()
+            return
+        if response.json()['status'] in TestRunRequest.FINISHED_STATUSES:
+            return
+        time.sleep(poll_seconds)
+
+
+def submit_and_poll(requests: list, poll_seconds: float, stats: Stats) -> None:
+    client = Client()
+    try:
+        for data in requests:
+            try:
+                started_at = time.perf_counter()
+                with CaptureQueriesContext(connection) as queries:
+                    response = client.post(reverse('test_run_req'), data=data, content_type='application/json')
+                stats.add('submit_latency', time.perf_counter() - started_at)
+                stats.add('submit_queries', len(queries))
+                if response.status_code != 201:
+                    stats.add_error()
+                    continue
+                poll(client, response.json()['id'], poll_seconds, stats)
+            except Exception:
+                stats.add_error()
+    finally:
+        connection.close()
+
+
+def run(args) -> dict:
+    rng = random.Random(args.seed)
+    env_ids = list(TestEnvironment.objects.order_by('id').values_list('id', flat=True))
+    TestFilePath.objects.bulk_create([
+        TestFilePath(path=f'benchmark/test_stub_{index}.py') for index in range(STUB_PATHS)
+    ])
+    path_ids = list(TestFilePath.objects.filter(path__startswith='benchmark/').order_by('id').values_list(
+        'id', flat=True
+    ))
+    requests = [
+        {
+            'requested_by': f'client{index % args.clients}',
+            'env': rng.choice(env_ids),
+            'path': rng.sample(path_ids, rng.randint(1, 3)),
+        }
+        for index in range(args.requests)
+    ]
+
+    stats = Stats()
+    tasks = queue.Queue()
+    workers = [threading.Thread(target=work, args=(tasks, stats)) for _ in range(args.workers)]
+    clients = [
+        threading.Thread(target=submit_and_poll, args=(requests[index::args.clients], args.poll_seconds, stats))
+        for index in range(args.clients)
+    ]
+    started_at = time.perf_counter()
+    with patch.object(execute_test_run_request, 'apply_async', lambda args, **options: tasks.put(args[0])):
+        for thread in workers + clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        for _ in workers:
+            tasks.put(None)
+        for thread in workers:
+            thread.join()
+    wall_seconds = time.perf_counter() - started_at
+
+    finished = list(TestRunRequest.objects.filter(finished_at__isnull=False, started_at__isnull=False).values_list(
+        'created_at', 'started_at', 'finished_at'
+    ))
+    queue_waits = [(started - created).total_seconds() for created, started, _ in finished]
+    busy_seconds = sum((finished_at - started).total_seconds() for _, started, finished_at in finished)
+    return {
+        'runs': len(finished),
+        'errors': stats.errors + args.requests - len(finished),
+        'wall_seconds': round(wall_seconds, 2),
+        'throughput_runs_per_s': round(len(finished) / wall_seconds, 2),
+        'submit_latency_p50_ms': round(percentile(stats.values.get('submit_latency', []), 50) * 1000, 1),
+        'submit_latency_p95_ms': round(percentile(stats.values.get('submit_latency', []), 95) * 1000, 1),
+        'poll_latency_p50_ms': round(percentile(stats.values.get('poll_latency', []), 50) * 1000, 1),
+        'poll_latency_p95_ms': round(percentile(stats.values.get('poll_latency', []), 95) * 1000, 1),
+        'queue_wait_p50_s': round(percentile(queue_waits, 50), 3),
+        'queue_wait_p95_s': round(percentile(queue_waits, 95), 3),
+        'env_utilization': round(busy_seconds / (len(env_ids) * wall_seconds), 4),
+        'queries_per_submit': round(statistics.mean(stats.values.get('submit_queries', [0])), 2),
+        'queries_per_poll': round(statistics.mean(stats.values.get('poll_queries', [0])), 2),
+        'queries_per_run': round(statistics.mean(stats.values.get('run_queries', [0])), 2),
+    }
+
+
+def check(metrics: dict, params: dict, baseline_path: str, tolerance: float) -> bool:
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if baseline['params'] != params:
+        print(f'The baseline was measured with {baseline["params"]}, run with the same parameters to compare.')
+        return False
+    passed = True
+    for name, higher_is_better in CHECKED_METRICS.items():
+        expected, value = baseline['metrics'][name], metrics[name]
+        #  the number of queries doesn't depend on the machine, it gets a tighter bound
+        allowed = min(tolerance, 0.1) if name in QUERY_METRICS else tolerance
+        limit = expected * (1 - allowed) if higher_is_better else expected * (1 + allowed)
+        regressed = value < limit if higher_is_better else value > limit
+        print(f'{"REGRESSED" if regressed else "ok":>9} {name}: {value} (baseline {expected}, limit {limit:.2f})')
+        passed = passed and not regressed
+    if metrics['errors']:
+        print(f'REGRESSED errors: {metrics["errors"]}')
+        passed = False
+    return passed
+
+
+def measure(args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if connection.vendor == 'sqlite':
+            share_sqlite_database(os.path.join(tmp_dir, 'benchmark.sqlite3'))
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            get_scheduler().clear()
+            with override_settings(
+                TEST_BASE_CMD=[sys.executable, '-c', STUB_TEST, str(args.test_seconds)],
+                TEST_RUNNER_WARM_POOL=False,
+                TEST_RUN_EVENTS_REDIS_URL='',
+                TEST_RUN_SCHEDULER_SLOTS=args.workers,
+                TEST_RUN_DEFAULT_USER_MAX_RUNNING=args.workers,
+                TEST_DISCOVERY_INDEX_TESTS=False,
+            ):
+                return run(args)
+        finally:
+            get_scheduler().clear()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--clients', type=int, default=100, help='concurrent submitting and polling clients')
+    parser.add_argument('--workers', type=int, default=8, help='concurrent task executions, like celery workers')
+    parser.add_argument('--test-seconds', type=float, default=0.05, help='duration of each stub test run')
+    parser.add_argument('--poll-seconds', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--tolerance', type=float, default=0.3, help='allowed relative regression for --check')
+    parser.add_argument('--repeat', type=int, default=1, help='runs on a fresh database, the median is reported')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--save-baseline', action='store_true')
+    group.add_argument('--check', action='store_true', help='exits with 1 if a metric regressed from the baseline')
+    args = parser.parse_args()
+    params = {
+        'requests': args.requests,
+        'clients': args.clients,
+        'workers': args.workers,
+        'test_seconds': args.test_seconds,
+        'poll_seconds': args.poll_seconds,
+        'seed': args.seed,
+        'database': connection.vendor,
+    }
+
+    setup_test_environment()
+    runs = []
+    for index in range(args.repeat):
+        runs.append(measure(args))
+        if args.repeat > 1:
+            print(f'Run {index + 1}/{args.repeat}: {json.dumps(runs[-1])}')
+    #  a single run can be an outlier, e.g. slowed down by another process, the median of each metric is kept
+    metrics = {name: statistics.median_low(run[name] for run in runs) for name in runs[0]}
+
+    print(json.dumps({'params': params, 'metrics': metrics}, indent=2))
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            baseline = {'params': params, 'machine': platform.platform(), 'repeat': args.repeat, 'metrics': metrics}
+            json.dump(baseline, f, indent=2)
+            f.write('\n')
+        print(f'Saved the baseline to {args.baseline}')
+    elif args.check and not check(metrics, params, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Compares the fixed overhead of a test run in a new pytest process and in a forked warm process.
+
+Usage: python benchmarks/warm_runner.py [--runs 20]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.pool import WarmRunner  # noqa: E402
+
+
+PYTEST_ARGS = ['-q', '-p', 'no:cacheprovider', 'test_noop.py']
+
+
+def run_cold(cwd: str) -> float:
+    started_at = time.perf_counter()
+    subprocess.run([sys.executable, '-m', 'pytest'] + PYTEST_ARGS, cwd=cwd, stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - started_at
+
+
+def run_warm(runner: WarmRunner, cwd: str) -> float:
+    started_at = time.perf_counter()
+    process = runner.start(PYTEST_ARGS, cwd=cwd)
+    process.stdout.read()
+    process.stdout.close()
+    if process.wait() != 0:
+        raise RuntimeError('The warm run failed')
+    return time.perf_counter() - started_at
+
+
+def report(name: str, timings: list) -> None:
+    print(
+        f'{name}: median {statistics.median(timings) * 1000:.1f} ms, '
+        f'mean {statistics.mean(timings) * 1000:.1f} ms, max {max(timings) * 1000:.1f} ms'
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cwd:
+        with open(os.path.join(cwd, 'test_noop.py'), 'w') as f:
+            f.write('def test_noop():\n    pass\n')
+
+        cold = [run_cold(cwd) for _ in range(args.runs)]
+        runner = WarmRunner(max_runs=args.runs + 1, max_rss=2 ** 40, preload=['pytest'])
+        try:
+            runner.warm_up()
+            run_warm(runner, cwd)  # waits for the preload to finish
+            warm = [run_warm(runner, cwd) for _ in range(args.runs)]
+        finally:
+            runner.close()
+
+    report('new process', cold)
+    report('warm process', warm)
+    print(f'speedup: {statistics.median(cold) / statistics.median(warm):.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -20,6 +20,7 @@ class AddNewRequest extends Component {
                       <select className="form-control" name="env_id" id="env_id" placeholder="Environment ID"
                               value={this.props.env}  onChange={this.props.envChanged.bind(this)}>
                         <option value="" defaultValue></option>
+                        {this.props.assets.test_pools.map(pool => <option value={'pool:' + pool} key={'pool:' + pool}>{pool === '*' ? 'Any idle env' : 'Any idle env of ' + pool}</option>)}
                         {this.props.assets.test_envs.map(item => <option value={item.id} key={item.id}>{item.name}</option>)}
                       </select>
                              <p className="error-message">{this.props.envError}</p>
@@ -11,11 +11,14 @@ class TestItemDetails extends Component {
      } else if (this.props.currentItem.status === "RUNNING" || this.props.currentItem.status === "CREATED") {
          className = 'running'
      }
+     const cancellable = ["CREATED", "RETRYING", "RUNNING"].includes(this.props.currentItem.status)
     return (
         <Aux>
             <div className="row">
               <div className="col-md-12">
                 <a className="btn btn-primary float-right" href="#" onClick={this.props.backClicked.bind(this)}>Back</a>
+                {cancellable &&
+                  <a className="btn btn-danger float-right mr-2" href="#" onClick={this.props.cancelClicked.bind(this)}>Cancel</a>}
               </div>
             </div>
             <div className="row">
@@ -11,7 +11,7 @@ import AddNewTest from "../../components/AddNewTest/AddNewTest";
 
 class IONOSTestExecutor extends Component {
   state = {
-    assets: {test_envs: [], available_paths: [], upload_dirs: []},
+    assets: {test_envs: [], test_pools: [], available_paths: [], upload_dirs: []},
     error: false,
     items: [],
     detailsView: false,
@@ -25,7 +25,9 @@ class IONOSTestExecutor extends Component {
     testPath: [],
   };
 
-  interval = null
+  events = null
+  itemEvents = null
+  since = null
 
   componentDidMount () {
     axios.get('assets').then(response => {
@@ -34,11 +36,14 @@ class IONOSTestExecutor extends Component {
       this.setState({error: true})
     })
 
-    this.interval = setInterval(this.refreshList, 1000);
+    // the list is refreshed whenever the status of a request changes, instead of polling it
+    this.events = new EventSource(axios.defaults.baseURL + 'test-run/events');
+    this.events.addEventListener('status', this.refreshList)
     this.refreshList()
   }
   componentWillUnmount() {
-    clearInterval(this.interval);
+    this.events.close();
+    this.closeItemEvents();
   }
 
   getDisplayPath = (path) => {
@@ -52,25 +57,35 @@ class IONOSTestExecutor extends Component {
   }
 
   refreshList = () => {
-    axios.get('test-run').then(response => {
-      let data = response.data;
-      this.setState({items: data.map(item => { return {displayPath: this.getDisplayPath(item.path), ...item}})})
+    // after the first page is loaded, only the requests changed since the last poll are fetched
+    const params = this.since === null ? {} : {since: this.since}
+    axios.get('test-run', {params: params}).then(response => {
+      let data = response.data.results.map(item => { return {displayPath: this.getDisplayPath(item.path), ...item}});
+      if (this.since !== null) {
+        const changedIds = data.map(item => item.id)
+        data = data.concat(this.state.items.filter(item => !changedIds.includes(item.id)))
+        data.sort((a, b) => b.id - a.id)
+      }
+      this.since = response.data.since
+      this.setState({items: data})
     }).catch(error => {
       this.setState({error: true})
     })
     if (this.state.itemID !== null){
-      this.viewItemDetails(this.state.itemID)
+      this.loadItemDetails(this.state.itemID)
     }
   }
 
   submitTest = () => {
-    axios.post('test-run', {requested_by: this.state.requester, env: this.state.env, path: this.state.testPath}).then(response => {
+    const pool = this.state.env.startsWith('pool:') ? this.state.env.slice('pool:'.length) : ''
+    const env = pool ? null : this.state.env
+    axios.post('test-run', {requested_by: this.state.requester, env: env, pool: pool, path: this.state.testPath}).then(response => {
       this.setState({requester: '', env: '', testPath: ''})
         this.refreshList()
       }).catch(error => {
         this.setState({
           requesterError: error.data.requested_by,
-          envError: error.data.env,
+          envError: error.data.env || error.data.pool,
           testPathError: error.data.path,
         })
       })
@@ -96,7 +111,7 @@ class IONOSTestExecutor extends Component {
       })
   }
 
-  viewItemDetails = (itemId) => {
+  loadItemDetails = (itemId) => {
       axios.get('test-run/' + itemId).then(response => {
         let data = response.data
         data.displayPath = this.getDisplayPath(response.data.path)
@@ -104,13 +119,47 @@ class IONOSTestExecutor extends Component {
       }).catch(error => {
         this.setState({error: true})
       })
+  };
+
+  appendItemLogs = (event) => {
+    const data = JSON.parse(event.data)
+    const item = this.state.currentItem
+    // events replayed after a (re)connect may already be part of the loaded logs
+    if (item.id !== data.id || item.logs === undefined || data.offset !== item.logs_offset + item.logs.length) {
+      return
+    }
+    this.setState({currentItem: {...item, logs: item.logs + data.logs}})
+  };
+
+  closeItemEvents = () => {
+    if (this.itemEvents !== null) {
+      this.itemEvents.close()
+      this.itemEvents = null
+    }
+  };
+
+  viewItemDetails = (itemId) => {
+    this.loadItemDetails(itemId)
+    this.closeItemEvents()
+    this.itemEvents = new EventSource(axios.defaults.baseURL + 'test-run/' + itemId + '/events')
+    this.itemEvents.addEventListener('logs', this.appendItemLogs)
     this.setState({
       detailsView: true,
       itemID: itemId
     })
   };
 
+  cancelItem = () => {
+    const item = this.state.currentItem
+    axios.post('test-run/' + item.id + '/cancel').then(response => {
+      this.setState({currentItem: {...this.state.currentItem, status: response.data.status}})
+    }).catch(error => {
+      this.loadItemDetails(item.id)
+    })
+  };
+
   backToListItems = () => {
+    this.closeItemEvents()
     this.setState({
       detailsView: false,
       itemID: null
@@ -131,7 +180,11 @@ class IONOSTestExecutor extends Component {
   render () {
     if (this.state.detailsView) {
       return (
-          <TestItemDetails currentItem={this.state.currentItem} backClicked={this.backToListItems}></TestItemDetails>
+          <TestItemDetails
+              currentItem={this.state.currentItem}
+              backClicked={this.backToListItems}
+              cancelClicked={this.cancelItem}>
+          </TestItemDetails>
       )
     }
     return (
@@ -14,3 +14,11 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ionos.settings')
 
 application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+
+from api.db import start_db_pool  # noqa: E402
+from api.scheduler import check_scheduler  # noqa: E402
+
+check_scheduler()
+start_db_pool(settings.DB_POOL_SIZE)
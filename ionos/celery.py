@@ -1,5 +1,9 @@
 import os
+import time
 from celery import Celery
+from celery.signals import (
+    celeryd_after_setup, task_postrun, task_prerun, worker_init, worker_process_init, worker_ready, worker_shutdown
+)
 
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ionos.settings')
@@ -7,6 +11,64 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ionos.settings')
 app = Celery('ionos')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
+#  task id -> time.perf_counter() when it started
+_task_started_at = {}
+_worker_concurrency = None
+
+
+@worker_init.connect
+def check_worker_settings(**_):
+    from api.scheduler import check_scheduler
+    check_scheduler()
+
+
+@worker_process_init.connect
+def warm_up_test_runner(**_):
+    from django.conf import settings
+    if settings.TEST_RUNNER_WARM_POOL:
+        from api.pool import get_warm_runner
+        get_warm_runner().warm_up()
+
+
+@celeryd_after_setup.connect
+def consume_node_queue(sender, instance, **_):
+    from django.conf import settings
+    global _worker_concurrency
+    if settings.TEST_WORKER_NODE:
+        from api.models import WorkerNode
+        instance.app.amqp.queues.select_add(WorkerNode(name=settings.TEST_WORKER_NODE).get_queue())
+        _worker_concurrency = instance.concurrency
+
+
+@worker_ready.connect
+def start_node_agent(**_):
+    if _worker_concurrency is not None:
+        from api.agent import start_agent
+        start_agent(_worker_concurrency)
+
+
+@worker_shutdown.connect
+def stop_node_agent(**_):
+    if _worker_concurrency is not None:
+        from api.agent import stop_agent
+        stop_agent()
+
+
+@task_prerun.connect
+def start_task_timer(task_id=None, **_):
+    _task_started_at[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def record_task_duration(task_id=None, task=None, state=None, **_):
+    started_at = _task_started_at.pop(task_id, None)
+    if started_at is None:
+        return
+    from api.metrics import get_metrics
+    metrics = get_metrics()
+    metrics.observe_since('ionos_celery_task_seconds', started_at, task=task.name, state=state or '')
+    #  an idle worker doesn't flush on its own
+    metrics.flush()
 
 
 @app.task(bind=True)
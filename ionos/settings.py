@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -86,7 +87,24 @@ DATABASES = {
         'USER': os.environ["DB_DATABASE_USERNAME"],
         'HOST': os.environ["DB_DATABASE_HOST"],
         'PORT': os.environ["DB_DATABASE_PORT"],
-        'PASSWORD': os.environ["DB_DATABASE_PASSWORD"]
+        'PASSWORD': os.environ["DB_DATABASE_PASSWORD"],
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        #  the shards of a parallel test run each create their own test database, like the pytest-xdist workers
+        'TEST': {
+            'NAME': f"test_{os.environ['DB_NAME']}_shard{os.environ['TEST_RUN_SHARD']}"
+            if os.environ.get('TEST_RUN_SHARD') else None,
+        },
+    }
+}
+#  threads, and connections, of each ASGI process running the database work of the async views, see api.db
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
     }
 }
 
@@ -136,18 +154,121 @@ STATICFILES_DIRS = (
     os.path.join(BASE_DIR, 'frontend', "build", "static"),
 )
 
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+    #  cold store of the logs of old runs, any storage backend works, e.g. an object store one
+    'test_run_logs': {
+        'BACKEND': os.environ.get('TEST_RUN_LOG_STORAGE_BACKEND', 'django.core.files.storage.FileSystemStorage'),
+        'OPTIONS': {
+            'location': os.environ.get('TEST_RUN_LOG_STORAGE_LOCATION', os.path.join(BASE_DIR, 'var', 'test-run-logs')),
+        },
+    },
+}
+
 # CELERY SETTINGS
 CELERY_BROKER_URL = 'redis://redis:6379'
 CELERY_RESULT_BACKEND = 'redis://redis:6379'
 CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
+CELERY_TASK_ALWAYS_EAGER = os.environ.get('CELERY_TASK_ALWAYS_EAGER', '') == '1'  # tasks run in the caller
 
 TEST_BASE_DIRS = [
     os.path.join(BASE_DIR, 'sample-tests'),
     os.path.join(BASE_DIR, 'api/tests'),
 ]
-TEST_RUN_REQUEST_TIMEOUT_SECONDS = 60 * 60 * 30  # 30 Minutes
+TEST_RUN_REQUEST_TIMEOUT_SECONDS = 60 * 30  # 30 Minutes, unless set per request
+TEST_RUN_MAX_TIMEOUT_SECONDS = 60 * 60 * 6
+TEST_RUN_KILL_GRACE_SECONDS = 5  # between asking a stopped run to terminate and killing it
+TEST_RUN_CANCEL_CHECK_SECONDS = 1
 TEST_BASE_CMD = ['pytest', '-v']
+TEST_ENV_LEASE_SECONDS = 60
+TEST_ENV_LEASE_HEARTBEAT_SECONDS = 10
+TEST_RUN_LOG_FLUSH_SIZE = 64 * 1024
+TEST_RUN_LOG_FLUSH_SECONDS = 1
+TEST_RUN_LOG_READ_LIMIT = 1024 * 1024
+TEST_RUN_MAX_PARALLELISM = os.cpu_count() or 1
+TEST_DURATION_SMOOTHING = 0.3
+TEST_RESULTS_BATCH_SIZE = 500
+TEST_RESULT_CACHE_TTL_SECONDS = 60 * 60 * 24
+TEST_RESULT_CACHE_MAX_ENTRIES = 10000
+TEST_RESULT_MAX_MESSAGE_LENGTH = 4096
+
+TEST_RUN_EVENTS_REDIS_URL = os.environ.get('TEST_RUN_EVENTS_REDIS_URL', '')
+TEST_RUN_EVENTS_MAX_LENGTH = 10000
+TEST_RUN_EVENTS_TTL_SECONDS = 60 * 60 * 24
+TEST_RUN_EVENTS_KEEPALIVE_SECONDS = 15
+
+TEST_RUN_MAX_PRIORITY = 10
+TEST_RUN_BULK_MAX_SIZE = 1000
+TEST_ENV_ALLOCATOR_REDIS_URL = os.environ.get('TEST_ENV_ALLOCATOR_REDIS_URL', '')  # in process free list if empty
+TEST_ENV_ALLOCATOR_SCAN_SIZE = 10  # idle envs tried from the database when the free list is empty
+#  in process scheduler if empty, only for the tests and eager tasks, the web and worker processes refuse to start
+TEST_RUN_SCHEDULER_REDIS_URL = os.environ.get('TEST_RUN_SCHEDULER_REDIS_URL', '')
+TEST_RUN_SCHEDULER_SLOTS = int(os.environ.get('TEST_RUN_SCHEDULER_SLOTS', 8))  # requests dispatched at once
+TEST_RUN_SCHEDULER_LOCK_SECONDS = 10
+TEST_RUN_DEFAULT_USER_MAX_RUNNING = 4
+TEST_RUN_USER_MAX_RUNNING = {}  # requested_by -> max running requests, overrides the default
+TEST_RUN_USER_WEIGHTS = {}  # requested_by -> share of the dispatches, 1 by default
+TEST_RUNNER_WARM_POOL = os.environ.get('TEST_RUNNER_WARM_POOL', '') == '1'  # fork runs from a pre-imported pytest
+TEST_RUNNER_WARM_MAX_RUNS = 100
+TEST_RUNNER_WARM_MAX_RSS = 512 * 1024 * 1024
+TEST_RUNNER_WARM_PRELOAD = ['pytest', 'django.test', 'rest_framework']
+TEST_DISCOVERY_INTERVAL_SECONDS = 10
+TEST_DISCOVERY_INDEX_TESTS = True
+ASSETS_CACHE_SECONDS = 60 * 60
+TEST_RUN_DETAIL_CACHE_FINISHED_SECONDS = 60 * 60 * 24 * 7  # finished requests never change
+TEST_RUN_DETAIL_CACHE_UNFINISHED_SECONDS = 60  # invalidated on every update anyway
+TEST_RUN_DETAIL_CACHE_MAX_LOG_SIZE = 256 * 1024  # larger requests are read from the database every time
+RESPONSE_CACHE_LOCK_SECONDS = 5  # readers of a missing entry wait that long for the one computing it
+RESPONSE_CACHE_WAIT_SECONDS = 0.05
+TEST_RUN_LOG_COMPRESSION_LEVEL = 6
+TEST_RUN_LOG_COMPRESS_AFTER_SECONDS = 60 * 5  # after the run finished, logs are compressed in the database
+TEST_RUN_LOG_ARCHIVE_AFTER_SECONDS = 60 * 60 * 24 * 7  # then moved to the `test_run_logs` storage
+TEST_RUN_LOG_RETENTION_SECONDS = 60 * 60 * 24 * 90  # then deleted
+TEST_RUN_LOG_RETENTION_BATCH_SIZE = 100
+TEST_RUN_LOG_RETENTION_INTERVAL_SECONDS = 60
+TEST_RUN_LOG_SEARCH_MATCHES_PER_RUN = 3
+TEST_RUN_LOG_SEARCH_CONTEXT_CHARS = 80  # of the line around a match, on each side
+TEST_RUN_LOG_SEARCH_MAX_RESULTS = 100
+#  only the lines of the compressed logs matching it stay searchable, up to TEST_RUN_LOG_SEARCH_MAX_CHARS per run
+TEST_RUN_LOG_SEARCH_PATTERN = os.environ.get(
+    'TEST_RUN_LOG_SEARCH_PATTERN', r'^E |FAILED|ERROR|Error|Exception|Traceback'
+)
+TEST_RUN_LOG_SEARCH_MAX_CHARS = 16 * 1024
+TEST_RUN_METRICS_REDIS_URL = os.environ.get('TEST_RUN_METRICS_REDIS_URL', '')  # metrics of this process only if empty
+TEST_RUN_METRICS_FLUSH_SECONDS = 5
+TEST_RUN_TRACING = os.environ.get('TEST_RUN_TRACING', '') == '1'  # spans of the runs, needs opentelemetry
+TEST_RUN_NODE_ROUTING = os.environ.get('TEST_RUN_NODE_ROUTING', '') == '1'  # send runs to the queue of their node
+TEST_WORKER_NODE = os.environ.get('TEST_WORKER_NODE', '')  # name of the node of this worker, if it runs as one
+#  names of the envs the node can host, all of them if empty
+TEST_WORKER_NODE_ENVS = [name for name in os.environ.get('TEST_WORKER_NODE_ENVS', '').split(',') if name]
+TEST_WORKER_NODE_CAPACITY = int(os.environ.get('TEST_WORKER_NODE_CAPACITY', 0))  # concurrency of the worker if 0
+TEST_WORKER_NODE_HEARTBEAT_SECONDS = 10
+TEST_WORKER_NODE_TIMEOUT_SECONDS = 30  # without heartbeat, the node is dead and its envs are assigned to others
+
+CELERY_BEAT_SCHEDULE = {
+    'reap-expired-env-leases': {
+        'task': 'api.tasks.reap_expired_env_leases',
+        'schedule': TEST_ENV_LEASE_SECONDS / 2,
+    },
+    'discover-test-files': {
+        'task': 'api.tasks.discover_test_files',
+        'schedule': TEST_DISCOVERY_INTERVAL_SECONDS,
+    },
+    'reap-dead-worker-nodes': {
+        'task': 'api.tasks.reap_dead_worker_nodes',
+        'schedule': TEST_WORKER_NODE_HEARTBEAT_SECONDS,
+    },
+    'apply-log-retention': {
+        'task': 'api.tasks.apply_log_retention',
+        'schedule': TEST_RUN_LOG_RETENTION_INTERVAL_SECONDS,
+    },
+}
 
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
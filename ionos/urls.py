@@ -15,9 +15,11 @@ Including another URLconf
 """
 from django.urls import path, include
 
+from api.views import metrics
 from core.views import index
 
 urlpatterns = [
     path('api/v1/', include('api.urls')),
+    path('metrics', metrics, name='metrics'),
     path('', index, name="index"),
 ]
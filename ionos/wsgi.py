@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ionos.settings')
 
 application = get_wsgi_application()
+
+from api.scheduler import check_scheduler  # noqa: E402
+
+check_scheduler()